@@ -0,0 +1,59 @@
+"""
+Benchmark of alert rules: time spent evaluating rules per tick.
+
+Rules (a threshold, a zero check with several intervals, and a deviation
+from baseline) are evaluated on metric batches of many channels, a few of
+which match.
+
+Usage: python benchmarks/bench_alert.py [CHANNELS] [ROUNDS]
+"""
+from mcstat.alert import Alerts, parse_rule
+from mcstat.domain import MetricBatch
+
+import random
+import time
+
+RULES = ["low bitrate < 2000 for 3",
+         "no_packets packets = 0 for 2",
+         "unstable bitrate deviates 20 for 5 baseline 10",
+         "errors cc_errors > 0"]
+
+# Budget: share of the interval (1 second) spent per tick.
+BUDGET = 0.01
+
+
+class NullQueue(object):
+    def put_nowait(self, event):
+        pass
+
+
+def make_batch(now, channels):
+    # About 1% of channels are low, or have errors.
+    bitrate = [random.choice((5000.0,) * 99 + (1000.0,)) for _ in channels]
+    return MetricBatch(now, 1, channels, bitrate,
+                       [b / 10.528 for b in bitrate],
+                       [{'cc_errors': random.choice((0,) * 99 + (1,))}
+                        for _ in channels])
+
+
+def main(channels=5000, rounds=100):
+    channels = tuple(('239.{}.{}.{}'.format(i >> 16, (i >> 8) & 255,
+                                            i & 255), 1234)
+                     for i in range(int(channels)))
+    rounds = int(rounds)
+    batches = [make_batch(now, channels) for now in range(rounds)]
+    alerts = Alerts([parse_rule(rule) for rule in RULES], [NullQueue()])
+    start = time.time()
+    for batch in batches:
+        alerts.put_nowait(batch)
+    spent = (time.time() - start) / rounds
+    pairs = len(channels) * len(RULES)
+    print("{} channel x rule pairs: {:.2f} ms/tick, {:.2f} us/pair".format(
+        pairs, spent * 1e3, spent * 1e6 / pairs))
+    print("Budget {:.0f}% of 1 s interval: {}".format(
+        BUDGET * 100, "OK" if spent <= BUDGET else "EXCEEDED"))
+
+
+if __name__ == '__main__':
+    import sys
+    main(*sys.argv[1:])
@@ -0,0 +1,263 @@
+"""
+End-to-end benchmark: multicast traffic generated on this host at
+controlled rates is received by the whole pipeline (receiver -> worker ->
+output) of an engine.
+
+Reports sustained packets/s, CPU time per packet (of mcstat, without
+senders), high-water marks of the worker queue and the output queue, and
+accuracy of reported packets and bytes compared to sent ones. A run, in
+which a queue overflowed, is marked as such (the receiver or the worker
+stops then).
+
+Usage: python benchmarks/bench_pipeline.py --help
+
+Example, comparing engines:
+
+  python benchmarks/bench_pipeline.py --engines queue,batch,counters \\
+      --channels 50 --rates 20000,50000,100000
+
+The asyncio engine (Python 3.4+) has no worker queue, its high-water mark
+is 0.
+"""
+from mcstat.config import Config, Main, default_config, merge_configs
+from mcstat.health import MonitoredQueue
+from mcstat.main import make_pipeline
+
+import argparse
+import multiprocessing
+import os
+import resource
+import socket
+import threading
+import time
+
+try:
+    # Python 2
+    from Queue import Full
+except ImportError:
+    # Python 3
+    from queue import Full
+
+# Engine specification -> (engine, receiver_mode).
+ENGINES = {
+    'queue': ('queue', 'simple'),
+    'batch': ('queue', 'batch'),
+    'counters': ('counters', 'simple'),
+    'sharded': ('sharded', 'simple'),
+    'asyncio': ('asyncio', 'simple'),
+    }
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+class HighWaterQueue(MonitoredQueue):
+    """Queue, which records its maximum size and overflows."""
+    def __init__(self, maxsize=1000):
+        MonitoredQueue.__init__(self, maxsize)
+        self.overflows = 0
+
+    def put_nowait(self, item):
+        try:
+            MonitoredQueue.put_nowait(self, item)
+        except Full:
+            self.overflows += 1
+            raise
+
+
+def channel_list(group, port, count):
+    """:return: count channels with consecutive addresses from group."""
+    first = sum(int(byte) << (8 * (3 - i))
+                for i, byte in enumerate(group.split('.')))
+    return [('.'.join(str((first + i) >> shift & 0xff)
+                      for shift in (24, 16, 8, 0)), port)
+            for i in range(count)]
+
+
+def sender(channels, rate, duration, size, interface, results):
+    """
+    Sends datagrams round-robin to channels, at rate (datagrams/s) in
+    total. Puts numbers of sent datagrams of channels to results.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    # Datagrams don't leave this host.
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 0)
+    if interface:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                        socket.inet_aton(interface))
+    payload = b'\x47' * size
+    sent = [0] * len(channels)
+    total = 0
+    # At most 1 ms of datagrams at once.
+    burst = max(rate // 1000, 1)
+    start = time.time()
+    while True:
+        elapsed = time.time() - start
+        if elapsed >= duration:
+            break
+        due = min(int(rate * elapsed) - total, burst)
+        if due <= 0:
+            time.sleep(0.0005)
+            continue
+        for _ in range(due):
+            i = total % len(channels)
+            sock.sendto(payload, channels[i])
+            sent[i] += 1
+            total += 1
+    results.put((sent, time.time() - start))
+
+
+def cpu_time(exclude=()):
+    """
+    :return: CPU time (in seconds) of this process and its children, except
+    exclude (pids).
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    total = usage.ru_utime + usage.ru_stime
+    for child in multiprocessing.active_children():
+        if child.pid in exclude:
+            continue
+        try:
+            with open('/proc/{}/stat'.format(child.pid)) as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except IOError:
+            continue
+        # utime and stime (fields 14 and 15).
+        total += (int(fields[11]) + int(fields[12])) / float(CLOCK_TICKS)
+    return total
+
+
+def collect(queue, totals):
+    """Sums packets and bytes reported in metrics of channels."""
+    while True:
+        event = queue.get()
+        if event.is_term():
+            break
+        elif event.is_batch():
+            # Rates are per measured interval.
+            elapsed = event.elapsed
+            for channel, bitrate, rate, _ in event.rows():
+                packets, num_bytes = totals.get(channel, (0, 0))
+                totals[channel] = (packets + rate * elapsed,
+                                   num_bytes + bitrate * 1024 / 8 * elapsed)
+
+
+def run(spec, channels, rate, args):
+    """:return: Dictionary with results."""
+    engine, receiver_mode = ENGINES[spec]
+    main_config = merge_configs(
+        Config(main=Main(channels=tuple(channels), engine=engine,
+                         receiver_mode=receiver_mode,
+                         processes=args.processes)),
+        default_config()).main
+    interval = main_config.interval
+
+    wake_up_fd, term_fd = os.pipe()
+    queue = HighWaterQueue()
+    output = HighWaterQueue()
+    totals = {}
+    collector = threading.Thread(target=collect, args=(output, totals))
+    threads, _ = make_pipeline(main_config, channels, wake_up_fd, [output],
+                               queue)
+    # Threads, which end on Term (not ping).
+    ending = [thread for thread in threads + [collector]
+              if not thread.daemon]
+    for thread in threads + [collector]:
+        # After an overflow, Term doesn't reach all threads.
+        thread.daemon = True
+        thread.start()
+    # Sockets join groups.
+    time.sleep(1)
+
+    results = multiprocessing.Queue()
+    senders = [multiprocessing.Process(
+        target=sender,
+        args=(channels[i::args.senders], rate // args.senders, args.duration,
+              args.size, args.interface, results))
+        for i in range(min(args.senders, len(channels)))]
+    cpu_start = cpu_time()
+    for process in senders:
+        process.start()
+    sent = 0
+    elapsed = 0.0
+    for _ in senders:
+        counts, seconds = results.get()
+        sent += sum(counts)
+        elapsed = max(elapsed, seconds)
+    for process in senders:
+        process.join()
+    # The last datagrams are reported on the next tick.
+    time.sleep(interval + 0.5)
+    cpu = cpu_time(exclude={process.pid for process in senders}) - cpu_start
+
+    os.write(term_fd, b'x')
+    for thread in ending:
+        thread.join(5)
+    os.close(wake_up_fd)
+    os.close(term_fd)
+
+    packets = sum(p for p, _ in totals.values())
+    num_bytes = sum(b for _, b in totals.values())
+    return {'engine': spec,
+            'rate': rate,
+            'sent': sent,
+            'pps': packets / elapsed if elapsed else 0,
+            'cpu_us': cpu / packets * 1e6 if packets else 0,
+            'queue_high': queue.high,
+            'output_high': output.high,
+            'packets_pct': 100.0 * packets / sent if sent else 0,
+            'bytes_pct': 100.0 * num_bytes / (sent * args.size)
+            if sent else 0,
+            'overflow': queue.overflows or output.overflows}
+
+
+def commandline_parser():
+    parser = argparse.ArgumentParser(
+        description="End-to-end throughput benchmark of mcstat.")
+    parser.add_argument("--engines", default='queue,batch,counters',
+                        help="Comma separated engines, any of: " +
+                        ", ".join(sorted(ENGINES)) +
+                        " (default: %(default)s).")
+    parser.add_argument("--channels", type=int, default=10,
+                        help="Number of channels (default: %(default)s).")
+    parser.add_argument("--rates", default='10000,50000',
+                        help="Comma separated total rates in datagrams/s "
+                        "(default: %(default)s).")
+    parser.add_argument("--duration", type=float, default=5,
+                        help="Seconds of sending (default: %(default)s).")
+    parser.add_argument("--size", type=int, default=1316,
+                        help="Size of datagrams (default: %(default)s).")
+    parser.add_argument("--senders", type=int, default=1,
+                        help="Sending processes (default: %(default)s).")
+    parser.add_argument("--processes", type=int,
+                        help="Processes of the sharded engine "
+                        "(default: number of CPUs).")
+    parser.add_argument("--group", default='239.255.0.1',
+                        help="Address of the first channel "
+                        "(default: %(default)s).")
+    parser.add_argument("--port", type=int, default=5000,
+                        help="Port of channels (default: %(default)s).")
+    parser.add_argument("--interface",
+                        help="Address of interface, which sends multicast "
+                        "(default: chosen by routing).")
+    return parser
+
+
+def main():
+    args = commandline_parser().parse_args()
+    channels = channel_list(args.group, args.port, args.channels)
+    header = ("{:<9} {:>8} {:>9} {:>9} {:>8} {:>7} {:>7} {:>8} {:>8}  {}"
+              .format('engine', 'rate', 'sent', 'pps', 'cpu us', 'queue',
+                      'output', 'packets', 'bytes', ''))
+    print(header)
+    for rate in [int(rate) for rate in args.rates.split(',')]:
+        for spec in args.engines.split(','):
+            r = run(spec, channels, rate, args)
+            print("{engine:<9} {rate:>8} {sent:>9} {pps:>9.0f} {cpu_us:>8.2f} "
+                  "{queue_high:>7} {output_high:>7} {packets_pct:>7.2f}% "
+                  "{bytes_pct:>7.2f}%  {0}".format(
+                      'OVERFLOW' if r['overflow'] else '', **r))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Benchmark of RTP analyzer: cost per datagram compared to receiving it.
+
+Datagrams are received from a local socket pair, like in receivers with
+read_payload, with and without the RTP analyzer.
+
+Usage: python benchmarks/bench_rtp.py [ROUNDS]
+"""
+from mcstat.analyzer.rtp import RtpAnalyzer
+from mcstat.core import drain_payload, payload_buffer_size
+
+import socket
+import struct
+import time
+
+# Datagrams sent before draining the socket.
+BATCH = 64
+
+# Budget of RTP analyzer: extra time per datagram.
+BUDGET = 1.5e-6
+
+
+def make_datagrams(first_seq):
+    return [struct.pack(">BBHII", 0x80, 33, seq & 0xffff,
+                        (seq * 900) & 0xffffffff, 1) + b'\x47' * 1316
+            for seq in range(first_seq, first_seq + BATCH)]
+
+
+def run(rounds, analyzer=None):
+    sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    receiver.setblocking(0)
+    buffer = bytearray(payload_buffer_size)
+    spent = 0.0
+    for i in range(rounds):
+        for datagram in make_datagrams(i * BATCH):
+            sender.send(datagram)
+        start = time.time()
+        aggr, views = drain_payload(receiver, buffer)
+        if analyzer is not None:
+            analyzer.feed(views, [start] * len(views))
+        spent += time.time() - start
+    return spent / (rounds * BATCH)
+
+
+def main(rounds=2000):
+    rounds = int(rounds)
+    base = run(rounds)
+    with_rtp = run(rounds, RtpAnalyzer())
+    print("Receive only:      {:.2f} us/datagram".format(base * 1e6))
+    print("Receive with RTP:  {:.2f} us/datagram".format(with_rtp * 1e6))
+    print("Max packet rate reduced by {:.0f}%".format(
+        100 * (1 - base / with_rtp)))
+    print("Budget {:.2f} us/datagram: {}".format(
+        BUDGET * 1e6, "OK" if with_rtp - base <= BUDGET else "EXCEEDED"))
+
+
+if __name__ == '__main__':
+    import sys
+    main(*sys.argv[1:])
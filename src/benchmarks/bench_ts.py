@@ -0,0 +1,53 @@
+"""
+Benchmark of MPEG-TS analyzer: sustained throughput on one core.
+
+Usage: python benchmarks/bench_ts.py [SECONDS]
+"""
+from mcstat.analyzer.ts import TsAnalyzer, TS_PACKET_SIZE
+
+import struct
+import sys
+import time
+
+# Datagrams read from one socket at once, and TS packets per datagram.
+BATCH = 64
+PACKETS_PER_DATAGRAM = 7
+
+
+def ts_packet(pid, cc):
+    header = struct.pack(">BHB", 0x47, 0x4000 | pid, 0x10 | cc)
+    return header + b'\xff' * (TS_PACKET_SIZE - len(header))
+
+
+def make_batch(pids=(0x100, 0x101, 0x102, 0x1fff)):
+    """Makes datagrams with interleaved PIDs and continuous CC."""
+    cc = dict.fromkeys(pids, 0)
+    datagrams = []
+    for i in range(BATCH):
+        packets = []
+        for j in range(PACKETS_PER_DATAGRAM):
+            pid = pids[(i * PACKETS_PER_DATAGRAM + j) % len(pids)]
+            packets.append(ts_packet(pid, cc[pid]))
+            cc[pid] = (cc[pid] + 1) % 16
+        datagrams.append(memoryview(b''.join(packets)))
+    return datagrams
+
+
+def main(seconds=3.0):
+    analyzer = TsAnalyzer()
+    datagrams = make_batch()
+    batches = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        analyzer.feed(datagrams)
+        batches += 1
+    elapsed = time.time() - start
+    packets = batches * BATCH * PACKETS_PER_DATAGRAM
+    print("TS packets/s:  {:,.0f}".format(packets / elapsed))
+    print("Datagrams/s:   {:,.0f}".format(batches * BATCH / elapsed))
+    print("Mbit/s:        {:,.1f}".format(
+        packets * TS_PACKET_SIZE * 8 / elapsed / 1e6))
+
+
+if __name__ == '__main__':
+    main(*[float(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,320 @@
+"""
+Alerts: rules evaluated on metrics of channels every interval.
+
+An alert of a rule is raised for a channel, when the rule's condition holds
+in N consecutive intervals, and cleared, when it no longer holds. Rules
+compare a field of metrics (bitrate, packets, or an extra field like
+cc_errors or drops) with a value, or with its rolling baseline.
+
+State of a rule is a few numbers per channel, updated once per interval.
+Conditions of rules for all channels are tested column by column (see
+MetricBatch), only channels, whose condition holds (or held), are handled
+one by one.
+"""
+from mcstat.domain import Alert
+from mcstat.net import is_multicast
+
+import collections
+import itertools
+import logging
+import numbers
+import operator
+import threading
+import time
+
+log = logging.getLogger('mcstat.alert')
+
+# Alert rule.
+# name: Name of the rule (and its alerts).
+# field: Field of metrics: bitrate, packets or an extra field.
+# op: '<', '>' or '=' (compared with value), or 'deviates' (differs from the
+#     baseline by more than value percent).
+# intervals: Number of consecutive intervals, in which the condition must
+#            hold.
+# baseline: Number of intervals of the rolling baseline (exponential moving
+#           average) of 'deviates'.
+# channels: Tuple of channels, to which the rule applies, or None for all.
+Rule = collections.namedtuple('Rule', ('name', 'field', 'op', 'value',
+                                       'intervals', 'baseline', 'channels'))
+
+ops = ('<', '>', '=', 'deviates')
+default_baseline = 60
+
+_NAN = float('nan')
+# Types of values, which are used without checks.
+_NUMBERS = {int, float}
+
+
+def parse_rule(text, channels=None):
+    """
+    Parses rule NAME FIELD OP VALUE [for N] [baseline M] [on IP:PORT ...],
+    e.g. "low_bitrate bitrate < 2000 for 3".
+
+    :param channels: Channels, to which the rule applies, unless it has
+    "on". Default: all.
+    :rtype: Rule
+    :raise ValueError: If the rule is invalid.
+    """
+    tokens = text.split()
+    if len(tokens) < 4 or tokens[2] not in ops:
+        raise ValueError("Invalid alert rule: {!r}".format(text))
+    name, field, op = tokens[:3]
+    intervals = 1
+    baseline = default_baseline
+    try:
+        value = float(tokens[3])
+        rest = iter(tokens[4:])
+        for keyword in rest:
+            if keyword == 'for':
+                intervals = int(next(rest))
+            elif keyword == 'baseline' and op == 'deviates':
+                baseline = int(next(rest))
+            elif keyword == 'on':
+                channels = tuple(sorted(parse_channel(item)
+                                        for item in rest))
+            else:
+                raise ValueError(keyword)
+    except (ValueError, StopIteration):
+        raise ValueError("Invalid alert rule: {!r}".format(text))
+    if intervals < 1 or baseline < 1 or not channels and channels is not None:
+        raise ValueError("Invalid alert rule: {!r}".format(text))
+    return Rule(name, field, op, value, intervals, baseline,
+                tuple(channels) if channels is not None else None)
+
+
+def parse_channel(string):
+    ip, _, port = string.partition(':')
+    if not (port.isdigit() and is_multicast(ip)):
+        raise ValueError(string)
+    return ip, int(port)
+
+
+def column(batch, field):
+    """:return: Values of field of channels in batch, NaN if missing."""
+    if field == 'bitrate':
+        return batch.bitrate
+    elif field == 'packets':
+        return batch.packets
+    elif batch.extra is None:
+        return [_NAN] * len(batch)
+    values = list(map(operator.methodcaller('get', field, _NAN),
+                      batch.extra))
+    if set(map(type, values)) <= _NUMBERS:
+        return values
+    return [value if isinstance(value, numbers.Real) else _NAN
+            for value in values]
+
+
+def condition(rule):
+    """
+    :return: Function, which tests value of a comparison rule. NaN never
+    matches.
+    """
+    value = rule.value
+    # Methods of float are called without Python frames.
+    return {'<': value.__gt__, '>': value.__lt__, '=': value.__eq__}[rule.op]
+
+
+def has_nan(values):
+    return any(map(operator.ne, values, values))
+
+
+class Baseline(object):
+    """
+    Rolling baselines (exponential moving averages) of channels of a
+    'deviates' rule, in a column like metrics of MetricBatch.
+    """
+    def __init__(self, rule):
+        self.alpha = 2.0 / (rule.baseline + 1)
+        self.limit = rule.value / 100.0
+        self.length = rule.baseline
+        self.channels = ()
+        self.values = []
+        # Maps channel to number of intervals of its baseline, until it
+        # reaches length.
+        self.warming = {}
+
+    def align(self, channels, values):
+        """
+        Rearranges baselines for channels, which were added or removed.
+        Baselines of added channels start at their values.
+        """
+        old = dict(zip(self.channels, self.values))
+        self.values = [old.get(channel, value)
+                       for channel, value in zip(channels, values)]
+        present = set(channels)
+        for channel in [channel for channel in self.warming
+                        if channel not in present]:
+            del self.warming[channel]
+        for channel in channels:
+            if channel not in old:
+                self.warming[channel] = 0
+        self.channels = channels
+
+    def update(self, channels, values):
+        """
+        Adds values of an interval to baselines.
+
+        :return: Slots of channels, whose values deviate from their
+        baselines of the previous intervals.
+        """
+        if channels != self.channels:
+            self.align(channels, values)
+        baselines = self.values
+        diffs = list(map(operator.sub, values, baselines))
+        hits = itertools.compress(
+            range(len(values)),
+            map(operator.gt, map(abs, diffs),
+                map(self.limit.__mul__, baselines)))
+        new = list(map(operator.add, baselines,
+                       map(self.alpha.__mul__, diffs)))
+        if has_nan(new):
+            # Missing values (NaN) keep baselines, or start them.
+            new = [old if value != value else
+                   value if old != old else baseline
+                   for old, value, baseline in zip(baselines, values, new)]
+        self.values = new
+        if not self.warming:
+            return list(hits)
+        warming = self.warming
+        hits = [slot for slot in hits if channels[slot] not in warming]
+        for channel in list(warming):
+            warming[channel] += 1
+            if warming[channel] >= self.length:
+                del warming[channel]
+        return hits
+
+
+class Alerts(object):
+    """
+    Output queue, which evaluates rules on every metric batch, and sends
+    Alert events after the batch (before the tick) to its output queues.
+    Other events are passed through.
+
+    Workers send events to it like to any other output queue, in their
+    thread. Rules can be replaced from another thread (set_rules).
+    """
+    def __init__(self, rules, queues_out):
+        """
+        :param rules: List of Rules.
+        :param queues_out: Output queues (or rollups).
+        """
+        self.queues_out = queues_out
+        self.rules = []
+        # Maps rule to dictionary, which maps channel to number of
+        # consecutive intervals with the condition. Channels without the
+        # condition aren't in it.
+        self.counts = {}
+        # Maps 'deviates' rule to its Baseline.
+        self.baselines = {}
+        self.lock = threading.Lock()
+        self.new_rules = None
+        self.set_rules(rules)
+
+    def set_rules(self, rules):
+        """Replaces rules on the next batch. States of kept rules remain."""
+        with self.lock:
+            self.new_rules = list(rules)
+
+    def send_all(self, event):
+        for queue in self.queues_out:
+            queue.put_nowait(event)
+
+    def put_nowait(self, event):
+        self.send_all(event)
+        if event.is_batch():
+            for alert in self.evaluate(event):
+                self.send_all(alert)
+
+    def apply_rules(self, now):
+        """
+        Uses rules set by set_rules. Alerts of removed rules are cleared.
+
+        :return: List of Alerts.
+        """
+        with self.lock:
+            rules, self.new_rules = self.new_rules, None
+        events = []
+        kept = set(rules)
+        for rule in self.rules:
+            if rule not in kept:
+                self.baselines.pop(rule, None)
+                for channel, count in sorted(self.counts.pop(rule).items()):
+                    if count >= rule.intervals:
+                        events.append(Alert(now, channel, rule.name,
+                                            'clear'))
+        self.rules = list(collections.OrderedDict.fromkeys(rules))
+        for rule in self.rules:
+            self.counts.setdefault(rule, {})
+            if rule.op == 'deviates' and rule not in self.baselines:
+                self.baselines[rule] = Baseline(rule)
+        log.info("%d alert rule(s).", len(self.rules))
+        return events
+
+    def evaluate(self, batch):
+        """:return: List of Alerts raised and cleared by batch."""
+        started = time.time()
+        now = batch.timestamp
+        events = []
+        if self.new_rules is not None:
+            events.extend(self.apply_rules(now))
+        columns = {}
+        slots = {}
+
+        def value_of(channel, field):
+            if not slots:
+                slots.update((channel, slot) for slot, channel
+                             in enumerate(batch.channels))
+            slot = slots.get(channel)
+            return columns[field][slot] if slot is not None else None
+
+        for rule in self.rules:
+            values = columns.get(rule.field)
+            if values is None:
+                values = columns[rule.field] = column(batch, rule.field)
+            if rule.channels is None:
+                channels = batch.channels
+            else:
+                channels = [channel for channel in rule.channels
+                            if value_of(channel, rule.field) is not None]
+                values = [value_of(channel, rule.field)
+                          for channel in channels]
+            if rule.op == 'deviates':
+                hits = self.baselines[rule].update(channels, values)
+            else:
+                # Slots of channels with the condition, found without a
+                # Python loop.
+                hits = list(itertools.compress(range(len(values)),
+                                               map(condition(rule), values)))
+            self.count(rule, now, channels, values, hits, events,
+                       lambda channel: value_of(channel, rule.field))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("%.03f: Evaluated %d alert rule(s) in %.03f ms", now,
+                      len(self.rules), (time.time() - started) * 1000)
+        return events
+
+    def count(self, rule, now, channels, values, hits, events, value_of):
+        """
+        Counts consecutive intervals of channels with the condition of rule.
+
+        :param hits: Slots of channels, which have the condition.
+        :param value_of: Function, which returns value of channel, None if
+        it was removed.
+        """
+        counts = self.counts[rule]
+        if counts:
+            # Conditions of some channels may have ended, or channels were
+            # removed.
+            hit = {channels[slot] for slot in hits}
+            for channel in [channel for channel in counts
+                            if channel not in hit]:
+                if counts.pop(channel) >= rule.intervals:
+                    events.append(Alert(now, channel, rule.name, 'clear',
+                                        value_of(channel)))
+        for slot in hits:
+            channel = channels[slot]
+            count = counts.get(channel, 0) + 1
+            counts[channel] = count
+            if count == rule.intervals:
+                events.append(Alert(now, channel, rule.name, 'raise',
+                                    values[slot]))
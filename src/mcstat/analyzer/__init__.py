@@ -0,0 +1,40 @@
+import importlib
+
+# Maps analyzer name to (module, class name).
+# Analyzers inspect payload of datagrams, so they require read_payload.
+analyzers = {
+    'ts': ('mcstat.analyzer.ts', 'TsAnalyzer'),
+    'rtp': ('mcstat.analyzer.rtp', 'RtpAnalyzer'),
+    }
+
+
+def analyzer_class(name):
+    module_name, class_name = analyzers[name]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def make_analyzers(names):
+    """
+    Makes new analyzers for a single channel.
+
+    Analyzer has method feed(datagrams, arrivals), which analyzes list of
+    datagrams (bytes-like objects) received at once, with list of their
+    arrival times, and returns partial statistics.
+    Partial statistics support += with statistics of the same analyzer, and
+    method fields(interval), which returns dictionary with extra fields of
+    Metric.
+
+    :param names: Names of analyzers.
+    :return: Dictionary mapping name to analyzer.
+    """
+    return {name: analyzer_class(name)() for name in names}
+
+
+def analyze(channel_analyzers, datagrams, arrivals):
+    """
+    Feeds datagrams to all analyzers of a channel.
+
+    :return: Dictionary mapping analyzer name to partial statistics.
+    """
+    return {name: analyzer.feed(datagrams, arrivals)
+            for name, analyzer in channel_analyzers.items()}
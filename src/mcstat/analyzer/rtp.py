@@ -0,0 +1,205 @@
+from itertools import repeat
+from operator import and_, mul, sub
+
+import struct
+
+try:
+    # Python 2: map, which stops at the shortest iterable.
+    from itertools import imap as map
+except ImportError:
+    # Python 3
+    pass
+
+# RTP timestamp clock rate (Hz) - 90 kHz is used by MPEG-TS and video.
+CLOCK_RATE = 90000
+
+# Number of the most recent sequence numbers, which are tracked for
+# detecting losses, reordered and duplicate packets. A packet is counted as
+# lost, when it's still missing after WINDOW newer packets.
+WINDOW = 128
+_WINDOW_MASK = (1 << WINDOW) - 1
+
+# Larger jumps of sequence number are treated as restart of the stream, if
+# the next packet follows the jump (RFC 3550, appendix A.1).
+MAX_DROPOUT = 3000
+MAX_MISORDER = WINDOW
+
+# First byte, payload type, sequence number, timestamp.
+_HEADER = struct.Struct(">BBHI")
+
+# Jitter after n packets, with differences of transit times D[i]:
+#   J[n] = J[0] * (15/16)**n + sum(D[i] * _JITTER_WEIGHTS[n - i])
+_JITTER_WEIGHTS = [(15.0 / 16) ** i / 16 for i in range(WINDOW + 1)]
+
+
+class RtpStats(object):
+    """Partial statistics of RTP analyzer."""
+    def __init__(self):
+        self.packets = 0
+        self.invalid = 0
+        self.lost = 0
+        self.reordered = 0
+        self.duplicates = 0
+        # Jitter (in seconds) after the last packet.
+        self.jitter = 0.0
+
+    def __iadd__(self, b):
+        if b.packets:
+            self.jitter = b.jitter
+        self.packets += b.packets
+        self.invalid += b.invalid
+        self.lost += b.lost
+        self.reordered += b.reordered
+        self.duplicates += b.duplicates
+        return self
+
+    def fields(self, interval):
+        """
+        :return: Extra fields of metric. Jitter is in milliseconds.
+        """
+        return {'rtp_lost': self.lost,
+                'rtp_reordered': self.reordered,
+                'rtp_duplicates': self.duplicates,
+                'rtp_invalid': self.invalid,
+                'rtp_jitter': self.jitter * 1000
+                }
+
+
+class RtpAnalyzer(object):
+    """
+    Tracks RTP sequence numbers and interarrival jitter (RFC 3550).
+
+    State has constant size: the highest sequence number, bitmap of WINDOW
+    recent sequence numbers, and jitter.
+    """
+    def __init__(self):
+        # The highest sequence number received.
+        self.max_seq = None
+        # Bit i is set, if packet max_seq - i was received.
+        self.window = 0
+        # Number of valid bits in window.
+        self.span = 0
+        # Sequence number, which restarts the stream: the one following the
+        # last large jump.
+        self.bad_seq = None
+        # Relative transit time of the previous packet (in RTP units).
+        self.transit = None
+        # Jitter (in RTP units).
+        self.jitter = 0.0
+
+    def feed(self, datagrams, arrivals):
+        """
+        :param arrivals: Arrival times of datagrams (Unix time).
+        :rtype: RtpStats
+        """
+        stats = RtpStats()
+        if not self.feed_in_order(stats, datagrams, arrivals):
+            for datagram, arrival in zip(datagrams, arrivals):
+                self.feed_one(stats, datagram, arrival)
+        stats.jitter = self.jitter / CLOCK_RATE
+        return stats
+
+    def feed_in_order(self, stats, datagrams, arrivals):
+        """
+        Fast path for the common case: valid packets, which directly follow
+        the highest sequence number. Headers are processed together, with
+        map over operator functions, which runs in C.
+
+        :return: False if datagrams must be processed one by one.
+        """
+        n = len(datagrams)
+        if not 0 < n <= WINDOW or self.span != WINDOW or \
+                self.transit is None:
+            return False
+        first_seq = self.max_seq + 1
+        if first_seq + n > 0x10000:
+            # Sequence number wraps around.
+            return False
+        try:
+            firsts, _, seqs, timestamps = zip(*map(_HEADER.unpack_from,
+                                                   datagrams))
+        except struct.error:
+            # Too short datagram.
+            return False
+        if seqs != tuple(range(first_seq, first_seq + n)) or \
+                list(map(and_, firsts, repeat(0xc0))).count(0x80) != n:
+            return False
+        transits = [self.transit]
+        transits.extend(map(sub, map(mul, arrivals, repeat(CLOCK_RATE)),
+                            timestamps))
+        diffs = list(map(abs, map(sub, transits[1:], transits[:-1])))
+        if max(diffs) > 1 << 31:
+            # Timestamp wrapped around.
+            return False
+
+        stats.packets += n
+        window = self.window
+        stats.lost += n - bin(window >> (WINDOW - n)).count('1')
+        self.window = ((window << n) | ((1 << n) - 1)) & _WINDOW_MASK
+        self.max_seq = seqs[-1]
+        self.transit = transits[-1]
+        self.jitter = self.jitter * (15.0 / 16) ** n + \
+            sum(map(mul, diffs, reversed(_JITTER_WEIGHTS[:n])))
+        return True
+
+    def feed_one(self, stats, datagram, arrival):
+        if len(datagram) < _HEADER.size:
+            stats.invalid += 1
+            return
+        first, _, seq, timestamp = _HEADER.unpack_from(datagram)
+        if first & 0xc0 != 0x80:
+            stats.invalid += 1
+            return
+        stats.packets += 1
+        self.sequence(stats, seq)
+
+        transit = arrival * CLOCK_RATE - timestamp
+        if self.transit is not None:
+            d = abs(transit - self.transit)
+            # Timestamp wrapped around.
+            if d > 1 << 31:
+                d = abs(d - (1 << 32))
+            self.jitter += (d - self.jitter) / 16
+        self.transit = transit
+
+    def sequence(self, stats, seq):
+        if self.max_seq is None:
+            self.restart(seq)
+            return
+        # Distance from the highest sequence number, in range
+        # [-32768, 32767].
+        delta = ((seq - self.max_seq + 0x8000) & 0xffff) - 0x8000
+        if delta > MAX_DROPOUT or -delta >= MAX_MISORDER:
+            if seq == self.bad_seq:
+                # Two sequential packets after the jump.
+                self.restart(seq)
+            else:
+                # Ignored, unless the next packet follows it.
+                self.bad_seq = (seq + 1) & 0xffff
+        elif delta > 0:
+            shifted = self.window << delta
+            span = self.span + delta
+            if span > WINDOW:
+                # Bits shifted out of window: missing packets are lost.
+                received = bin(shifted >> WINDOW).count('1')
+                stats.lost += span - WINDOW - received
+                span = WINDOW
+            self.window = (shifted & _WINDOW_MASK) | 1
+            self.span = span
+            self.max_seq = seq
+        elif -delta >= self.span:
+            # Older than window: already counted as lost.
+            stats.reordered += 1
+        else:
+            bit = 1 << -delta
+            if self.window & bit:
+                stats.duplicates += 1
+            else:
+                self.window |= bit
+                stats.reordered += 1
+
+    def restart(self, seq):
+        self.max_seq = seq
+        self.window = 1
+        self.span = 1
+        self.bad_seq = None
@@ -0,0 +1,173 @@
+from collections import Counter
+from itertools import repeat
+from operator import add, and_, eq, ge, lshift, mul, ne, not_, or_, sub
+
+try:
+    # Python 2: map, which stops at the shortest iterable.
+    from itertools import imap as map
+except ImportError:
+    # Python 3
+    pass
+
+TS_PACKET_SIZE = 188
+SYNC_BYTE = 0x47
+NULL_PID = 0x1fff
+
+
+def _table(f):
+    """Makes translation table, which maps byte b to f(b)."""
+    return bytes(bytearray(f(b) for b in range(256)))
+
+
+_NOT_SYNC = _table(lambda b: int(b != SYNC_BYTE))
+_TEI = _table(lambda b: b >> 7)
+_PID_HIGH = _table(lambda b: b & 0x1f)
+_HAS_ADAPTATION = _table(lambda b: (b >> 5) & 1)
+_HAS_PAYLOAD = _table(lambda b: (b >> 4) & 1)
+_CC = _table(lambda b: b & 0x0f)
+_NON_ZERO = _table(lambda b: int(b != 0))
+_DISCONTINUITY = _table(lambda b: b >> 7)
+
+
+def ts_payload(datagram):
+    """
+    Returns TS packets of datagram: skips RTP header if present, and
+    incomplete TS packet at the end.
+    """
+    start = 0
+    first = datagram[0:1]
+    if first and first != b'\x47':
+        first = bytearray(first)[0]
+        if first >> 6 == 2 and len(datagram) >= 12:
+            # RTP header with CSRC list and optional extension.
+            start = 12 + 4 * (first & 0x0f)
+            if first & 0x10 and len(datagram) >= start + 4:
+                ext = bytearray(datagram[start + 2:start + 4])
+                start += 4 + 4 * ((ext[0] << 8) | ext[1])
+    end = start + (len(datagram) - start) // TS_PACKET_SIZE * TS_PACKET_SIZE
+    return datagram[start:end]
+
+
+class TsStats(object):
+    """Partial statistics of MPEG-TS analyzer."""
+    def __init__(self, sync_errors=0, tei_errors=0, cc_errors=0,
+                 pid_packets=None):
+        """
+        :param pid_packets: Maps PID to number of TS packets.
+        :type pid_packets: collections.Counter
+        """
+        self.sync_errors = sync_errors
+        self.tei_errors = tei_errors
+        self.cc_errors = cc_errors
+        self.pid_packets = pid_packets if pid_packets is not None \
+            else Counter()
+
+    def __iadd__(self, b):
+        self.sync_errors += b.sync_errors
+        self.tei_errors += b.tei_errors
+        self.cc_errors += b.cc_errors
+        self.pid_packets.update(b.pid_packets)
+        return self
+
+    def fields(self, interval):
+        """
+        :return: Extra fields of metric. pid_bitrate maps PID to kbits/second.
+        """
+        scale = float(TS_PACKET_SIZE * 8) / 1024 / interval
+        return {'sync_errors': self.sync_errors,
+                'tei_errors': self.tei_errors,
+                'cc_errors': self.cc_errors,
+                'pid_bitrate': {pid: packets * scale
+                                for pid, packets in self.pid_packets.items()
+                                if pid >= 0}
+                }
+
+
+class TsAnalyzer(object):
+    """
+    Counts sync byte, transport error indicator (TEI) and continuity counter
+    (CC) errors, and TS packets per PID.
+
+    All TS packets received at once are parsed together, using operations on
+    columns of header bytes (strided slices, translate, map with operator
+    functions), which run in C. Python code runs only per datagram and per
+    PID.
+    """
+    def __init__(self):
+        # Maps PID to last continuity counter.
+        self.last_cc = {}
+
+    def feed(self, datagrams, arrivals=None):
+        data = bytearray()
+        for datagram in datagrams:
+            data += ts_payload(datagram)
+        return self.parse(data)
+
+    def parse(self, data):
+        """
+        :param data: TS packets.
+        :type data: bytearray
+        :rtype: TsStats
+        """
+        n = len(data) // TS_PACKET_SIZE
+        if n == 0:
+            return TsStats()
+
+        # Columns of header bytes.
+        b0, b1, b2, b3, b4, b5 = (data[i::TS_PACKET_SIZE] for i in range(6))
+
+        not_sync = b0.translate(_NOT_SYNC)
+        tei = b1.translate(_TEI)
+        invalid = list(map(or_, not_sync, tei))
+        pids = map(or_, map(lshift, b1.translate(_PID_HIGH), repeat(8)), b2)
+        # PID of invalid packets is -1.
+        pids = list(map(or_, pids, map(mul, invalid, repeat(-1))))
+
+        stats = TsStats(sync_errors=sum(not_sync), tei_errors=sum(tei),
+                        pid_packets=Counter(pids))
+        stats.cc_errors = self.cc_errors(pids, b3, b4, b5)
+        return stats
+
+    def cc_errors(self, pids, b3, b4, b5):
+        n = len(pids)
+        # Packets are checked per PID, so sort them by PID (the sort is
+        # stable). Key of packets, which are not checked, is -1.
+        is_null = map(eq, pids, repeat(NULL_PID))
+        keys = list(map(sub, pids, map(mul, is_null, repeat(NULL_PID + 1))))
+        order = sorted(range(n), key=keys.__getitem__)
+        cc = b3.translate(_CC)
+        payload = b3.translate(_HAS_PAYLOAD)
+        discontinuity = map(and_, b3.translate(_HAS_ADAPTATION),
+                            map(and_, b4.translate(_NON_ZERO),
+                                b5.translate(_DISCONTINUITY)))
+        discontinuity = list(discontinuity)
+
+        s_keys = list(map(keys.__getitem__, order))
+        s_cc = list(map(cc.__getitem__, order))
+        s_payload = list(map(payload.__getitem__, order))
+        s_disc = list(map(discontinuity.__getitem__, order))
+
+        # CC of packet with payload is the previous CC plus 1, otherwise
+        # it's the same. Packet with payload may be sent twice.
+        prev, cur, pay = s_cc[:-1], s_cc[1:], s_payload[1:]
+        checked = map(and_, map(eq, s_keys[1:], s_keys[:-1]),
+                      map(ge, s_keys[1:], repeat(0)))
+        expected = map(and_, map(add, prev, pay), repeat(0x0f))
+        allowed = map(or_, map(and_, pay, map(eq, cur, prev)), s_disc[1:])
+        errors = sum(map(and_, map(and_, checked, map(ne, cur, expected)),
+                         map(not_, allowed)))
+
+        # First packets of PIDs are compared with the previous datagrams.
+        first = dict(zip(reversed(s_keys), reversed(range(n))))
+        first.pop(-1, None)
+        for key, i in first.items():
+            last = self.last_cc.get(key)
+            if last is None or s_disc[i]:
+                continue
+            if s_cc[i] != (last + s_payload[i]) & 0x0f and \
+                    not (s_payload[i] and s_cc[i] == last):
+                errors += 1
+
+        self.last_cc.update(zip(s_keys, s_cc))
+        self.last_cc.pop(-1, None)
+        return errors
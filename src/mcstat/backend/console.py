@@ -1,11 +1,43 @@
-def worker(queue):
-    while True:
-        event = queue.get()
-        if event.is_term():
-            break
-        else:
-            metric = event.metric
-            ip, port = metric.channel
-            print("{:f}\t{}\t{:d}\t{:f}\t{:f}".format(
-                metric.timestamp, ip, port, metric.bitrate, metric.packets))
-            queue.task_done()
+from mcstat.output import Output
+
+import json
+
+
+def format_extra(extra):
+    """Formats extra fields of metric as tab separated name=value."""
+    return "".join("\t{}={}".format(name, json.dumps(value, sort_keys=True)
+                                    if isinstance(value, dict) else value)
+                   for name, value in sorted(extra.items()))
+
+
+def write(event):
+    """Prints event (metrics of an interval, stream event or alert)."""
+    if event.is_stream_event():
+        ip, port = event.channel
+        print("{:f}\t{}\t{:d}\tstream {}{}".format(
+            event.timestamp, ip, port, event.state,
+            format_extra({'last_seen': event.last_seen})
+            if event.state == 'down' else ""))
+    elif event.is_alert():
+        ip, port = event.channel
+        print("{:f}\t{}\t{:d}\talert {} {}{}".format(
+            event.timestamp, ip, port, event.rule, event.state,
+            format_extra({'value': event.value})
+            if event.value is not None else ""))
+    elif event.is_batch():
+        timestamp = event.timestamp
+        if len(event):
+            print("\n".join(
+                "{:f}\t{}\t{:d}\t{:f}\t{:f}{}".format(
+                    timestamp, channel[0], channel[1], bitrate, packets,
+                    format_extra(extra))
+                for channel, bitrate, packets, extra in event.rows()))
+
+
+class ConsoleOutput(Output):
+    """Prints events to stdout."""
+    inline = True
+    daemon = True
+
+    def handle(self, event):
+        write(event)
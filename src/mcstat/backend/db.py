@@ -1,12 +1,41 @@
+from mcstat.alert import parse_rule
+from mcstat.backend.pgcopy import copy_statement, copy_data
+from mcstat.backlog import Backlog
+from mcstat.output import Output
+from mcstat.spool import Spool
+
 import psycopg2
+import psycopg2.extras
 import datetime
+import json
+import logging
+import threading
+import time
 from contextlib import closing
 
+try:
+    # Python 2
+    from cStringIO import StringIO
+except ImportError:
+    # Python 3
+    from io import StringIO
+
+log = logging.getLogger('mcstat.db')
+
+# Seconds between attempts to write, when database is not available.
+retry_interval = 5
+
 
 class DB(object):
-    def __init__(self, config):
+    def __init__(self, config, sql=None):
+        """
+        :param sql: Statement, which writes rows. Default: update_sql.
+        """
         self.config = config
         self._connection = None
+        self.sql = sql or config.update_sql
+        # COPY statement, if sql is a plain insert.
+        self.copy = copy_statement(self.sql or "")
 
     def close(self):
         if self._connection is not None:
@@ -28,6 +57,9 @@ class DB(object):
     def get_channels(self):
         return self.retry(self._get_channels)
 
+    def get_rules(self):
+        return self.retry(self._get_rules)
+
     def write(self, channel_metrics):
         return self.retry(self._write, channel_metrics)
 
@@ -37,10 +69,20 @@ class DB(object):
             rows = cursor.fetchall()
             return [(ip, int(port)) for ip, port in rows]
 
-    def _write(self, channel_stats):
+    def _get_rules(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(self.config.rules_sql)
+            return cursor.fetchall()
+
+    def _write(self, rows):
+        """Writes all rows in one transaction."""
         with self.connection.cursor() as cursor:
-            params = [cs for cs in channel_stats]
-            cursor.executemany(self.config.update_sql, params)
+            if self.copy is not None:
+                copy_sql, names = self.copy
+                cursor.copy_expert(copy_sql,
+                                   StringIO(copy_data(rows, names)))
+            else:
+                psycopg2.extras.execute_batch(cursor, self.sql, rows)
             self.connection.commit()
 
     def retry(self, fun, *args, **kwargs):
@@ -51,28 +93,247 @@ class DB(object):
             return fun(*args, **kwargs)
 
 
-# TODO: Send events in batches
-def worker(queue, db_config):
-    def ts(timestamp):
-        return datetime.datetime.fromtimestamp(timestamp)
+def metric_row(metric):
+    """Converts metric to parameters of update_sql."""
+    ip, port = metric.channel
+    row = {'timestamp': datetime.datetime.fromtimestamp(metric.timestamp),
+           'ip': ip,
+           'port': port,
+           'bitrate': metric.bitrate,
+           'packets': metric.packets,
+           'interval': metric.interval
+           }
+    for name, value in metric.extra.items():
+        row[name] = json.dumps(value) if isinstance(value, dict) else value
+    return row
+
+
+def event_row(event):
+    """Converts StreamEvent to parameters of event_sql."""
+    ip, port = event.channel
+    last_seen = event.last_seen
+    return {'timestamp': datetime.datetime.fromtimestamp(event.timestamp),
+            'ip': ip,
+            'port': port,
+            'state': event.state,
+            'last_seen': datetime.datetime.fromtimestamp(last_seen)
+            if last_seen is not None else None
+            }
+
+
+def alert_row(event):
+    """Converts Alert to parameters of alert_sql."""
+    ip, port = event.channel
+    return {'timestamp': datetime.datetime.fromtimestamp(event.timestamp),
+            'ip': ip,
+            'port': port,
+            'rule': event.rule,
+            'state': event.state,
+            'value': event.value
+            }
 
+
+def row_channel(row):
+    return row['ip'], row['port']
+
+
+def write_batch(db, rows):
+    """
+    Writes rows in one transaction. Rows rejected by database are dropped.
+
+    :return: False if database is not available.
+    """
+    try:
+        db.write(rows)
+    except (psycopg2.InterfaceError, psycopg2.OperationalError):
+        log.exception("Writing %d rows failed.", len(rows))
+        return False
+    except psycopg2.Error:
+        log.exception("Dropping %d rows, which can't be written.", len(rows))
+        db.close()
+    return True
+
+
+def writer(backlog, db_config):
+    """
+    Writes batches from backlog, every batch in one transaction. Ends when
+    backlog is closed and empty.
+    """
     with closing(DB(db_config)) as db:
-        while True:
-            event = queue.get()
-            if event.is_term():
+        if db_config.spool_dir:
+            spool = Spool(db_config.spool_dir,
+                          db_config.spool_size * 1024 * 1024)
+            spooling_writer(db, backlog, spool)
+        else:
+            backlog_writer(db, backlog)
+
+
+def backlog_writer(db, backlog):
+    """
+    When database is not available, the batch is returned to backlog and
+    written again later.
+    """
+    while True:
+        rows = backlog.get()
+        if rows is None:
+            break
+        if not write_batch(db, rows):
+            backlog.put_back(rows)
+            if backlog.wait_closed(retry_interval):
+                log.error("Database not available, %d batches lost.",
+                          len(backlog))
                 break
-            else:
-                metric = event.metric
-                ip, port = metric.channel
-                row = {'timestamp': ts(metric.timestamp),
-                       'ip': ip,
-                       'port': port,
-                       'bitrate': metric.bitrate,
-                       'packets': metric.packets
-                       }
-                db.write([row])
+
+
+def spooling_writer(db, backlog, spool):
+    """
+    When database is not available, batches are appended to spool. While
+    spool isn't empty, new batches are appended to it too, so that they are
+    written in order. Spool is replayed when database is available again,
+    oldest first.
+
+    :type spool: mcstat.spool.Spool
+    """
+    retry_at = 0
+    while True:
+        rows = backlog.get(retry_interval if len(spool) else None)
+        if rows is not None:
+            if len(spool) or not write_batch(db, rows):
+                spool.append(rows)
+        elif backlog.closed:
+            break
+        if len(spool) and time.time() >= retry_at:
+            if not replay(db, spool):
+                retry_at = time.time() + retry_interval
+    if len(spool):
+        log.warning("%d spool segments will be replayed on next start.",
+                    len(spool))
+
+
+def replay(db, spool):
+    """
+    Writes spool to database, one segment per transaction.
+
+    :return: False if database is not available.
+    """
+    while len(spool):
+        segment, batches = spool.oldest()
+        rows = [row for batch in batches for row in batch]
+        if not write_batch(db, rows):
+            return False
+        spool.remove(segment)
+        log.info("Replayed %d rows from spool.", len(rows))
+    return True
+
+
+def event_writer(backlog, db_config, sql):
+    """Writes events (StreamEvents or Alerts) from backlog with sql."""
+    with closing(DB(db_config, sql)) as db:
+        backlog_writer(db, backlog)
+
+
+def start_event_writer(name, db_config, sql, threads):
+    """
+    Starts thread, which writes events with sql, and adds it to threads.
+
+    :return: Backlog of the thread, None if sql isn't set.
+    """
+    if not sql:
+        return None
+    backlog = Backlog(db_config.backlog)
+    thread = threading.Thread(name=name, target=event_writer,
+                              args=(backlog, db_config, sql))
+    thread.start()
+    threads.append(thread)
+    return backlog
+
+
+class DbOutput(Output):
+    """
+    Collects metrics into batches: one batch per batch_ticks ticks. Batches
+    are written by a separate thread, so that slow database doesn't block
+    the output. The backlog of batches is bounded, see overflow policies in
+    mcstat.backlog.
+
+    StreamEvents and Alerts are written by other threads immediately, if
+    event_sql and alert_sql are set.
+    """
+    # Events are only moved to backlogs, whose overflow policy applies.
+    overflow = 'block'
+
+    def __init__(self, db_config):
+        self.db_config = db_config
+        self.backlog = Backlog(db_config.backlog, db_config.overflow,
+                               row_channel)
+        thread = threading.Thread(name="db-writer", target=writer,
+                                  args=(self.backlog, db_config))
+        thread.start()
+        self.threads = [thread]
+        self.events = start_event_writer("db-events", db_config,
+                                         db_config.event_sql, self.threads)
+        self.alerts = start_event_writer("db-alerts", db_config,
+                                         db_config.alert_sql, self.threads)
+        # Rows of the current batch.
+        self.rows = []
+        self.ticks = 0
+
+    @classmethod
+    def from_config(cls, main_config, db_config, queues, health):
+        return cls(db_config)
+
+    def handle(self, event):
+        if event.is_tick():
+            self.ticks += 1
+            if self.ticks >= self.db_config.batch_ticks:
+                if self.rows:
+                    self.backlog.put(self.rows)
+                self.rows = []
+                self.ticks = 0
+        elif event.is_stream_event():
+            if self.events is not None:
+                self.events.put([event_row(event)])
+        elif event.is_alert():
+            if self.alerts is not None:
+                self.alerts.put([alert_row(event)])
+        elif event.is_batch():
+            self.rows.extend(metric_row(m) for m in event.metrics())
+
+    def close(self):
+        if self.rows:
+            self.backlog.put(self.rows)
+        self.backlog.close()
+        for writes in (self.events, self.alerts):
+            if writes is not None:
+                writes.close()
+        for thread in self.threads:
+            thread.join()
 
 
 def get_channels(db_config):
     with closing(DB(db_config)) as db:
         return db.get_channels()
+
+
+def get_rules(db_config):
+    """
+    Loads alert rules with rules_sql. Invalid rules are skipped.
+
+    :return: List of mcstat.alert.Rule.
+    """
+    with closing(DB(db_config)) as db:
+        rows = db.get_rules()
+    # Maps rule text to its channels, None means: all.
+    texts = {}
+    for ip, port, text in rows:
+        if ip is None:
+            texts[text] = None
+        elif texts.setdefault(text, set()) is not None:
+            texts[text].add((ip, int(port)))
+    rules = []
+    for text, channels in sorted(texts.items()):
+        try:
+            rules.append(parse_rule(text, sorted(channels)
+                                    if channels is not None else None))
+        except ValueError as e:
+            log.error("%s", e)
+    return rules
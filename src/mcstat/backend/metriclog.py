@@ -0,0 +1,41 @@
+from mcstat.metriclog import MetricLogWriter
+from mcstat.output import Output
+
+import logging
+
+log = logging.getLogger('mcstat.metriclog')
+
+
+class MetricLog(Output):
+    """Appends metrics of every interval to metric log in directory."""
+    # Writes to disk (and rotates the log), so it runs in its own thread.
+    inline = False
+
+    def __init__(self, directory, max_bytes=0):
+        """
+        :param max_bytes: Maximum size of the log, 0 means: no limit.
+        """
+        self.writer = MetricLogWriter(directory, max_bytes)
+        # Metrics of the current interval.
+        self.metrics = []
+
+    @classmethod
+    def from_config(cls, main_config, db_config, queues, health):
+        # Size of the log is configured in MB.
+        return cls(main_config.metric_log_dir,
+                   main_config.metric_log_size << 20)
+
+    def handle(self, event):
+        if event.is_tick():
+            self.flush()
+        elif event.is_batch():
+            self.metrics.extend(event.metrics())
+
+    def flush(self):
+        if self.metrics:
+            self.writer.write(self.metrics, self.metrics[0].interval)
+        self.metrics = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
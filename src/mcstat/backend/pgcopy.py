@@ -0,0 +1,53 @@
+"""
+Bulk loading of rows with PostgreSQL COPY FROM STDIN (text format).
+"""
+import re
+
+_INSERT = re.compile(r"^\s*insert\s+into\s+([\w.\"]+)\s*\(([^()]*)\)"
+                     r"\s*values\s*\((.*)\)\s*;?\s*$",
+                     re.IGNORECASE | re.DOTALL)
+_PARAM = re.compile(r"^%\((\w+)\)s$")
+
+_ESCAPES = [('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r')]
+
+
+def copy_statement(sql):
+    """
+    Converts plain insert of parameters to COPY, e.g.:
+
+      insert into stats (ts, bitrate) values (%(timestamp)s, %(bitrate)s)
+
+    :return: (COPY statement, names of parameters in order of columns), or
+    None if sql is something else.
+    """
+    match = _INSERT.match(sql)
+    if match is None:
+        return None
+    table, columns, values = match.groups()
+    columns = [column.strip() for column in columns.split(',')]
+    params = [_PARAM.match(value.strip()) for value in values.split(',')]
+    if len(columns) != len(params) or not all(params):
+        return None
+    copy_sql = "copy {} ({}) from stdin".format(table, ", ".join(columns))
+    return copy_sql, [param.group(1) for param in params]
+
+
+def copy_value(value):
+    """Formats value as a column of COPY text format."""
+    if value is None:
+        return '\\N'
+    text = repr(value) if isinstance(value, float) else str(value)
+    for char, escaped in _ESCAPES:
+        text = text.replace(char, escaped)
+    return text
+
+
+def copy_data(rows, names):
+    """
+    :param rows: List of dictionaries.
+    :param names: Names of parameters in order of columns. Missing parameters
+    are NULL.
+    :return: Rows in COPY text format.
+    """
+    return "".join("\t".join(copy_value(row.get(name)) for name in names) +
+                   "\n" for row in rows)
@@ -0,0 +1,221 @@
+"""
+HTTP exporter of metrics in Prometheus text format.
+
+The exposition is rendered once per tick, and scrapes are served from it by
+a separate thread (and a thread per connection), so slow or frequent
+scrapers don't slow down the worker.
+"""
+from mcstat.health import escape
+from mcstat.output import Output
+
+import itertools
+import logging
+import numbers
+import re
+import threading
+import time
+
+try:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+log = logging.getLogger('mcstat.prometheus')
+
+content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+_INVALID = re.compile(r'[^a-zA-Z0-9_]')
+
+
+def metric_name(name):
+    return 'mcstat_' + _INVALID.sub('_', name)
+
+
+def format_value(value):
+    return repr(float(value))
+
+
+def render(batches, down=(), queues=None, timestamp=None, samples=(),
+           alerts=()):
+    """
+    :param batches: MetricBatches of the last interval.
+    :param down: Channels, which are down (see outage_threshold).
+    :param alerts: Active alerts, iterable of (channel, rule name).
+    :param queues: Dictionary (name -> Queue), whose sizes are exported.
+    :param timestamp: Time of the last tick.
+    :param samples: Other gauges, list of (name, labels, value), e.g.
+    mcstat.health.Health.samples.
+    :return: Exposition in Prometheus text format.
+    :rtype: bytes
+    """
+    # Maps metric name to list of samples (labels, value).
+    families = {}
+
+    def add(name, labels, value):
+        families.setdefault(name, []).append((labels, value))
+
+    for batch in batches:
+        # Columns of the batch are read directly, without Metric of every
+        # channel.
+        extras = batch.extra if batch.extra is not None \
+            else itertools.repeat(None)
+        for channel, bitrate, packets, extra in zip(
+                batch.channels, batch.bitrate, batch.packets, extras):
+            ip, port = channel
+            labels = 'ip="{}",port="{}"'.format(escape(ip), port)
+            add('mcstat_bitrate_kbps', labels, bitrate)
+            add('mcstat_packets_per_second', labels, packets)
+            add('mcstat_channel_up', labels, 0 if channel in down else 1)
+            if not extra:
+                continue
+            for name, value in extra.items():
+                if isinstance(value, dict):
+                    for key, item in value.items():
+                        add(metric_name(name),
+                            '{},key="{}"'.format(labels, escape(key)), item)
+                elif isinstance(value, numbers.Real):
+                    add(metric_name(name), labels, value)
+    for (ip, port), rule in sorted(alerts):
+        add('mcstat_alert', 'ip="{}",port="{}",rule="{}"'.format(
+            escape(ip), port, escape(rule)), 1)
+    for name, queue in sorted((queues or {}).items()):
+        add('mcstat_queue_size', 'queue="{}"'.format(escape(name)),
+            queue.qsize())
+    for name, labels, value in samples:
+        add(name, labels, value)
+    if timestamp is not None:
+        add('mcstat_last_tick_timestamp_seconds', '', timestamp)
+
+    lines = []
+    for name in sorted(families):
+        lines.append('# TYPE {} gauge'.format(name))
+        for labels, value in families[name]:
+            if labels:
+                lines.append('{}{{{}}} {}'.format(name, labels,
+                                                  format_value(value)))
+            else:
+                lines.append('{} {}'.format(name, format_value(value)))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class Exposition(object):
+    """The last rendered exposition, replaced by the worker on every tick."""
+    def __init__(self):
+        self.body = b''
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def make_server(address):
+    """
+    Creates HTTP server, which serves its exposition attribute.
+
+    :param address: (host, port) to listen on.
+    """
+    exposition = Exposition()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = exposition.body
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            log.debug("%s %s", self.address_string(), format % args)
+
+    server = _Server(address, Handler)
+    server.exposition = exposition
+    return server
+
+
+class Exporter(object):
+    """Renders exposition of server from metrics of every tick."""
+    def __init__(self, server, queues=None, health=None):
+        """
+        :param server: Server created by make_server.
+        :param queues: Dictionary (name -> Queue), whose sizes are exported.
+        :param health: mcstat.health.Health, whose samples are exported, or
+        None.
+        """
+        self.exposition = server.exposition
+        self.queues = queues
+        self.health = health
+        # Batches of the last interval.
+        self.batches = []
+        self.down = set()
+        # Active alerts: (channel, rule name)
+        self.alerts = set()
+
+    def handle(self, event):
+        if event.is_tick():
+            started = time.time()
+            self.exposition.body = render(
+                self.batches, self.down, self.queues, event.timestamp,
+                self.health.samples if self.health is not None else (),
+                self.alerts)
+            log.debug("Rendered %d metrics in %.03f s",
+                      sum(len(b) for b in self.batches),
+                      time.time() - started)
+            self.batches = []
+        elif event.is_stream_event():
+            if event.state == 'down':
+                self.down.add(event.channel)
+            else:
+                self.down.discard(event.channel)
+        elif event.is_alert():
+            if event.state == 'raise':
+                self.alerts.add((event.channel, event.rule))
+            else:
+                self.alerts.discard((event.channel, event.rule))
+        elif event.is_batch():
+            self.batches.append(event)
+
+
+def serve(server):
+    """
+    Starts serving scrapes in a thread.
+
+    :return: Function, which stops the server and closes it.
+    """
+    log.info("Listening on %s:%d", *server.server_address[:2])
+    thread = threading.Thread(name="http-server", target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    def close():
+        server.shutdown()
+        server.server_close()
+    return close
+
+
+class HttpOutput(Exporter, Output):
+    """Exporter, whose server is serving scrapes until close."""
+    # Only the latest metrics are served.
+    overflow = 'coalesce'
+    inline = True
+    daemon = True
+
+    def __init__(self, server, queues=None, health=None):
+        Exporter.__init__(self, server, queues, health)
+        self.stop = serve(server)
+
+    @classmethod
+    def from_config(cls, main_config, db_config, queues, health):
+        # Fails here, if the address can't be used.
+        return cls(make_server(main_config.http_address), queues, health)
+
+    def close(self):
+        self.stop()
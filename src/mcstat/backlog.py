@@ -0,0 +1,106 @@
+import logging
+import threading
+
+log = logging.getLogger('mcstat.backlog')
+
+# What happens when a batch is added to a full backlog:
+#   drop     - the oldest batch is dropped,
+#   coalesce - the two oldest batches are merged into one, which keeps only
+#              the newest row of every key.
+overflow_policies = ('drop', 'coalesce')
+
+
+def coalesce(older, newer, key):
+    """
+    Merges two batches of rows, keeping only the newest row of every key.
+
+    Rows keep their order in batches, with rows of newer first.
+    """
+    keys = {key(row) for row in newer}
+    return [row for row in older if key(row) not in keys] + newer
+
+
+class Backlog(object):
+    """
+    Bounded queue of batches, shared by a producer and a consumer thread.
+
+    The producer never blocks: when the backlog is full, the overflow policy
+    decides which data is lost.
+    """
+    def __init__(self, max_batches, overflow='drop', key=None):
+        """
+        :param max_batches: Maximum number of batches (at least 1).
+        :param overflow: One of overflow_policies.
+        :param key: Function, which returns key of row. Required by coalesce
+        policy.
+        """
+        assert overflow in overflow_policies
+        self.max_batches = max(max_batches, 1)
+        self.overflow = overflow
+        self.key = key
+        self.batches = []
+        self.dropped = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        with self.condition:
+            return len(self.batches)
+
+    def put(self, batch):
+        """Adds batch (list of rows) to the end."""
+        with self.condition:
+            self.batches.append(batch)
+            self._shrink()
+            self.condition.notify()
+
+    def put_back(self, batch):
+        """Returns batch, which couldn't be processed, to the front."""
+        with self.condition:
+            self.batches.insert(0, batch)
+            self._shrink()
+            self.condition.notify()
+
+    def _shrink(self):
+        while len(self.batches) > self.max_batches:
+            older, newer = self.batches[:2]
+            if self.overflow == 'coalesce' and self.max_batches > 1:
+                merged = coalesce(older, newer, self.key)
+                self.dropped += len(older) + len(newer) - len(merged)
+                self.batches[:2] = [merged]
+            else:
+                self.dropped += len(older)
+                del self.batches[0]
+            log.warning("Backlog is full, %d rows dropped so far.",
+                        self.dropped)
+
+    def get(self, timeout=None):
+        """
+        Removes and returns the oldest batch. Waits until there is a batch,
+        backlog is closed or timeout expires.
+
+        :return: List of rows or None.
+        """
+        with self.condition:
+            if not self.batches and not self.closed:
+                self.condition.wait(timeout)
+            if self.batches:
+                return self.batches.pop(0)
+            return None
+
+    def wait_closed(self, timeout):
+        """
+        Waits until backlog is closed, a batch is added or timeout expires.
+
+        :return: True if closed.
+        """
+        with self.condition:
+            if not self.closed:
+                self.condition.wait(timeout)
+            return self.closed
+
+    def close(self):
+        """Wakes up the consumer. Batches can still be taken by get()."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
@@ -0,0 +1,122 @@
+from array import array
+
+import math
+
+
+def bucket_layout(interval, bucket_ms):
+    """
+    :param interval: Interval of statistics (in seconds).
+    :param bucket_ms: Length of bucket (in milliseconds), 0 if disabled.
+    :return: (bucket length in seconds, number of buckets), or None.
+    """
+    if not bucket_ms:
+        return None
+    return (bucket_ms / 1000.0,
+            max(int(math.ceil(interval * 1000.0 / bucket_ms)), 1))
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile (0 < p <= 100) of sorted list."""
+    rank = int(math.ceil(p / 100.0 * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+
+class Buckets(object):
+    """
+    Bytes received in consecutive sub-intervals (buckets) of an interval.
+
+    Data received after the last bucket (e.g. when tick is late) is added to
+    the last bucket.
+    """
+    def __init__(self, start, layout):
+        """
+        :param start: Start of the interval (Unix time).
+        :param layout: (bucket length in seconds, number of buckets), see
+        bucket_layout.
+        """
+        self.start = start
+        self.length, num_buckets = layout
+        self.bytes = array('L', [0]) * num_buckets
+
+    def add(self, now, num_bytes):
+        i = int((now - self.start) / self.length)
+        if i >= len(self.bytes):
+            i = len(self.bytes) - 1
+        elif i < 0:
+            i = 0
+        self.bytes[i] += num_bytes
+
+    def __iadd__(self, b):
+        """Adds buckets of the same interval (e.g. from other process)."""
+        for i, num_bytes in enumerate(b.bytes):
+            self.bytes[i] += num_bytes
+        return self
+
+    def fields(self, interval):
+        """
+        :return: Extra fields of metric: minimum, maximum, median and 99th
+        percentile of bitrates of buckets (kbits/second), and the most bytes
+        received in one bucket.
+        """
+        values = sorted(self.bytes)
+        scale = 8.0 / 1024 / self.length
+        return {'bitrate_min': values[0] * scale,
+                'bitrate_max': values[-1] * scale,
+                'bitrate_p50': percentile(values, 50) * scale,
+                'bitrate_p99': percentile(values, 99) * scale,
+                'burst_bytes': values[-1]
+                }
+
+    def rollup(self, b):
+        """
+        Combines with buckets (or summary) of the next interval.
+
+        :return: BurstSummary of both intervals.
+        """
+        return BurstSummary.of(self).rollup(b)
+
+
+class BurstSummary(object):
+    """
+    Burst statistics of consecutive intervals (a rollup), of a fixed size.
+
+    Buckets of the intervals aren't kept, so percentiles are approximated:
+    bitrate_p50 is the mean of medians of the intervals, bitrate_p99 is the
+    highest 99th percentile.
+    """
+    def __init__(self, length, intervals, min_bytes, max_bytes, p50_sum,
+                 p99_max):
+        self.length = length
+        self.intervals = intervals
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.p50_sum = p50_sum
+        self.p99_max = p99_max
+
+    @classmethod
+    def of(cls, buckets):
+        """Summary of Buckets of one interval."""
+        values = sorted(buckets.bytes)
+        return cls(buckets.length, 1, values[0], values[-1],
+                   percentile(values, 50), percentile(values, 99))
+
+    def rollup(self, b):
+        """Combines with Buckets or summary of the next interval."""
+        if isinstance(b, Buckets):
+            b = BurstSummary.of(b)
+        self.intervals += b.intervals
+        self.min_bytes = min(self.min_bytes, b.min_bytes)
+        self.max_bytes = max(self.max_bytes, b.max_bytes)
+        self.p50_sum += b.p50_sum
+        self.p99_max = max(self.p99_max, b.p99_max)
+        return self
+
+    def fields(self, interval):
+        """:return: The same fields as Buckets.fields."""
+        scale = 8.0 / 1024 / self.length
+        return {'bitrate_min': self.min_bytes * scale,
+                'bitrate_max': self.max_bytes * scale,
+                'bitrate_p50': float(self.p50_sum) / self.intervals * scale,
+                'bitrate_p99': self.p99_max * scale,
+                'burst_bytes': self.max_bytes
+                }
@@ -0,0 +1,80 @@
+"""
+Timing of intervals.
+
+Ticks are aligned to multiples of the interval in Unix time (e.g. every
+x.0, x.25, x.5, x.75 second for interval 0.25), and their deadlines are
+absolute, so time spent handling ticks doesn't accumulate into drift.
+Metrics are computed over the time measured (on the monotonic clock)
+between consecutive snapshots of counters - not over the nominal interval,
+which is wrong whenever a snapshot is late.
+"""
+import math
+import time
+
+try:
+    # Python 3.3+
+    monotonic = time.monotonic
+except AttributeError:
+    # Python 2
+    monotonic = time.time
+
+
+def next_boundary(now, interval):
+    """:return: Index of the first multiple of interval after now."""
+    return int(math.floor(now / interval)) + 1
+
+
+def next_index(index, now, interval):
+    """
+    :param index: Index of the next tick (the multiple of interval, when it
+    is due), or None before the first tick.
+    :return: Index of the next tick at now. Ticks missed (e.g. the process
+    was stopped) are skipped, and a step of the system clock realigns ticks.
+    """
+    if index is None or not -interval < index * interval - now <= interval:
+        return next_boundary(now, interval)
+    return index
+
+
+def schedule(interval, wall=time.time, clock=monotonic, sleep=time.sleep):
+    """
+    Waits for ticks.
+
+    Yields (Unix time, monotonic time) of every tick: the multiple of
+    interval, which was due, and the time when the wait ended.
+    """
+    index = None
+    while True:
+        now = wall()
+        index = next_index(index, now, interval)
+        due = index * interval
+        while now < due:
+            sleep(due - now)
+            now = wall()
+        yield due, clock()
+        index += 1
+
+
+class Window(object):
+    """Measures consecutive windows between snapshots of counters."""
+    def __init__(self, start=None):
+        """
+        :param start: Start of the first window. Default: now (monotonic
+        time).
+        """
+        self.last = start if start is not None else monotonic()
+
+    def next(self, now=None, default=None):
+        """
+        Ends the current window at now (default: now monotonic) and starts
+        the next one.
+
+        :param default: Length returned if the window isn't positive (clock
+        of a different source, or the system clock went back on Python 2).
+        :return: Length of the window (in seconds).
+        """
+        if now is None:
+            now = monotonic()
+        elapsed = now - self.last
+        self.last = now
+        return elapsed if elapsed > 0 else default
@@ -1,18 +1,46 @@
-from mcstat.net import is_multicast
+from mcstat.net import is_multicast, has_recvmsg
+from mcstat.analyzer import analyzers
+from mcstat.backlog import overflow_policies
+from mcstat.alert import parse_rule
+from mcstat.health import output_overflow_policies
+from mcstat.output import output_names
 
-import ConfigParser
 import argparse
 import logging
+import math
+import os
+import sys
 from collections import namedtuple
 
+try:
+    # Python 2
+    from ConfigParser import SafeConfigParser as ConfigParser
+except ImportError:
+    # Python 3
+    from configparser import ConfigParser
+
 default_interval = 1
 
+receiver_modes = ('simple', 'batch')
+engines = ('queue', 'counters', 'sharded', 'asyncio')
+
 _Config = namedtuple('Config', ('main', 'db'))
 _Main = namedtuple('Main', ('logging_level', 'channels', 'interval',
-                            'stats_output', 'channels_from_db')
+                            'stats_output', 'channels_from_db',
+                            'receiver_mode', 'flush_interval', 'engine',
+                            'processes', 'shared_sockets', 'read_payload',
+                            'analyzers', 'reload_interval', 'burst_bucket',
+                            'kernel_timestamps', 'outage_threshold',
+                            'output_intervals', 'http_address',
+                            'metric_log_dir', 'metric_log_size', 'pcap',
+                            'receive_buffer', 'channel_receive_buffers',
+                            'busy_poll', 'receiver_cpus', 'alert_rules',
+                            'output_overflow', 'output_queue_sizes')
                    )
 _DB = namedtuple('DB', ('query_sql', 'update_sql', 'host', 'database',
-                        'user', 'password')
+                        'user', 'password', 'batch_ticks', 'backlog',
+                        'overflow', 'spool_dir', 'spool_size', 'event_sql',
+                        'rules_sql', 'alert_sql')
                  )
 
 
@@ -42,7 +70,7 @@ def load_config(file_name):
     Returns:
       Config
     """
-    parser = ConfigParser.SafeConfigParser()
+    parser = ConfigParser()
     parser.read(file_name)
 
     def zz(name, section='main', get=parser.get, proc=lambda x: x):
@@ -57,13 +85,42 @@ def load_config(file_name):
                 }
 
     db_config = cc('db', _DB._fields)
+    db_config.update(batch_ticks=zz('batch_ticks', 'db', parser.getint),
+                     backlog=zz('backlog', 'db', parser.getint),
+                     spool_size=zz('spool_size', 'db', parser.getint))
 
     split = lambda x: x.split()
     addr = lambda x: tuple({multicast_address(a) for a in x.split()})
     main = Main(channels_from_db=zz('channels_from_db', get=parser.getboolean),
-                interval=zz('interval', get=parser.getint),
+                interval=zz('interval', proc=seconds),
                 channels=zz('channels', proc=addr),
-                stats_output=zz('stats_output', proc=split)
+                stats_output=zz('stats_output', proc=split),
+                receiver_mode=zz('receiver_mode'),
+                flush_interval=zz('flush_interval', get=parser.getfloat),
+                engine=zz('engine'),
+                processes=zz('processes', get=parser.getint),
+                shared_sockets=zz('shared_sockets', get=parser.getboolean),
+                read_payload=zz('read_payload', get=parser.getboolean),
+                analyzers=zz('analyzers', proc=split),
+                reload_interval=zz('reload_interval', get=parser.getint),
+                burst_bucket=zz('burst_bucket', get=parser.getint),
+                kernel_timestamps=zz('kernel_timestamps',
+                                     get=parser.getboolean),
+                outage_threshold=zz('outage_threshold', get=parser.getint),
+                output_intervals=zz('output_intervals',
+                                    proc=output_intervals),
+                http_address=zz('http_address', proc=listen_address),
+                metric_log_dir=zz('metric_log_dir'),
+                metric_log_size=zz('metric_log_size', get=parser.getint),
+                receive_buffer=zz('receive_buffer', get=parser.getint),
+                channel_receive_buffers=zz('channel_receive_buffers',
+                                           proc=channel_sizes),
+                busy_poll=zz('busy_poll', get=parser.getint),
+                receiver_cpus=zz('receiver_cpus', proc=cpu_list),
+                alert_rules=zz('alert_rules', proc=alert_rules),
+                output_overflow=zz('output_overflow', proc=output_options),
+                output_queue_sizes=zz('output_queue_sizes',
+                                      proc=output_sizes)
                 )
 
     return Config(main=main,
@@ -94,11 +151,16 @@ def commandline_parser():
                         help='Write statistics to standard out only.'
                         )
 
-    parser.add_argument("-i", dest='interval', type=int,
-                        help="Interval in seconds (default={}).".format(
+    parser.add_argument("-i", dest='interval', type=seconds,
+                        help="Interval in seconds, e.g. 0.25 "
+                        "(default={}).".format(
                             default_interval)
                         )
 
+    parser.add_argument("--pcap", dest='pcap', metavar="FILE",
+                        help="Analyze capture (pcap or pcapng) instead of" +
+                             " receiving, using time of capture.")
+
     parser.add_argument("channel", metavar='channel', nargs='*',
                         type=multicast_address,
                         help='Multicast address (ip:port). If not specified' +
@@ -137,6 +199,148 @@ def multicast_address(string):
     return (addr, port)
 
 
+def seconds(string):
+    """Parses positive interval.
+
+    Args:
+      string: Seconds, e.g. "60" or "0.25".
+
+    Returns:
+      int, or float if the interval is fractional
+    """
+    value = float(string)
+    if not value > 0 or math.isinf(value):
+        raise ValueError("Invalid interval: {!r}".format(string))
+    return int(value) if value.is_integer() else value
+
+
+def is_multiple(interval, shorter):
+    """Whether interval is a multiple of shorter (fractional) interval."""
+    factor = interval / float(shorter)
+    return factor >= 1 and abs(factor - round(factor)) < 1e-6
+
+
+def output_intervals(string):
+    """Parses intervals of outputs.
+
+    Args:
+      string: Space separated OUTPUT:SECONDS, e.g. "db:60 http:0.5".
+
+    Returns:
+      dict (output -> interval in seconds)
+    """
+    intervals = {}
+    for item in string.split():
+        output, _, value = item.partition(':')
+        try:
+            intervals[output] = seconds(value)
+        except ValueError:
+            raise ValueError("Invalid output interval: {!r}".format(item))
+    return intervals
+
+
+def output_options(string):
+    """Parses options of outputs.
+
+    Args:
+      string: Space separated OUTPUT:VALUE, e.g. "http:coalesce db:block".
+
+    Returns:
+      dict (output -> value)
+    """
+    options = {}
+    for item in string.split():
+        output, _, value = item.partition(':')
+        if not value:
+            raise ValueError("Invalid output option: {!r}".format(item))
+        options[output] = value
+    return options
+
+
+def output_sizes(string):
+    """Parses sizes of queues of outputs.
+
+    Args:
+      string: Space separated OUTPUT:SIZE, e.g. "db:5000".
+
+    Returns:
+      dict (output -> size)
+    """
+    sizes = output_options(string)
+    for output, size in sizes.items():
+        if not size.isdigit():
+            raise ValueError("Invalid size: {!r}".format(size))
+        sizes[output] = int(size)
+    return sizes
+
+
+def listen_address(string):
+    """Parses address of a server.
+
+    Args:
+      string: HOST:PORT, host is optional (listen on all interfaces).
+
+    Returns:
+      (string host, port)
+    """
+    host, _, port = string.rpartition(':')
+    if not port.isdigit():
+        raise ValueError("Invalid port: {!r}".format(string))
+    return (host, int(port))
+
+
+def channel_sizes(string):
+    """Parses sizes of channels.
+
+    Args:
+      string: Space separated IP:PORT:SIZE, e.g. "239.0.0.1:1234:16384".
+
+    Returns:
+      dict ((string ip, port) -> size)
+    """
+    sizes = {}
+    for item in string.split():
+        address, _, size = item.rpartition(':')
+        try:
+            channel = multicast_address(address)
+        except argparse.ArgumentTypeError as e:
+            raise ValueError(str(e))
+        if not size.isdigit():
+            raise ValueError("Invalid size: {!r}".format(item))
+        sizes[channel] = int(size)
+    return sizes
+
+
+def cpu_list(string):
+    """Parses list of CPUs.
+
+    Args:
+      string: Space separated CPUs or ranges of CPUs, e.g. "2 4-7".
+
+    Returns:
+      Sorted list of CPU numbers.
+    """
+    cpus = set()
+    for item in string.split():
+        first, dash, last = item.partition('-')
+        if not first.isdigit() or (dash and not last.isdigit()):
+            raise ValueError("Invalid CPU: {!r}".format(item))
+        cpus.update(range(int(first), int(last or first) + 1))
+    return sorted(cpus)
+
+
+def alert_rules(string):
+    """Parses alert rules.
+
+    Args:
+      string: Rules, one per line (see mcstat.alert.parse_rule).
+
+    Returns:
+      List of mcstat.alert.Rule
+    """
+    return [parse_rule(line) for line in string.splitlines() if line.strip()]
+
+
 def merge_configs(*configs):
     """Merges configurations.
 
@@ -150,7 +354,7 @@ def merge_configs(*configs):
     """
 
     def full_vars(obj):
-        return {key: value for key, value in vars(obj).items()
+        return {key: value for key, value in obj._asdict().items()
                 if value is not None}
 
     def merge(a, b):
@@ -191,11 +395,46 @@ def args_to_config(args):
         logging_level=logging_level,
         channels=channels,
         channels_from_db=False if channels else None,
-        interval=args.interval
+        interval=args.interval,
+        pcap=args.pcap
         )
     return Config(main=main)
 
 
+def default_config():
+    """Returns Config with default values."""
+    return Config(main=Main(
+        interval=default_interval,
+        stats_output=['stdout'],
+        channels_from_db=False,
+        receiver_mode='simple',
+        flush_interval=0.0,
+        engine='queue',
+        shared_sockets=False,
+        read_payload=False,
+        analyzers=[],
+        reload_interval=0,
+        burst_bucket=0,
+        kernel_timestamps=False,
+        outage_threshold=0,
+        output_intervals={},
+        http_address=('', 9108),
+        metric_log_size=0,
+        receive_buffer=0,
+        channel_receive_buffers={},
+        busy_poll=0,
+        receiver_cpus=[],
+        alert_rules=[],
+        output_overflow={},
+        output_queue_sizes={}
+        ), db=DB(
+        batch_ticks=1,
+        backlog=60,
+        overflow='drop',
+        spool_size=100
+        ))
+
+
 def make_config(args):
     """Creates final configuration from commandline arguments.
 
@@ -212,13 +451,53 @@ def make_config(args):
     all_configs = [args_to_config(args)]
     if args.config:
         all_configs.append(load_config(args.config))
-    defaults = Config(main=Main(
-        interval=default_interval,
-        stats_output=['stdout'],
-        channels_from_db=False
-        ))
-    all_configs.append(defaults)
+    all_configs.append(default_config())
     config = merge_configs(*all_configs)
     if not (config.main.channels or config.main.channels_from_db):
         parser.error("No channels specified.")
+    if config.main.receiver_mode not in receiver_modes:
+        parser.error("Invalid receiver mode: {!r}".format(
+            config.main.receiver_mode))
+    if config.main.engine not in engines:
+        parser.error("Invalid engine: {!r}".format(config.main.engine))
+    for name in config.main.analyzers:
+        if name not in analyzers:
+            parser.error("Invalid analyzer: {!r}".format(name))
+    if config.db.overflow not in overflow_policies:
+        parser.error("Invalid overflow policy: {!r}".format(
+            config.db.overflow))
+    outputs = output_names()
+    for name in set(config.main.stats_output).union(
+            config.main.output_overflow, config.main.output_queue_sizes):
+        if name not in outputs:
+            parser.error("Invalid output: {!r}".format(name))
+    for name, overflow in sorted(config.main.output_overflow.items()):
+        if overflow not in output_overflow_policies:
+            parser.error("Invalid overflow policy of {}: {!r}".format(
+                name, overflow))
+    intervals = [config.main.interval]
+    for name, interval in sorted(config.main.output_intervals.items(),
+                                 key=lambda item: item[1]):
+        if name not in outputs:
+            parser.error("Invalid output: {!r}".format(name))
+        if not is_multiple(interval, intervals[-1]):
+            parser.error("Interval of {} ({}) isn't a multiple of {}.".format(
+                name, interval, intervals[-1]))
+        intervals.append(interval)
+    if 'metriclog' in config.main.stats_output and \
+            not config.main.metric_log_dir:
+        parser.error("metriclog output requires metric_log_dir.")
+    if config.main.shared_sockets and not has_recvmsg:
+        parser.error("shared_sockets requires Python 3.3 or newer.")
+    if config.main.kernel_timestamps and not has_recvmsg:
+        parser.error("kernel_timestamps requires Python 3.3 or newer.")
+    if config.main.engine == 'asyncio' and sys.version_info < (3, 4):
+        parser.error("asyncio engine requires Python 3.4 or newer.")
+    if config.main.receiver_cpus:
+        if not hasattr(os, 'sched_setaffinity'):
+            parser.error("receiver_cpus requires Python 3.3 or newer.")
+        available = os.sched_getaffinity(0)
+        for cpu in config.main.receiver_cpus:
+            if cpu not in available:
+                parser.error("CPU {} isn't available.".format(cpu))
     return config
@@ -1,54 +1,841 @@
-from mcstat.net import make_multicast_server_socket
-from mcstat.domain import Term, Tick, Sample, Aggr, MetricEvent
-from mcstat.stat import metrics
+from mcstat.net import make_multicast_server_socket, \
+    make_multicast_port_socket, pktinfo_bufsize, pktinfo_destination, \
+    join_multicast_group, leave_multicast_group, enable_timestamps, \
+    timestamp_bufsize, cmsg_timestamp, set_receive_buffer, set_busy_poll
+from mcstat.config import with_defaults
+from mcstat.clock import schedule, Window
+from mcstat.analyzer import make_analyzers, analyze
+from mcstat.domain import Term, Tick, Sample, Removal, Aggr
+from mcstat.counters import CounterTable
+from mcstat.outage import OutageDetector
+from mcstat.stat import table_batch
 
+import errno
+import fcntl
+import os
 import select
+import socket
 import collections
 import time
 import logging
+import threading
 
 log = logging.getLogger('mcstat.core')
 
+# Maximum number of datagrams read from one socket per epoll wake-up, so that
+# a single busy channel can't starve the others.
+max_batch = 256
 
-def receiver(channels, queue, wake_up_fd):
-    # Maps file descriptor to (socket, (ip, port))
+# Maximum size of UDP datagram (rounded up).
+max_datagram_size = 65536
+
+# Size of receive buffer, when payload is read. Datagrams read at once are
+# stored in consecutive parts of the buffer.
+payload_buffer_size = 16 * max_datagram_size
+
+_ReceiveOptions = collections.namedtuple('_ReceiveOptions',
+                                         ('shared_sockets', 'read_payload',
+                                          'analyzers', 'buckets',
+                                          'timestamps', 'outage_threshold',
+                                          'monitor', 'receive_buffer',
+                                          'channel_buffers', 'busy_poll',
+                                          'cpus')
+                                         )
+
+# Options of receiving sockets.
+# shared_sockets: Whether channels with the same port share one socket.
+# read_payload: Whether payload of datagrams is copied to receive buffer.
+# analyzers: Names of analyzers of payload (see mcstat.analyzer). Analyzers
+#            imply read_payload.
+# buckets: Layout of sub-interval buckets (see mcstat.burst.bucket_layout),
+#          or None. Used by receivers, which count in counter tables.
+# timestamps: Whether kernel receive timestamps of datagrams are read
+#             (Aggr.arrivals). Requires recvmsg (Python 3.3+).
+# outage_threshold: Silence (in seconds), after which channel is reported
+#                   as down, or None.
+# monitor: mcstat.health.ReceiverMonitor, which measures sockets and loop of
+#          receiver, or None.
+# receive_buffer: Size of receive buffers of sockets (in bytes), or None for
+#                 the system default.
+# channel_buffers: Dictionary mapping channel to size of its receive buffer
+#                  (overrides receive_buffer), or None.
+# busy_poll: Busy polling of sockets (in microseconds), or None.
+# cpus: List of CPUs, on which the receiver runs, or None for any.
+ReceiveOptions = with_defaults(_ReceiveOptions)
+
+
+def receive_buffer(options):
+    """
+    Makes buffer for receiving datagrams.
+
+    Datagrams are received with MSG_TRUNC, so their real length is known
+    even if they don't fit in the buffer. If payload is not needed, then the
+    buffer is tiny and almost nothing is copied from the kernel.
+
+    :type options: ReceiveOptions
+    """
+    if options.read_payload or options.analyzers:
+        return bytearray(payload_buffer_size)
+    else:
+        return bytearray(1)
+
+
+def drain(sock, buffer, limit=max_batch):
+    """
+    Reads datagrams from non-blocking socket until it would block.
+
+    :param limit: Maximum number of datagrams to read.
+    :return: Aggr with number of datagrams and bytes read. Bytes include
+    parts of datagrams, which didn't fit in the buffer.
+    """
+    packets = 0
+    num_bytes = 0
+    try:
+        while packets < limit:
+            num_bytes += sock.recv_into(buffer, 0, socket.MSG_TRUNC)
+            packets += 1
+    except socket.error as e:
+        if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+            raise
+    return Aggr(packets, num_bytes)
+
+
+def drain_payload(sock, buffer, limit=max_batch):
+    """
+    Reads datagrams from non-blocking socket until it would block, or until
+    the buffer is full. Datagrams are stored in consecutive parts of buffer.
+
+    :param limit: Maximum number of datagrams to read.
+    :return: (Aggr, list of memoryviews of datagrams in buffer)
+    """
+    view = memoryview(buffer)
+    end = len(buffer) - max_datagram_size
+    offset = 0
+    datagrams = []
+    try:
+        while len(datagrams) < limit and offset <= end:
+            num_bytes = sock.recv_into(view[offset:], 0, socket.MSG_TRUNC)
+            datagrams.append(view[offset:offset + num_bytes])
+            offset += num_bytes
+    except socket.error as e:
+        if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+            raise
+    return Aggr(len(datagrams), offset), datagrams
+
+
+def drain_timestamps(sock, buffer, limit=max_batch, payloads=None):
+    """
+    Like drain, but also reads kernel receive timestamps of datagrams into
+    Aggr.arrivals.
+
+    :param payloads: If not None, list to be extended with memoryviews of
+    datagrams, which are then stored in consecutive parts of buffer, like
+    in drain_payload.
+    :rtype: Aggr
+    """
+    view = memoryview(buffer)
+    buffers = [buffer]
+    end = len(buffer) - max_datagram_size
+    offset = 0
+    arrivals = []
+    # Datagram without timestamp gets the previous one, the clock is read
+    # only if the first datagram has none.
+    last = None
+    try:
+        while len(arrivals) < limit:
+            if payloads is not None:
+                if offset > end:
+                    break
+                buffers = [view[offset:]]
+            num_bytes, ancdata, _, _ = sock.recvmsg_into(
+                buffers, timestamp_bufsize, socket.MSG_TRUNC)
+            last = cmsg_timestamp(ancdata) or last or time.time()
+            arrivals.append((last, num_bytes))
+            if payloads is not None:
+                payloads.append(view[offset:offset + num_bytes])
+                offset += num_bytes
+    except socket.error as e:
+        if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+            raise
+    return Aggr(len(arrivals), sum(size for _, size in arrivals),
+                arrivals=arrivals)
+
+
+def drain_demux(sock, buffer, channels_by_addr, limit=max_batch,
+                payloads=None, timestamps=False):
+    """
+    Reads datagrams from non-blocking socket shared by several channels
+    until it would block.
+
+    :param channels_by_addr: Maps packed destination address to channel.
+    Datagrams sent to other addresses are ignored.
+    :param limit: Maximum number of datagrams to read.
+    :param payloads: If not None, dictionary to be updated with mapping of
+    channel to list of memoryviews of its datagrams. Datagrams are then
+    stored in consecutive parts of buffer, like in drain_payload.
+    :param timestamps: Whether kernel receive timestamps are read into
+    Aggr.arrivals.
+    :return: Dictionary mapping channel to Aggr.
+    """
+    aggrs = {}
+    view = memoryview(buffer)
+    buffers = [buffer]
+    end = len(buffer) - max_datagram_size
+    offset = 0
+    ancbufsize = pktinfo_bufsize
+    if timestamps:
+        ancbufsize += timestamp_bufsize
+    # Like in drain_timestamps.
+    last = None
+    try:
+        for _ in range(limit):
+            if payloads is not None:
+                if offset > end:
+                    break
+                buffers = [view[offset:]]
+            num_bytes, ancdata, _, _ = sock.recvmsg_into(
+                buffers, ancbufsize, socket.MSG_TRUNC)
+            channel = channels_by_addr.get(pktinfo_destination(ancdata))
+            if channel is None:
+                continue
+            aggr = aggrs.get(channel)
+            if aggr is None:
+                aggr = aggrs[channel] = Aggr(0, 0, arrivals=[] if timestamps
+                                             else None)
+            aggr.packets += 1
+            aggr.bytes += num_bytes
+            if timestamps:
+                last = cmsg_timestamp(ancdata) or last or time.time()
+                aggr.arrivals.append((last, num_bytes))
+            if payloads is not None:
+                payloads.setdefault(channel, []).append(
+                    view[offset:offset + num_bytes])
+                offset += num_bytes
+    except socket.error as e:
+        if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+            raise
+    return aggrs
+
+
+class ChannelSocket(object):
+    """Socket, which receives datagrams of a single channel."""
+    def __init__(self, channel, analyzer_names=None, timestamps=False):
+        ip, port = channel
+        self.channels = [channel]
+        self.sock = make_multicast_server_socket(ip, port)
+        self.analyzers = make_analyzers(analyzer_names or [])
+        self.timestamps = timestamps
+        if timestamps:
+            enable_timestamps(self.sock)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+    def drain(self, buffer, limit=max_batch):
+        """
+        :return: List of (channel, Aggr) of channels with received datagrams.
+        """
+        if self.timestamps:
+            datagrams = [] if self.analyzers else None
+            aggr = drain_timestamps(self.sock, buffer, limit, datagrams)
+            if datagrams:
+                arrivals = [arrival for arrival, _ in aggr.arrivals]
+                aggr.extra = analyze(self.analyzers, datagrams, arrivals)
+        elif self.analyzers:
+            aggr, datagrams = drain_payload(self.sock, buffer, limit)
+            if aggr.packets:
+                arrivals = [time.time()] * len(datagrams)
+                aggr.extra = analyze(self.analyzers, datagrams, arrivals)
+        else:
+            aggr = drain(self.sock, buffer, limit)
+        return [(self.channels[0], aggr)] if aggr.packets else []
+
+
+class PortSocket(object):
+    """Socket, which receives datagrams of all channels with the same port."""
+    def __init__(self, port, ips, analyzer_names=None, timestamps=False):
+        self.port = port
+        self.channels = [(ip, port) for ip in ips]
+        self.sock = make_multicast_port_socket(ips, port)
+        self.timestamps = timestamps
+        if timestamps:
+            enable_timestamps(self.sock)
+        self.channels_by_addr = {socket.inet_aton(ip): (ip, port)
+                                 for ip in ips}
+        self.analyzer_names = analyzer_names
+        if analyzer_names:
+            self.analyzers = {channel: make_analyzers(analyzer_names)
+                              for channel in self.channels}
+        else:
+            self.analyzers = None
+
+    def join(self, ip):
+        """Adds channel with multicast group ip."""
+        join_multicast_group(self.sock, ip)
+        channel = (ip, self.port)
+        self.channels.append(channel)
+        self.channels_by_addr[socket.inet_aton(ip)] = channel
+        if self.analyzers is not None:
+            self.analyzers[channel] = make_analyzers(self.analyzer_names)
+
+    def leave(self, ip):
+        """Removes channel with multicast group ip."""
+        leave_multicast_group(self.sock, ip)
+        channel = (ip, self.port)
+        self.channels.remove(channel)
+        del self.channels_by_addr[socket.inet_aton(ip)]
+        if self.analyzers is not None:
+            del self.analyzers[channel]
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+    def drain(self, buffer, limit=max_batch):
+        """
+        :return: List of (channel, Aggr) of channels with received datagrams.
+        """
+        payloads = {} if self.analyzers else None
+        aggrs = drain_demux(self.sock, buffer, self.channels_by_addr, limit,
+                            payloads, self.timestamps)
+        if payloads:
+            now = None if self.timestamps else time.time()
+            for channel, datagrams in payloads.items():
+                if self.timestamps:
+                    arrivals = [arrival for arrival, _
+                                in aggrs[channel].arrivals]
+                else:
+                    arrivals = [now] * len(datagrams)
+                aggrs[channel].extra = analyze(self.analyzers[channel],
+                                               datagrams, arrivals)
+        return list(aggrs.items())
+
+
+def requested_buffer(channels, options):
+    """
+    :return: Size of receive buffer of socket of channels (the largest of
+    them), 0 for the system default.
+    """
+    buffers = options.channel_buffers or {}
+    return max(buffers.get(channel, options.receive_buffer) or 0
+               for channel in channels)
+
+
+def tune_sockets(socks, options):
+    """
+    Sets receive buffers and busy polling of sockets (ChannelSocket or
+    PortSocket), and logs their effective values.
+    """
+    buffers = []
+    limited = 0
+    polls = []
+    for sock in socks:
+        size = requested_buffer(sock.channels, options)
+        if size:
+            effective = set_receive_buffer(sock.sock, size)
+            buffers.append(effective)
+            if effective < 2 * size:
+                limited += 1
+            log.debug("Receive buffer of %s: %d bytes (requested %d).",
+                      " ".join("{}:{}".format(*c) for c in sock.channels),
+                      effective, size)
+        if options.busy_poll:
+            polls.append(set_busy_poll(sock.sock, options.busy_poll))
+    if buffers:
+        log.info("Receive buffers of %d socket(s): %d - %d KB (effective, "
+                 "doubled by the kernel).", len(buffers),
+                 min(buffers) >> 10, max(buffers) >> 10)
+    if limited:
+        log.warning("Receive buffers of %d socket(s) are smaller than "
+                    "requested: raise sysctl net.core.rmem_max, or run "
+                    "with CAP_NET_ADMIN.", limited)
+    if polls:
+        if min(polls) < options.busy_poll:
+            log.warning("Busy poll of %d socket(s) is %d us instead of %d "
+                        "us: requires CAP_NET_ADMIN.",
+                        sum(1 for p in polls if p < options.busy_poll),
+                        min(polls), options.busy_poll)
+        else:
+            log.info("Busy poll of %d socket(s): %d us.", len(polls),
+                     options.busy_poll)
+
+
+def pin_receiver(options):
+    """Pins the calling thread (or process) to options.cpus, if set."""
+    if options.cpus:
+        os.sched_setaffinity(0, options.cpus)
+        log.info("Receiver runs on CPU(s) %s.",
+                 " ".join(str(cpu) for cpu in sorted(os.sched_getaffinity(0))))
+
+
+def open_channels(channels, epoll, socks_map, options=ReceiveOptions()):
+    """
+    Opens multicast sockets of channels and registers them in epoll.
+
+    :param socks_map: Dictionary to be updated with mapping of file
+    descriptor to ChannelSocket or PortSocket.
+    :type options: ReceiveOptions
+    """
+    if options.shared_sockets:
+        ips_by_port = collections.defaultdict(list)
+        for ip, port in channels:
+            ips_by_port[port].append(ip)
+        socks = (PortSocket(port, ips, options.analyzers, options.timestamps)
+                 for port, ips in sorted(ips_by_port.items()))
+    else:
+        socks = (ChannelSocket(channel, options.analyzers, options.timestamps)
+                 for channel in channels)
+
+    opened = []
+    for sock in socks:
+        socks_map[sock.fileno()] = sock
+        epoll.register(sock.fileno(), select.EPOLLIN)
+        if options.monitor is not None:
+            options.monitor.register(sock)
+        opened.append(sock)
+    tune_sockets(opened, options)
+
+
+def close_channels(epoll, socks_map):
+    """Unregisters sockets from epoll and closes them."""
+    for sock in socks_map.values():
+        epoll.unregister(sock.fileno())
+        sock.close()
+    socks_map.clear()
+
+
+def all_channels(socks_map):
+    """Returns channels of all sockets."""
+    return [channel for sock in socks_map.values()
+            for channel in sock.channels]
+
+
+def update_channels(channels, epoll, socks_map, options=ReceiveOptions()):
+    """
+    Changes open channels to the given ones. Only sockets of added and
+    removed channels are opened and closed (or their groups are joined and
+    left, if sockets are shared), other channels aren't disturbed.
+
+    :return: (added, removed) - sorted lists of channels.
+    """
+    current = set(all_channels(socks_map))
+    added = sorted(set(channels) - current)
+    removed = sorted(current - set(channels))
+
+    if options.shared_sockets:
+        socks_by_port = {sock.port: sock for sock in socks_map.values()}
+        for ip, port in removed:
+            sock = socks_by_port[port]
+            sock.leave(ip)
+            if not sock.channels:
+                close_socket(sock, epoll, socks_map)
+                del socks_by_port[port]
+        new = []
+        for ip, port in added:
+            if port in socks_by_port:
+                socks_by_port[port].join(ip)
+            else:
+                new.append((ip, port))
+        open_channels(new, epoll, socks_map, options)
+    else:
+        removed_set = set(removed)
+        for sock in list(socks_map.values()):
+            if sock.channels[0] in removed_set:
+                close_socket(sock, epoll, socks_map)
+        open_channels(added, epoll, socks_map, options)
+    return added, removed
+
+
+def close_socket(sock, epoll, socks_map):
+    epoll.unregister(sock.fileno())
+    del socks_map[sock.fileno()]
+    sock.close()
+
+
+class ChannelUpdates(object):
+    """
+    Control pipe, which passes new lists of channels to receiver.
+
+    Receiver polls fileno() together with its sockets, and takes only the
+    latest list, if several were sent in the meantime.
+    """
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+        make_nonblocking(self.read_fd)
+        self.lock = threading.Lock()
+        self.channels = None
+
+    def fileno(self):
+        return self.read_fd
+
+    def send(self, channels):
+        with self.lock:
+            self.channels = list(channels)
+        os.write(self.write_fd, b'\0')
+
+    def take(self):
+        """
+        :return: The latest list of channels, or None if it was already
+        taken.
+        """
+        try:
+            while os.read(self.read_fd, 4096):
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+        with self.lock:
+            channels, self.channels = self.channels, None
+        return channels
+
+
+def make_nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL, 0)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+def register_updates(epoll, updates):
+    """
+    Registers ChannelUpdates in receiver's epoll.
+
+    :return: File descriptor of updates, or None if updates is None.
+    """
+    if updates is None:
+        return None
+    epoll.register(updates.fileno(), select.EPOLLIN)
+    return updates.fileno()
+
+
+def apply_updates(updates, epoll, socks_map, options, detector=None):
+    """
+    Changes open channels to the latest list sent to updates.
+
+    :type detector: mcstat.outage.OutageDetector
+    :return: (added, removed) - lists of channels.
+    """
+    channels = updates.take()
+    if channels is None:
+        return [], []
+    started = time.time()
+    added, removed = update_channels(channels, epoll, socks_map, options)
+    if not (added or removed):
+        return added, removed
+    if detector is not None:
+        detector.add(added, started)
+        detector.remove(removed)
+    log.info("Channels updated in %.1f ms: %d added, %d removed.",
+             (time.time() - started) * 1000, len(added), len(removed))
+    for channel in added:
+        log.info("Added channel %s:%d", channel[0], channel[1])
+    for channel in removed:
+        log.info("Removed channel %s:%d", channel[0], channel[1])
+    return added, removed
+
+
+def make_detector(socks_map, options):
+    """
+    :return: OutageDetector of all channels, or None if it's not enabled.
+    """
+    if not options.outage_threshold:
+        return None
+    return OutageDetector(options.outage_threshold, all_channels(socks_map),
+                          time.time())
+
+
+def poll_timeout(detector, timeout=-1):
+    """
+    Returns epoll timeout, which is at most the time until the next deadline
+    of detector.
+    """
+    if detector is None:
+        return timeout
+    deadline = detector.timeout(time.time())
+    if timeout < 0:
+        return deadline
+    return timeout if deadline < 0 else min(timeout, deadline)
+
+
+def send_updates(queue, now, added, removed):
+    """Tells worker about added and removed channels."""
+    for channel in added:
+        queue.put_nowait(Sample(now, channel, Aggr.empty()))
+    for channel in removed:
+        queue.put_nowait(Removal(now, channel))
+
+
+def loop_time(received, clock, timestamps):
+    """
+    Returns time of iteration of receiver loop. With kernel timestamps, it's
+    the timestamp of the first datagram received in the iteration, so that
+    the clock isn't read on every wake-up. Otherwise (or without datagrams),
+    it's clock, or the current time if clock is None.
+
+    :param received: List of (channel, Aggr) received in the iteration.
+    :param clock: Time read after the wake-up, or None.
+    """
+    if timestamps:
+        for _, aggr in received:
+            if aggr.arrivals:
+                return aggr.arrivals[0][0]
+    return clock if clock is not None else time.time()
+
+
+def receiver(channels, queue, wake_up_fd, options=ReceiveOptions(),
+             updates=None):
+    """
+    :param updates: ChannelUpdates, or None if channels don't change.
+    """
+    # Maps file descriptor to ChannelSocket or PortSocket
     socks_map = {}
     epoll = select.epoll()
 
-    buffer = bytearray(4096)
+    buffer = receive_buffer(options)
+    monitor = options.monitor
+    # With timestamps, the clock is read after wake-up only to measure the
+    # loop (see loop_time).
+    read_clock = monitor is not None or not options.timestamps
+    pin_receiver(options)
 
     try:
-        for ip, port in channels:
-            sock = make_multicast_server_socket(ip, port)
-            socks_map[sock.fileno()] = (sock, (ip, port))
-            epoll.register(sock.fileno(), select.EPOLLIN)
+        open_channels(channels, epoll, socks_map, options)
+        epoll.register(wake_up_fd, select.EPOLLIN)
+        updates_fd = register_updates(epoll, updates)
+
+        now = time.time()
+        for channel in all_channels(socks_map):
+            queue.put_nowait(Sample(now, channel, Aggr.empty()))
+        detector = make_detector(socks_map, options)
+
+        loop = True
+
+        while loop:
+            events = epoll.poll(poll_timeout(detector))
+            started = time.time() if read_clock else None
+            update = False
+            drained = []
+            for fileno, event in events:
+                if fileno == wake_up_fd:
+                    loop = False
+                    break
+                if fileno == updates_fd:
+                    update = True
+                    continue
+                drained.extend(socks_map[fileno].drain(buffer, 1))
+            now = loop_time(drained, started, options.timestamps)
+            received = []
+            for channel, aggr in drained:
+                queue.put_nowait(Sample(now, channel, aggr))
+                received.append(channel)
+            if detector is not None:
+                for event in detector.check(received, now):
+                    queue.put_nowait(event)
+            if update:
+                added, removed = apply_updates(updates, epoll, socks_map,
+                                               options, detector)
+                send_updates(queue, now, added, removed)
+            if monitor is not None:
+                monitor.loop(time.time() - started)
+    finally:
+        close_channels(epoll, socks_map)
+        epoll.close()
+        send_term(queue)
+
+
+def batch_receiver(channels, queue, wake_up_fd, flush_interval=0,
+                   options=ReceiveOptions(), updates=None):
+    """
+    Receiver, which drains every ready socket and sends one aggregated
+    sample per channel, instead of one sample per datagram.
+
+    :param flush_interval: Minimum time (in seconds) between sending samples.
+    If 0, then samples are sent after every epoll wake-up.
+    :param updates: ChannelUpdates, or None if channels don't change.
+    """
+    # Maps file descriptor to ChannelSocket or PortSocket
+    socks_map = {}
+    epoll = select.epoll()
 
+    buffer = receive_buffer(options)
+    monitor = options.monitor
+    # With timestamps, the clock is read after wake-up only to measure the
+    # loop (see loop_time).
+    read_clock = monitor is not None or not options.timestamps
+    pin_receiver(options)
+
+    try:
+        open_channels(channels, epoll, socks_map, options)
         epoll.register(wake_up_fd, select.EPOLLIN)
+        updates_fd = register_updates(epoll, updates)
 
         now = time.time()
-        for _, channel in socks_map.values():
+        for channel in all_channels(socks_map):
             queue.put_nowait(Sample(now, channel, Aggr.empty()))
 
+        detector = make_detector(socks_map, options)
+
+        # Maps channel to Aggr not sent yet.
+        pending = {}
+        last_flush = now
+        loop = True
+
+        while loop:
+            if pending and flush_interval > 0:
+                timeout = max(last_flush + flush_interval - time.time(), 0)
+            else:
+                timeout = -1
+            events = epoll.poll(poll_timeout(detector, timeout))
+            started = time.time() if read_clock else None
+            update = False
+            drained = []
+            for fileno, event in events:
+                if fileno == wake_up_fd:
+                    loop = False
+                    break
+                if fileno == updates_fd:
+                    update = True
+                    continue
+                drained.extend(socks_map[fileno].drain(buffer))
+            now = loop_time(drained, started, options.timestamps)
+            received = []
+            for channel, aggr in drained:
+                received.append(channel)
+                if channel in pending:
+                    pending[channel] += aggr
+                else:
+                    pending[channel] = aggr
+            if detector is not None:
+                for event in detector.check(received, now):
+                    queue.put_nowait(event)
+            if update:
+                added, removed = apply_updates(updates, epoll, socks_map,
+                                               options, detector)
+                for channel in removed:
+                    pending.pop(channel, None)
+                send_updates(queue, now, added, removed)
+            if pending and (not loop or now - last_flush >= flush_interval):
+                for channel, aggr in pending.items():
+                    queue.put_nowait(Sample(now, channel, aggr))
+                pending = {}
+                last_flush = now
+            if monitor is not None:
+                monitor.loop(time.time() - started)
+    finally:
+        close_channels(epoll, socks_map)
+        epoll.close()
+        send_term(queue)
+
+
+def counter_receiver(counters, queue, wake_up_fd, options=ReceiveOptions(),
+                     updates=None):
+    """
+    Receiver, which adds received datagrams to shared counters, instead of
+    sending samples to the worker.
+
+    :type counters: mcstat.counters.SharedCounters
+    :param queue: Queue, which receives Term when receiver ends.
+    :param updates: ChannelUpdates, or None if channels don't change.
+    """
+    # Maps file descriptor to ChannelSocket or PortSocket
+    socks_map = {}
+    epoll = select.epoll()
+
+    buffer = receive_buffer(options)
+    monitor = options.monitor
+    # With timestamps, the clock is read after wake-up only to measure the
+    # loop (see loop_time).
+    read_clock = monitor is not None or not options.timestamps
+    pin_receiver(options)
+    channels = counters.channels
+    slots = {channel: slot for slot, channel in enumerate(channels)}
+
+    try:
+        open_channels(channels, epoll, socks_map, options)
+        epoll.register(wake_up_fd, select.EPOLLIN)
+        updates_fd = register_updates(epoll, updates)
+        detector = make_detector(socks_map, options)
+
         loop = True
 
         while loop:
-            events = epoll.poll()
-            now = time.time()
+            events = epoll.poll(poll_timeout(detector))
+            started = time.time() if read_clock else None
+            received = []
+            update = False
             for fileno, event in events:
                 if fileno == wake_up_fd:
                     loop = False
                     break
-                sock, channel = socks_map[fileno]
-                num_bytes = sock.recv_into(buffer)
-                queue.put_nowait(Sample(now, channel, Aggr(1, num_bytes)))
+                if fileno == updates_fd:
+                    update = True
+                    continue
+                received.extend(socks_map[fileno].drain(buffer))
+            now = loop_time(received, started, options.timestamps)
+            with counters.lock:
+                table = counters.table
+                for channel, aggr in received:
+                    table.add(slots[channel], aggr.packets, aggr.bytes,
+                              aggr.extra, now, aggr.arrivals)
+            if detector is not None:
+                for event in detector.check(
+                        [channel for channel, _ in received], now):
+                    queue.put_nowait(event)
+            if update:
+                added, removed = apply_updates(updates, epoll, socks_map,
+                                               options, detector)
+                if added or removed:
+                    channels = sorted(all_channels(socks_map))
+                    counters.set_channels(channels)
+                    slots = {channel: slot
+                             for slot, channel in enumerate(channels)}
+            if monitor is not None:
+                monitor.loop(time.time() - started)
     finally:
-        for sock, _ in socks_map.values():
-            epoll.unregister(sock.fileno())
-            sock.close()
+        close_channels(epoll, socks_map)
         epoll.close()
         send_term(queue)
 
 
+def counter_worker(interval, counters, queue_in, queues_out, health=None):
+    """
+    Worker, which reads shared counters on every tick.
+
+    :type counters: mcstat.counters.SharedCounters
+    :param queue_in: Queue with Tick and Term events.
+    :type health: mcstat.health.Health
+    """
+    def send_all(obj):
+        for queue in queues_out:
+            queue.put_nowait(obj)
+
+    window = Window()
+    try:
+        while True:
+            event = queue_in.get()
+            if event.is_term():
+                send_all(event)
+                break
+            elif event.is_tick():
+                now = event.timestamp
+                log.debug("%.03f: Tick", now)
+                channels, table = counters.swap()
+                # Counted until the swap, however late the tick is.
+                elapsed = window.next(default=interval)
+                drops = health.tick(now) if health is not None else None
+                send_all(table_batch(now, interval, channels, table, drops,
+                                     elapsed))
+                send_all(event)
+            elif event.is_stream_event():
+                send_all(event)
+            queue_in.task_done()
+    finally:
+        send_term(*queues_out)
+
+
 def send_term(*queues):
     """Send termination event to the given queue."""
     now = time.time()
@@ -56,8 +843,35 @@ def send_term(*queues):
         queue.put_nowait(Term(now))
 
 
-def worker(interval, queue_in, queues_out):
-    aggrs = collections.defaultdict(Aggr.empty)
+def wait_for_queues(queues, max_size):
+    """
+    Waits until every queue has at most max_size events. Used by producers,
+    which are faster than real time.
+    """
+    while any(queue.qsize() > max_size for queue in queues):
+        time.sleep(0.01)
+
+
+def worker(interval, queue_in, queues_out, layout=None, window_start=None,
+           health=None, table_start=None):
+    """
+    Worker, which counts samples from receiver in a counter table and sends
+    metrics of all channels (MetricBatch) on every tick.
+
+    :param layout: Layout of sub-interval buckets (see
+    mcstat.burst.bucket_layout), or None.
+    :param window_start: Start of the first interval, in the time of
+    Tick.clock (monotonic). Default: now.
+    :type health: mcstat.health.Health
+    :param table_start: Start of the first interval, in the time of
+    Tick.timestamp (Unix time), where sub-interval buckets start. Default:
+    now.
+    """
+    window = Window(window_start)
+    # Channels in order of slots of the table.
+    channels = []
+    slots = {}
+    table = CounterTable(0, layout, table_start)
 
     def send_all(obj):
         for queue in queues_out:
@@ -73,20 +887,38 @@ def worker(interval, queue_in, queues_out):
                 if event.is_tick():
                     now = event.timestamp
                     log.debug("%.03f: Tick", now)
-                    for channel, aggr in aggrs.items():
-                        m = metrics(now, interval, channel, aggr)
-                        send_all(MetricEvent(m))
-                    aggrs = {key: Aggr.empty() for key in aggrs}
+                    # Samples before the tick were counted until it.
+                    elapsed = window.next(event.clock, interval)
+                    drops = health.tick(now) if health is not None else None
+                    send_all(table_batch(now, interval, channels, table,
+                                         drops, elapsed))
+                    # Tick ends metrics of the interval.
+                    send_all(event)
+                    table = CounterTable(len(channels), layout, now)
+                elif event.is_removal():
+                    slot = slots.pop(event.channel, None)
+                    if slot is not None:
+                        del channels[slot]
+                        table.remove(slot)
+                        slots = {channel: slot
+                                 for slot, channel in enumerate(channels)}
+                elif event.is_stream_event():
+                    send_all(event)
                 else:
-                    aggr = aggrs[event.channel]
-                    aggr += event.aggr
+                    slot = slots.get(event.channel)
+                    if slot is None:
+                        slot = slots[event.channel] = len(channels)
+                        channels.append(event.channel)
+                        table.append()
+                    aggr = event.aggr
+                    table.add(slot, aggr.packets, aggr.bytes, aggr.extra,
+                              event.timestamp, aggr.arrivals)
             queue_in.task_done()
     finally:
         send_term(*queues_out)
 
 
 def ping(interval, queue):
-    while True:
-        time.sleep(interval)
-        now = time.time()
-        queue.put_nowait(Tick(now))
+    """Sends Tick every interval (see mcstat.clock.schedule)."""
+    for now, clock in schedule(interval):
+        queue.put_nowait(Tick(now, clock))
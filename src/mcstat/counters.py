@@ -0,0 +1,128 @@
+from mcstat.burst import Buckets
+from mcstat.domain import merge_extra
+
+from array import array
+
+import threading
+import time
+
+
+class CounterTable(object):
+    """
+    Packet and byte counters of channels, indexed by channel slot.
+
+    Partial statistics of analyzers are kept in extras, which is None for
+    channels without them.
+    """
+    def __init__(self, size, layout=None, start=None):
+        """
+        :param layout: Layout of sub-interval buckets (see
+        mcstat.burst.bucket_layout), or None.
+        :param start: Start of the interval (Unix time), default now.
+        """
+        self.packets = array('L', [0]) * size
+        self.bytes = array('L', [0]) * size
+        self.extras = [None] * size
+        self.layout = layout
+        self.start = start if start is not None else time.time()
+        if layout is not None:
+            self.buckets = [Buckets(self.start, layout) for _ in range(size)]
+        else:
+            self.buckets = None
+
+    def __len__(self):
+        return len(self.packets)
+
+    def add(self, slot, packets, num_bytes, extra=None, now=None,
+            arrivals=None):
+        """
+        :param now: Time, when bytes were received. Buckets are updated only
+        if it's given.
+        :param arrivals: Receive timestamps and sizes of datagrams (see
+        Aggr.arrivals). If given, buckets are updated with them instead of
+        now.
+        """
+        self.packets[slot] += packets
+        self.bytes[slot] += num_bytes
+        if extra:
+            self.extras[slot] = merge_extra(self.extras[slot], extra)
+        if self.buckets is not None:
+            if arrivals:
+                buckets = self.buckets[slot]
+                for arrival, size in arrivals:
+                    buckets.add(arrival, size)
+            elif now is not None:
+                self.buckets[slot].add(now, num_bytes)
+
+    def append(self):
+        """Adds a slot after the last one."""
+        self.packets.append(0)
+        self.bytes.append(0)
+        self.extras.append(None)
+        if self.buckets is not None:
+            self.buckets.append(Buckets(self.start, self.layout))
+
+    def remove(self, slot):
+        """Removes a slot, the following slots move down by one."""
+        del self.packets[slot]
+        del self.bytes[slot]
+        del self.extras[slot]
+        if self.buckets is not None:
+            del self.buckets[slot]
+
+    def add_buckets(self, slot, buckets):
+        """Adds buckets of the same interval, e.g. from other table."""
+        if self.buckets is not None and buckets is not None:
+            self.buckets[slot] += buckets
+
+
+class SharedCounters(object):
+    """
+    Counter table shared between receiver and worker.
+
+    Receiver adds to the current table, worker swaps it for an empty one
+    on every tick. Both happen under a lock, so no update is lost.
+    """
+    def __init__(self, channels, layout=None):
+        """
+        :param channels: List of channels. Channel's slot in counter table is
+        its index in this list.
+        :param layout: Layout of sub-interval buckets, or None.
+        """
+        self.lock = threading.Lock()
+        self.channels = list(channels)
+        self.layout = layout
+        self.table = CounterTable(len(self.channels), layout)
+
+    def swap(self):
+        """
+        Replaces current table with an empty one.
+
+        :return: (channels, table) - previous table and its channels.
+        """
+        with self.lock:
+            channels, table = self.channels, self.table
+            self.table = CounterTable(len(channels), self.layout)
+        return channels, table
+
+    def set_channels(self, channels):
+        """
+        Replaces list of channels. Counters of channels, which remain, are
+        kept (in their new slots).
+        """
+        with self.lock:
+            old_slots = {channel: slot
+                         for slot, channel in enumerate(self.channels)}
+            table = self.table
+            new_table = CounterTable(len(channels), self.layout,
+                                     table.start)
+            for slot, channel in enumerate(channels):
+                old_slot = old_slots.get(channel)
+                if old_slot is not None:
+                    new_table.packets[slot] = table.packets[old_slot]
+                    new_table.bytes[slot] = table.bytes[old_slot]
+                    new_table.extras[slot] = table.extras[old_slot]
+                    if table.buckets is not None:
+                        new_table.buckets[slot] = table.buckets[old_slot]
+            self.channels = list(channels)
+            self.table = new_table
@@ -1,3 +1,7 @@
+import collections
+import itertools
+
+
 class Event(object):
     """Base event sent via channels between threads."""
     def __init__(self, timestamp):
@@ -9,6 +13,18 @@ class Event(object):
     def is_tick(self):
         return False
 
+    def is_removal(self):
+        return False
+
+    def is_stream_event(self):
+        return False
+
+    def is_batch(self):
+        return False
+
+    def is_alert(self):
+        return False
+
 
 class Term(Event):
     """Program termination."""
@@ -17,11 +33,68 @@ class Term(Event):
 
 
 class Tick(Event):
-    """Sent every second."""
+    """
+    Sent every interval. Workers forward it to backends after metrics of the
+    interval.
+    """
+    def __init__(self, timestamp, clock=None):
+        """
+        :param clock: Time of the tick, from which the length of the interval
+        is measured (see mcstat.clock.Window). Default: timestamp.
+        """
+        Event.__init__(self, timestamp)
+        self.clock = clock if clock is not None else timestamp
+
     def is_tick(self):
         return True
 
 
+class Removal(Event):
+    """Channel was removed."""
+    def __init__(self, timestamp, channel):
+        Event.__init__(self, timestamp)
+        self.channel = channel
+
+    def is_removal(self):
+        return True
+
+
+class StreamEvent(Event):
+    """Channel stopped ('down') or started again ('up') receiving data."""
+    def __init__(self, timestamp, channel, state, last_seen=None):
+        """
+        :param state: 'down' or 'up'.
+        :param last_seen: Time of the last datagram before channel went down,
+        None if it didn't receive any (or state is 'up').
+        """
+        Event.__init__(self, timestamp)
+        self.channel = channel
+        self.state = state
+        self.last_seen = last_seen
+
+    def is_stream_event(self):
+        return True
+
+
+class Alert(Event):
+    """Alert of a rule was raised or cleared for channel."""
+    def __init__(self, timestamp, channel, rule, state, value=None):
+        """
+        :param rule: Name of the rule (see mcstat.alert.Rule).
+        :param state: 'raise' or 'clear'.
+        :param value: Value of the field of the rule in the interval, None if
+        it isn't known (e.g. the rule was removed).
+        """
+        Event.__init__(self, timestamp)
+        self.channel = channel
+        self.rule = rule
+        self.state = state
+        self.value = value
+
+    def is_alert(self):
+        return True
+
+
 class Sample(Event):
     """Data sample."""
     def __init__(self, timestamp, channel, aggr):
@@ -30,34 +103,128 @@ class Sample(Event):
         self.aggr = aggr
 
 
-class MetricEvent(Event):
-    """Event with metric."""
-    def __init__(self, metric):
+# Counts of channels in an interval, from which metrics were computed (used
+# by rollups).
+# packets, bytes: Sequences of numbers of datagrams and bytes.
+# extras: List of partial statistics (like Aggr.extra) or None, or None if no
+#         channel has them.
+Counts = collections.namedtuple('Counts', ('packets', 'bytes', 'extras'))
+
+
+class MetricBatch(Event):
+    """
+    Metrics of all channels of one interval, in columns: the i-th item of
+    every column belongs to the i-th channel.
+
+    Workers send one batch per tick, the same object to every output, so
+    batches must not be modified.
+    """
+    def __init__(self, timestamp, interval, channels, bitrate, packets,
+                 extra=None, counts=None, elapsed=None):
+        """
+        :param interval: Length of the interval (in seconds), as configured.
+        :type channels: tuple of (string ip, port)
+        :param bitrate: kbits/second of channels.
+        :param packets: packets/second of channels.
+        :param extra: Extra fields of channels (list of dicts), or None if no
+        channel has them.
+        :param counts: Counts of the interval, or None if they aren't known
+        (e.g. replayed metrics).
+        :type counts: Counts
+        :param elapsed: Measured length of the interval, over which rates
+        were computed. Default: interval.
+        """
+        Event.__init__(self, timestamp)
+        self.interval = interval
+        self.elapsed = elapsed if elapsed is not None else interval
+        self.channels = channels
+        self.bitrate = bitrate
+        self.packets = packets
+        self.extra = extra
+        self.counts = counts
+
+    def is_batch(self):
+        return True
+
+    def __len__(self):
+        return len(self.channels)
+
+    def rows(self):
         """
-        :type metric: Metric
+        :return: Iterable of (channel, bitrate, packets, extra) of channels.
         """
-        Event.__init__(self, metric.timestamp)
-        self.metric = metric
+        extra = self.extra if self.extra is not None \
+            else itertools.repeat({})
+        return zip(self.channels, self.bitrate, self.packets, extra)
+
+    def metrics(self):
+        """Yields Metric of every channel."""
+        for channel, bitrate, packets, extra in self.rows():
+            yield Metric(self.timestamp, channel, bitrate, packets, extra,
+                         self.interval)
+
+    @classmethod
+    def of(cls, timestamp, interval, metrics):
+        """Batch of Metrics of one interval."""
+        extra = [m.extra for m in metrics]
+        return cls(timestamp, interval,
+                   tuple(m.channel for m in metrics),
+                   [m.bitrate for m in metrics],
+                   [m.packets for m in metrics],
+                   extra if any(extra) else None)
 
 
 class Aggr(object):
     """Accumulates values of data samples."""
-    def __init__(self, packets, bytes):
+    def __init__(self, packets, bytes, extra=None, arrivals=None):
+        """
+        :param extra: Partial statistics of analyzers.
+        :type extra: dict (analyzer name -> statistics)
+        :param arrivals: Kernel receive timestamps and sizes of datagrams, if
+        they are enabled.
+        :type arrivals: list of (Unix time, bytes)
+        """
         self.packets = packets
         self.bytes = bytes
+        self.extra = extra
+        self.arrivals = arrivals
 
     def __iadd__(self, b):
         self.packets += b.packets
         self.bytes += b.bytes
+        if b.extra:
+            self.extra = merge_extra(self.extra, b.extra)
+        # Only aggregates of a few reads keep arrivals, not aggregates of
+        # whole intervals, which start empty.
+        if b.arrivals and self.arrivals is not None:
+            self.arrivals.extend(b.arrivals)
+        return self
 
     @classmethod
     def empty(cls):
         return Aggr(0, 0)
 
 
+def merge_extra(a, b):
+    """
+    Merges partial statistics of analyzers.
+
+    :return: a updated with b (new dictionary if a is None).
+    """
+    if a is None:
+        return dict(b)
+    for name, stats in b.items():
+        if name in a:
+            a[name] += stats
+        else:
+            a[name] = stats
+    return a
+
+
 class Metric(object):
     """Metrics for channel: bitrate and packets/second."""
-    def __init__(self, timestamp, channel, bitrate, packets):
+    def __init__(self, timestamp, channel, bitrate, packets, extra=None,
+                 interval=None):
         """
         :param timestamp: Date/time of the metric.
         :type timestamp: datetime.datetime
@@ -65,8 +232,13 @@ class Metric(object):
         :type channel: (string ip, port)
         :param bitrate: kbits/second
         :param packets: packets/second
+        :param extra: Extra fields, e.g. from analyzers.
+        :type extra: dict
+        :param interval: Length of the interval (in seconds).
         """
         self.timestamp = timestamp
         self.channel = channel
         self.bitrate = bitrate
         self.packets = packets
+        self.extra = extra or {}
+        self.interval = interval
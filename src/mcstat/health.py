@@ -0,0 +1,345 @@
+"""
+Self-instrumentation: health of mcstat itself, measured every interval.
+
+- Kernel drops of receiving sockets (drops column of /proc/net/udp). Metrics
+  of channels, whose datagrams were dropped, have extra field 'drops' - the
+  measurement of such interval is degraded (too low).
+- Sizes and high-water marks of queues, latency from tick to its handling
+  by every output, and intervals dropped by queues of outputs.
+- Receiver loop: number of iterations, busy time (excluding waiting in
+  epoll) and the longest iteration.
+
+Health is logged, and exported by the http output.
+"""
+import logging
+import os
+import re
+import threading
+import time
+
+try:
+    # Python 2
+    from Queue import Queue
+except ImportError:
+    # Python 3
+    from queue import Queue
+
+log = logging.getLogger('mcstat.health')
+
+# Table of UDP sockets (Linux).
+udp_table = '/proc/net/udp'
+
+# Characters escaped in label values of samples.
+_ESCAPED = re.compile(r'[\\"\n]')
+_ESCAPES = {'\\': '\\\\', '"': '\\"', '\n': '\\n'}
+
+
+def escape(value):
+    """
+    :return: Value of label (any object) escaped for labels of samples
+    (Prometheus text format).
+    """
+    return _ESCAPED.sub(lambda m: _ESCAPES[m.group()], '{}'.format(value))
+
+
+def read_drops(path=udp_table):
+    """
+    :return: Dictionary mapping inode of UDP socket to number of its
+    datagrams dropped by the kernel (e.g. full receive buffer), or None if
+    the table can't be read.
+    """
+    try:
+        with open(path) as f:
+            lines = f.readlines()[1:]
+    except IOError:
+        return None
+    drops = {}
+    for line in lines:
+        fields = line.split()
+        # sl local rem st tx:rx tr:when retrnsmt uid timeout inode ref
+        # pointer drops
+        if len(fields) >= 13:
+            drops[int(fields[9])] = int(fields[12])
+    return drops
+
+
+class KernelDrops(object):
+    """
+    Datagrams of channel dropped by the kernel. Kept in Aggr.extra like
+    statistics of analyzers, so that it's added up by rollups.
+    """
+    def __init__(self, count):
+        self.count = count
+
+    def __iadd__(self, other):
+        self.count += other.count
+        return self
+
+    def fields(self, interval):
+        return {'drops': self.count}
+
+
+class ReceiverReport(object):
+    """Measurements of receiver(s) in one interval."""
+    def __init__(self, drops=None, loops=0, busy=0.0, longest=0.0,
+                 total=None):
+        """
+        :param drops: Dictionary mapping channel to kernel drops of its
+        socket, which degraded its metrics. Channels sharing a socket all
+        have its drops.
+        :param loops: Number of iterations of receiver loop.
+        :param busy: Time (in seconds) spent in iterations, excluding waiting
+        for datagrams.
+        :param longest: The longest iteration (in seconds).
+        :param total: Number of datagrams dropped, summed per socket.
+        Default: sum of drops (every channel has its own socket).
+        """
+        self.drops = drops if drops is not None else {}
+        self.loops = loops
+        self.busy = busy
+        self.longest = longest
+        self.total = total if total is not None else sum(self.drops.values())
+
+    def __iadd__(self, other):
+        """Adds report of another receiver (shard)."""
+        for channel, count in other.drops.items():
+            self.drops[channel] = self.drops.get(channel, 0) + count
+        self.total += other.total
+        self.loops += other.loops
+        self.busy += other.busy
+        self.longest = max(self.longest, other.longest)
+        return self
+
+
+class ReceiverMonitor(object):
+    """
+    Measures receiver: kernel drops of its sockets and time of its loop.
+
+    Receiver registers sockets and reports iterations, worker takes a report
+    on every tick.
+    """
+    def __init__(self, path=udp_table):
+        self.path = path
+        # Guards sockets and measurements of the loop, which the receiver
+        # updates while the worker takes them.
+        self.lock = threading.Lock()
+        # Maps inode to (ChannelSocket or PortSocket, drops last seen).
+        self.socks = {}
+        self.loops = 0
+        self.busy = 0.0
+        self.longest = 0.0
+
+    def register(self, sock):
+        """Adds newly opened socket (its channels can change later)."""
+        inode = os.fstat(sock.fileno()).st_ino
+        with self.lock:
+            self.socks[inode] = (sock, 0)
+
+    def loop(self, seconds):
+        """Records iteration of receiver loop, which took seconds."""
+        with self.lock:
+            self.loops += 1
+            self.busy += seconds
+            if seconds > self.longest:
+                self.longest = seconds
+
+    def take(self):
+        """
+        :return: ReceiverReport since the previous call. Drops of socket
+        shared by several channels are reported for each of them, and
+        counted once in the total.
+        """
+        with self.lock:
+            report = ReceiverReport(loops=self.loops, busy=self.busy,
+                                    longest=self.longest)
+            self.loops = 0
+            self.busy = 0.0
+            self.longest = 0.0
+        current = read_drops(self.path)
+        if current is None:
+            return report
+        with self.lock:
+            for inode, (sock, last) in list(self.socks.items()):
+                if inode not in current:
+                    # Closed.
+                    del self.socks[inode]
+                    continue
+                # The kernel counter is 32-bit.
+                count = (current[inode] - last) % (1 << 32)
+                if count:
+                    self.socks[inode] = (sock, current[inode])
+                    report.total += count
+                    for channel in sock.channels:
+                        report.drops[channel] = count
+        return report
+
+
+class MonitoredQueue(Queue):
+    """Queue, which records its high-water mark."""
+    def __init__(self, maxsize=0):
+        Queue.__init__(self, maxsize)
+        self.high = 0
+
+    def _put(self, item):
+        # Called with the queue's lock held.
+        Queue._put(self, item)
+        if len(self.queue) > self.high:
+            self.high = len(self.queue)
+
+    def take_high(self):
+        """:return: High-water mark since the previous call."""
+        with self.mutex:
+            high, self.high = self.high, len(self.queue)
+        return high
+
+
+# What happens when an event is sent to a full output queue:
+#   block    - the sender waits for space (a slow output slows down, or
+#              stops, measurement),
+#   drop     - metrics of the oldest interval in the queue are dropped,
+#   coalesce - metrics of all intervals in the queue, but the newest, are
+#              dropped.
+# Other events (stream events, alerts, termination) are never dropped.
+output_overflow_policies = ('block', 'drop', 'coalesce')
+
+
+class OutputQueue(MonitoredQueue):
+    """
+    Queue of output, which also measures latency from tick to the end of its
+    handling: when the output asks for the next event.
+
+    Its put_nowait doesn't fail, when the queue is full: the overflow policy
+    applies. Intervals (MetricBatches followed by Tick) are dropped whole.
+    """
+    def __init__(self, maxsize=0, overflow='drop'):
+        """
+        :param overflow: One of output_overflow_policies.
+        """
+        assert overflow in output_overflow_policies
+        MonitoredQueue.__init__(self, maxsize)
+        self.overflow = overflow
+        self.tick = None
+        self.latency = None
+        # Number of intervals dropped.
+        self.dropped = 0
+        self.last_dropped = 0
+
+    def put_nowait(self, event):
+        if self.overflow == 'block':
+            self.put(event)
+            return
+        with self.not_full:
+            if 0 < self.maxsize <= self._qsize():
+                self._make_room()
+            # Events, which can't be dropped, exceed maxsize.
+            self._put(event)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def _make_room(self):
+        """Drops intervals according to the overflow policy."""
+        queue = self.queue
+        intervals = sum(1 for event in queue if event.is_tick())
+        if not intervals:
+            return
+        # With coalesce, only the newest complete interval remains.
+        ticks = intervals - 1 if self.overflow == 'coalesce' and \
+            intervals > 1 else 1
+        kept = []
+        while ticks:
+            event = queue.popleft()
+            if event.is_tick():
+                ticks -= 1
+                self.dropped += 1
+            elif not event.is_batch():
+                kept.append(event)
+                continue
+            # Dropped events are never handled, join mustn't wait for them.
+            self.unfinished_tasks -= 1
+        queue.extendleft(reversed(kept))
+
+    def take_dropped(self):
+        """:return: Number of intervals dropped since the previous call."""
+        with self.mutex:
+            dropped = self.dropped - self.last_dropped
+            self.last_dropped = self.dropped
+        return dropped
+
+    def get(self, block=True, timeout=None):
+        if self.tick is not None:
+            self.latency = time.time() - self.tick
+            self.tick = None
+        event = MonitoredQueue.get(self, block, timeout)
+        if event.is_tick():
+            self.tick = event.timestamp
+        return event
+
+
+class Health(object):
+    """
+    Health of mcstat, measured on every tick by the worker.
+
+    samples are gauges of the last interval, as list of (name, labels,
+    value) - see mcstat.backend.prometheus.
+    """
+    def __init__(self, interval, queues=None, monitor=None):
+        """
+        :param queues: Dictionary (name -> Queue). High-water marks of
+        MonitoredQueues and latency of OutputQueues (and other outputs with
+        attribute latency) are measured.
+        :type monitor: ReceiverMonitor
+        """
+        self.interval = interval
+        self.queues = queues if queues is not None else {}
+        self.monitor = monitor
+        self.samples = []
+
+    def tick(self, now, report=None):
+        """
+        Takes measurements of the interval, which ended now.
+
+        :param report: ReceiverReport of the interval. Default: taken from
+        monitor.
+        :return: Dictionary mapping channel to kernel drops in the interval.
+        """
+        if report is None:
+            report = self.monitor.take() if self.monitor is not None \
+                else ReceiverReport()
+        samples = []
+        for name, queue in sorted(self.queues.items()):
+            labels = 'queue="{}"'.format(escape(name))
+            if isinstance(queue, MonitoredQueue):
+                samples.append(('mcstat_queue_high_water', labels,
+                                queue.take_high()))
+            # Of OutputQueue, or output handling events inline.
+            latency = getattr(queue, 'latency', None)
+            if latency is not None:
+                samples.append(('mcstat_tick_latency_seconds', labels,
+                                latency))
+            if isinstance(queue, OutputQueue):
+                dropped = queue.take_dropped()
+                samples.append(('mcstat_output_dropped_intervals', labels,
+                                dropped))
+                if dropped:
+                    log.warning("Output %s is too slow, %d interval(s) of "
+                                "metrics dropped.", name, dropped)
+        drops = report.total
+        samples.extend([
+            ('mcstat_kernel_drops', '', drops),
+            ('mcstat_receiver_loops', '', report.loops),
+            ('mcstat_receiver_busy_ratio', '', report.busy / self.interval),
+            ('mcstat_receiver_loop_seconds_max', '', report.longest),
+            ])
+        self.samples = samples
+
+        if drops:
+            log.warning("%d datagrams of %d channel(s) dropped by the "
+                        "kernel, their metrics are too low.", drops,
+                        len(report.drops))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("%.03f: Health: %s", now, ", ".join(
+                "{}{} {:g}".format(name[len('mcstat_'):],
+                                   '{' + labels + '}' if labels else '',
+                                   value)
+                for name, labels, value in samples))
+        return report.drops
@@ -0,0 +1,180 @@
+"""
+Engine, which runs in one asyncio event loop: receiving, counting, ticks and
+outputs, which don't block (see mcstat.main.InlineOutput). Unlike the other
+engines, there are no queues and no thread switches between receiving and
+outputs.
+
+Sockets are registered in an epoll, like by the other receivers, and the
+loop waits for its file descriptor. Datagrams are counted in counter tables
+like by the counters engine. Requires Python 3.4 or newer.
+"""
+from mcstat.clock import next_index, Window, monotonic
+from mcstat.core import open_channels, close_channels, all_channels, \
+    apply_updates, make_detector, pin_receiver, receive_buffer, send_term, \
+    loop_time, ReceiveOptions
+from mcstat.domain import Tick
+from mcstat.stat import table_batch
+
+import asyncio
+import logging
+import select
+import time
+
+log = logging.getLogger('mcstat.loop')
+
+
+class LoopEngine(object):
+    """Receives datagrams and sends metrics in callbacks of event loop."""
+    def __init__(self, loop, interval, counters, queues_out,
+                 options=ReceiveOptions(), updates=None, health=None):
+        """
+        :type counters: mcstat.counters.SharedCounters
+        :param queues_out: Output queues (or rollups, inline outputs).
+        :param updates: ChannelUpdates, or None if channels don't change.
+        :type health: mcstat.health.Health
+        """
+        self.loop = loop
+        self.interval = interval
+        self.counters = counters
+        self.queues_out = queues_out
+        self.options = options
+        self.updates = updates
+        self.health = health
+        self.epoll = select.epoll()
+        # Maps file descriptor to ChannelSocket or PortSocket
+        self.socks_map = {}
+        self.buffer = receive_buffer(options)
+        self.slots = {}
+        self.detector = None
+        # Timer of the next deadline of detector.
+        self.expiry = None
+        self.index = None
+        # Measures intervals from the opening of sockets (see start).
+        self.window = None
+
+    def send_all(self, event):
+        for queue in self.queues_out:
+            queue.put_nowait(event)
+
+    def start(self, wake_up_fd):
+        """Opens sockets and schedules the first tick."""
+        pin_receiver(self.options)
+        # Datagrams are counted from joining of channels.
+        start = monotonic()
+        open_channels(self.counters.channels, self.epoll, self.socks_map,
+                      self.options)
+        self.slots = {channel: slot
+                      for slot, channel in enumerate(self.counters.channels)}
+        self.detector = make_detector(self.socks_map, self.options)
+        self.loop.add_reader(self.epoll.fileno(), self.receive)
+        self.loop.add_reader(wake_up_fd, self.loop.stop)
+        if self.updates is not None:
+            self.loop.add_reader(self.updates.fileno(), self.update)
+        self.window = Window(start)
+        self.schedule_tick()
+        self.arm_detector()
+
+    def receive(self):
+        monitor = self.options.monitor
+        timestamps = self.options.timestamps
+        # With timestamps, the clock is read only to measure the loop (see
+        # mcstat.core.loop_time).
+        started = time.time() if monitor is not None or not timestamps \
+            else None
+        received = []
+        for fileno, _ in self.epoll.poll(0):
+            received.extend(self.socks_map[fileno].drain(self.buffer))
+        now = loop_time(received, started, timestamps)
+        slots = self.slots
+        with self.counters.lock:
+            table = self.counters.table
+            for channel, aggr in received:
+                table.add(slots[channel], aggr.packets, aggr.bytes,
+                          aggr.extra, now, aggr.arrivals)
+        if self.detector is not None:
+            for event in self.detector.check(
+                    [channel for channel, _ in received], now):
+                self.send_all(event)
+            # Channels, which came up, have deadlines again.
+            self.arm_detector()
+        if monitor is not None:
+            monitor.loop(time.time() - started)
+
+    def schedule_tick(self):
+        now = time.time()
+        self.index = next_index(self.index, now, self.interval)
+        due = self.index * self.interval
+        # The loop's clock is monotonic.
+        self.loop.call_at(self.loop.time() + max(due - now, 0), self.tick,
+                          due)
+
+    def tick(self, now):
+        clock = monotonic()
+        log.debug("%.03f: Tick", now)
+        channels, table = self.counters.swap()
+        elapsed = self.window.next(clock, self.interval)
+        drops = self.health.tick(now) if self.health is not None else None
+        self.send_all(table_batch(now, self.interval, channels, table, drops,
+                                  elapsed))
+        self.send_all(Tick(now, clock))
+        self.index += 1
+        self.schedule_tick()
+
+    def arm_detector(self):
+        """Schedules expiry at the next deadline of detector, if any."""
+        if self.detector is None or self.expiry is not None:
+            return
+        timeout = self.detector.timeout(time.time())
+        if timeout >= 0:
+            self.expiry = self.loop.call_later(timeout, self.expire)
+
+    def expire(self):
+        self.expiry = None
+        for event in self.detector.expire(time.time()):
+            self.send_all(event)
+        self.arm_detector()
+
+    def update(self):
+        added, removed = apply_updates(self.updates, self.epoll,
+                                       self.socks_map, self.options,
+                                       self.detector)
+        if added or removed:
+            channels = sorted(all_channels(self.socks_map))
+            self.counters.set_channels(channels)
+            self.slots = {channel: slot
+                          for slot, channel in enumerate(channels)}
+            self.arm_detector()
+
+    def close(self):
+        """Closes sockets and sends Term to outputs."""
+        try:
+            self.loop.remove_reader(self.epoll.fileno())
+            close_channels(self.epoll, self.socks_map)
+            self.epoll.close()
+        finally:
+            send_term(*self.queues_out)
+
+
+def run_loop(interval, counters, wake_up_fd, queues_out,
+             options=ReceiveOptions(), updates=None, health=None):
+    """
+    Runs LoopEngine in a new event loop, until wake_up_fd is readable or a
+    callback fails.
+    """
+    loop = asyncio.new_event_loop()
+
+    def handle_exception(loop, context):
+        # Like failure of a thread of the other engines, ends mcstat.
+        log.error("%s", context['message'],
+                  exc_info=context.get('exception'))
+        loop.stop()
+
+    loop.set_exception_handler(handle_exception)
+    engine = LoopEngine(loop, interval, counters, queues_out, options,
+                        updates, health)
+    try:
+        engine.start(wake_up_fd)
+        loop.run_forever()
+    finally:
+        engine.close()
+        loop.close()
@@ -1,21 +1,26 @@
-from mcstat.core import ping, worker, receiver
+from mcstat.alert import Alerts
+from mcstat.core import ping, worker, receiver, batch_receiver, \
+    counter_worker, counter_receiver, make_nonblocking, \
+    ReceiveOptions, ChannelUpdates
+from mcstat.counters import SharedCounters
+from mcstat.health import Health, MonitoredQueue, OutputQueue, \
+    ReceiverMonitor
+from mcstat.burst import bucket_layout
+from mcstat.clock import monotonic
+from mcstat.rollup import make_rollups
 from mcstat.net import is_multicast
-from mcstat.config import make_config
+from mcstat.output import load_output, run as run_output
+from mcstat.config import make_config, Config
 
-import fcntl
+import errno
 import logging
+import multiprocessing
 import os
+import select
 import signal
 import sys
 import threading
-
-
-try:
-    # Python 2
-    from Queue import Queue
-except ImportError:
-    # Python 3
-    from queue import Queue
+import time
 
 
 log = logging.getLogger('mcstat.main')
@@ -30,94 +35,357 @@ class ThreadWithLog(threading.Thread):
             log.info("End")
 
 
-def make_nonblocking(fd):
-    flags = fcntl.fcntl(fd, fcntl.F_GETFL, 0)
-    flags = flags | os.O_NONBLOCK
-    fcntl.fcntl(fd, fcntl.F_SETFL, flags)
-
+class Signals(object):
+    """
+    Signals received by the main thread.
 
-def signal_to_pipe(*signal_numbers):
+    Signal handlers only record signals. The pipe fileno() receives a byte
+    on every signal (see signal.set_wakeup_fd), so that the main thread can
+    wait for signals with select.
     """
-    Returns read file descriptor of a pipe. This pipe will receive '\0' byte
-    message when the main thread gets a signal.
+    def __init__(self, *signal_numbers):
+        """
+        :param signal_numbers: list of signals whose default handler should
+        be disabled, so that application can shut down gracefully.
+        """
+        self.received = []
+        self.pipe_read, pipe_write = os.pipe()
+        make_nonblocking(self.pipe_read)
+        make_nonblocking(pipe_write)
+
+        def record(num, frame):
+            self.received.append(num)
+
+        for num in signal_numbers:
+            signal.signal(num, record)
+        signal.set_wakeup_fd(pipe_write)
+
+    def wait(self, timeout):
+        """
+        Waits for signals.
+
+        :return: Set of signals received since the previous call.
+        """
+        try:
+            select.select([self.pipe_read], [], [], timeout)
+        except select.error as e:
+            # Python 2: interrupted by signal.
+            if e.args[0] != errno.EINTR:
+                raise
+        try:
+            while os.read(self.pipe_read, 4096):
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+        received = set()
+        while self.received:
+            received.add(self.received.pop())
+        return received
 
-    :param signal_numbers: list of signals whose default handler should be
-    disabled, so that application can shut down gracefully.
 
-    :return: Read file descriptor that will receive '\0' on signal.
-    """
+def make_daemon(thread):
+    thread.setDaemon(True)
+    return thread
 
-    pipe_read, pipe_write = os.pipe()
-    make_nonblocking(pipe_write)
 
-    do_nothing = lambda signal, frame: None
-    for num in signal_numbers:
-        signal.signal(num, do_nothing)
-    signal.set_wakeup_fd(pipe_write)
+def load_channels(main_config, db_config):
+    """
+    Returns sorted list of channels - from configuration or database.
+    """
+    if main_config.channels_from_db:
+        import mcstat.backend.db as DB
+        channels = DB.get_channels(db_config)
+        log.info("Loaded %d channels from database.", len(channels))
+    else:
+        channels = main_config.channels
+    for ip, port in channels:
+        assert is_multicast(ip)
+    return sorted(set(channels))
 
-    return pipe_read
 
+def load_rules(main_config, db_config):
+    """
+    Returns list of alert rules - from configuration and database.
+    """
+    rules = list(main_config.alert_rules)
+    if db_config.rules_sql:
+        import mcstat.backend.db as DB
+        rules.extend(DB.get_rules(db_config))
+    return rules
 
-def make_daemon(thread):
-    thread.setDaemon(True)
-    return thread
 
+def make_alerts(main_config, db_config, output_queues):
+    """
+    :param output_queues: Queues (or rollups) of outputs.
+    :return: Alerts sending to output_queues, or None if there are no rules
+    (and none can be loaded).
+    """
+    if not (main_config.alert_rules or db_config.rules_sql):
+        return None
+    return Alerts(load_rules(main_config, db_config), output_queues)
 
-def main2(main_config, db_config):
+
+def wait_for_signals(signals, term_fd, threads, reload_channels=None,
+                     reload_interval=0):
     """
-    :type main_config: mcstat.config._Main
-    :type db_config: mcstat.config._DB
+    Handles signals in the main thread, until threads end.
+
+    SIGINT and SIGTERM are passed to term_fd, on which receiver waits.
+    SIGHUP reloads channels, which are also reloaded every reload_interval
+    seconds (if it's not 0).
+
+    :type signals: Signals
+    :param term_fd: Write end of pipe.
+    :param reload_channels: Function, which reloads channels, or None.
     """
+    next_reload = time.time() + reload_interval if reload_interval else None
 
-    channels = main_config.channels
-    interval = main_config.interval
-    outputs = main_config.stats_output
+    while any(thread.is_alive() for thread in threads):
+        # Timeout, so that ended threads are noticed.
+        received = signals.wait(1)
+        if signal.SIGINT in received or signal.SIGTERM in received:
+            os.write(term_fd, b'\0')
+        reload_now = signal.SIGHUP in received
+        if next_reload is not None and time.time() >= next_reload:
+            next_reload = time.time() + reload_interval
+            reload_now = True
+        if reload_now:
+            if reload_channels is not None:
+                reload_channels()
+            else:
+                log.warning("Channels can't be reloaded with this engine.")
 
-    for ip, port in channels:
-        assert is_multicast(ip)
 
-    wake_up_fd = signal_to_pipe(signal.SIGINT, signal.SIGTERM)
+def make_queue(maxsize=1000):
+    return MonitoredQueue(maxsize)
+
 
-    def make_queue():
-        return Queue(1000)
+class InlineOutput(object):
+    """
+    Output queue, which handles every event immediately, in the thread of
+    the sender, instead of a thread of the output. Like OutputQueue, it
+    measures latency from tick to the end of its handling.
+    """
+    def __init__(self, handle, close=None):
+        """
+        :param handle: Function, which handles event (except Term).
+        :param close: Function called on Term, or None.
+        """
+        self.handle = handle
+        self.close = close
+        self.latency = None
+
+    def qsize(self):
+        # Events are never queued.
+        return 0
+
+    def put_nowait(self, event):
+        if event.is_term():
+            if self.close is not None:
+                self.close()
+            return
+        self.handle(event)
+        if event.is_tick():
+            self.latency = time.time() - event.timestamp
+
+
+def make_outputs(main_config, db_config, interval, internal_queues,
+                 outputs=None, queue_size=None, health=None, inline=False):
+    """
+    Creates queues and (not started) threads of outputs (see mcstat.output).
+
+    :param interval: Interval of metrics, unless output_intervals say
+    otherwise.
+    :param internal_queues: Dictionary (name -> Queue) exported by the http
+    output. Queues of outputs are added to it.
+    :param outputs: Names of outputs. Default: stats_output.
+    :param queue_size: Maximum size of queues, 0 means: unlimited. Default:
+    output_queue_sizes, or the size preferred by output.
+    :param health: mcstat.health.Health exported by the http output, or
+    None.
+    :param inline: Whether outputs, which don't block, are InlineOutputs
+    without threads.
+    :return: (list of (queue, interval of its metrics), list of threads)
+    """
+    if outputs is None:
+        outputs = main_config.stats_output
 
     output_queues = []
     threads = []
 
+    for name in outputs:
+        cls = load_output(name)
+        output = cls.from_config(main_config, db_config, internal_queues,
+                                 health)
+        if inline and cls.inline:
+            queue = InlineOutput(output.handle, output.close)
+        else:
+            size = queue_size if queue_size is not None else \
+                main_config.output_queue_sizes.get(name, cls.queue_size)
+            queue = OutputQueue(size, main_config.output_overflow.get(
+                name, cls.overflow))
+            thread = ThreadWithLog(name=name, target=run_output,
+                                   args=(queue, output))
+            if cls.daemon:
+                make_daemon(thread)
+            threads.append(thread)
+        output_queues.append((queue, main_config.output_intervals.get(
+            name, interval)))
+        internal_queues[name] = queue
+    return output_queues, threads
+
+
+def make_pipeline(main_config, channels, wake_up_fd, output_queues, queue,
+                  health=None):
+    """
+    Creates (not started) worker, receiver and ping threads of the engine.
+    Processes of the sharded engine are started.
+
+    :param wake_up_fd: Receiver ends when this file descriptor is readable.
+    :param output_queues: Queues (or rollups) of outputs.
+    :param queue: Input queue of the worker.
+    :param health: mcstat.health.Health measured by the worker, or None.
+    Receivers are measured by its monitor.
+    :return: (list of threads, ChannelUpdates or None if channels can't be
+    reloaded)
+    """
+    interval = main_config.interval
     T = ThreadWithLog
 
-    if main_config.channels_from_db:
-        import mcstat.backend.db as DB
-        channels = DB.get_channels(db_config)
-        log.info("Loaded %d channels from database.", len(channels))
-    channels = sorted(channels)
+    layout = bucket_layout(interval, main_config.burst_bucket)
+    # Sizes of receive buffers are configured in KB.
+    channel_buffers = {channel: size << 10 for channel, size
+                       in main_config.channel_receive_buffers.items()}
+    options = ReceiveOptions(shared_sockets=main_config.shared_sockets,
+                             read_payload=main_config.read_payload,
+                             analyzers=main_config.analyzers,
+                             buckets=layout,
+                             timestamps=main_config.kernel_timestamps,
+                             outage_threshold=main_config.outage_threshold /
+                             1000.0,
+                             monitor=health.monitor if health is not None
+                             else None,
+                             receive_buffer=main_config.receive_buffer << 10,
+                             channel_buffers=channel_buffers,
+                             busy_poll=main_config.busy_poll,
+                             cpus=main_config.receiver_cpus)
+
+    # Channels of shards are fixed.
+    updates = ChannelUpdates() if main_config.engine != 'sharded' else None
+    if main_config.engine == 'asyncio':
+        from mcstat.loop import run_loop
+        # Ticks are scheduled by the loop, the worker queue isn't used.
+        counters = SharedCounters(channels, layout)
+        return [T(name="loop", target=run_loop,
+                  args=(interval, counters, wake_up_fd, output_queues,
+                        options, updates, health))
+                ], updates
+    elif main_config.engine == 'sharded':
+        from mcstat.shard import make_shards, shard_worker, forward_events
+        shards = make_shards(channels, main_config.processes or
+                             multiprocessing.cpu_count(), options)
+        log.info("Receiving in %d processes.", len(shards))
+        # Shards count from their start, so does the first interval.
+        start = monotonic()
+        # Processes are started before any thread.
+        for shard in shards:
+            shard.start()
+        worker_thread = T(name="worker", target=shard_worker,
+                          args=(interval, channels, shards, queue,
+                                output_queues, layout, health, start))
+        receiver_thread = T(name="receiver", target=forward_events,
+                            args=(wake_up_fd, shards, queue))
+    elif main_config.engine == 'counters':
+        counters = SharedCounters(channels, layout)
+        worker_thread = T(name="worker", target=counter_worker,
+                          args=(interval, counters, queue, output_queues,
+                                health))
+        receiver_thread = T(name="receiver", target=counter_receiver,
+                            args=(counters, queue, wake_up_fd, options,
+                                  updates))
+    else:
+        worker_thread = T(name="worker", target=worker,
+                          args=(interval, queue, output_queues, layout,
+                                None, health))
+        if main_config.receiver_mode == 'batch':
+            receiver_thread = T(name="receiver", target=batch_receiver,
+                                args=(channels, queue, wake_up_fd,
+                                      main_config.flush_interval, options,
+                                      updates))
+        else:
+            receiver_thread = T(name="receiver", target=receiver,
+                                args=(channels, queue, wake_up_fd,
+                                      options, updates))
+
+    return [worker_thread,
+            receiver_thread,
+            make_daemon(T(name="ping", target=ping, args=(interval, queue)))
+            ], updates
+
+
+def main2(main_config, db_config, reload_config=None):
+    """
+    :type main_config: mcstat.config._Main
+    :type db_config: mcstat.config._DB
+    :param reload_config: Function, which returns new Config when channels
+    are reloaded. By default channels are reloaded with the same config.
+    """
+
+    interval = main_config.interval
+
+    signals = Signals(signal.SIGINT, signal.SIGTERM, signal.SIGHUP)
+    # Receiver ends when this pipe is readable.
+    wake_up_fd, term_fd = os.pipe()
+
+    # Queues, whose sizes are exported by the http output.
+    internal_queues = {}
+    health = Health(interval, internal_queues, ReceiverMonitor())
+
+    channels = load_channels(main_config, db_config)
     for i, channel in enumerate(channels, 1):
         log.info("Channel %s: %s:%d", i, channel[0], channel[1])
 
-    if 'db' in outputs:
-        queue = make_queue()
-        import mcstat.backend.db as DB
-        output_queues.append(queue)
-        thread = T(name="database", target=DB.worker, args=(queue, db_config))
-        threads.append(thread)
-    if 'stdout' in outputs:
-        queue = make_queue()
-        import mcstat.backend.console as C
-        output_queues.append(queue)
-        thread = make_daemon(T(name="stdout", target=C.worker, args=(queue,)))
-        threads.append(thread)
+    output_queues, threads = make_outputs(
+        main_config, db_config, interval, internal_queues, health=health,
+        inline=main_config.engine == 'asyncio')
+
+    # Outputs with longer intervals receive rollups of metrics.
+    output_queues = make_rollups(interval, output_queues)
+    # Alert rules are evaluated on metrics of interval.
+    alerts = make_alerts(main_config, db_config, output_queues)
+    if alerts is not None:
+        output_queues = [alerts]
 
     queue = make_queue()
-    threads.extend([
-        T(name="worker", target=worker, args=(interval, queue, output_queues)),
-        T(name="receiver", target=receiver,
-          args=(channels, queue, wake_up_fd)),
-        make_daemon(T(name="ping", target=ping, args=(interval, queue)))
-        ])
+    if main_config.engine != 'asyncio':
+        internal_queues['worker'] = queue
+    pipeline, updates = make_pipeline(main_config, channels, wake_up_fd,
+                                      output_queues, queue, health)
+    threads.extend(pipeline)
 
     for thread in threads:
         thread.start()
 
+    if reload_config is None:
+        def reload_config():
+            return Config(main=main_config, db=db_config)
+
+    def reload_channels():
+        try:
+            config = reload_config()
+            if updates is not None:
+                updates.send(load_channels(config.main, config.db))
+            if alerts is not None:
+                alerts.set_rules(load_rules(config.main, config.db))
+        except (Exception, SystemExit):
+            log.exception("Reloading channels failed.")
+
+    wait_for_signals(signals, term_fd, [t for t in threads if not t.daemon],
+                     reload_channels if updates is not None or
+                     alerts is not None else None,
+                     main_config.reload_interval)
+
 
 def setup_logging(level):
     logging.basicConfig(
@@ -130,6 +398,10 @@ def main():
     config = make_config(sys.argv[1:])
     setup_logging(config.main.logging_level)
     log.debug("Configuration:\n%s", config)
+    if config.main.pcap:
+        from mcstat.pcap import run
+        return run(config.main, config.db)
     return main2(main_config=config.main,
-                 db_config=config.db
+                 db_config=config.db,
+                 reload_config=lambda: make_config(sys.argv[1:])
                  )
@@ -0,0 +1,245 @@
+"""
+Metric log: metrics stored in compact binary segment files.
+
+Segment file starts with a header: magic, length of JSON and JSON with
+interval, channels and names of extra fields. Fixed-size records follow, in
+order of time:
+
+  timestamp (double), index of channel (uint32), bitrate, packets (float),
+  extra fields (float, NaN if missing)
+
+A new segment is started when it's too big, or when a metric has a channel
+or extra field, which isn't in the header.
+"""
+import json
+import logging
+import math
+import mmap
+import numbers
+import os
+import struct
+
+from mcstat.domain import Metric
+
+log = logging.getLogger('mcstat.metriclog')
+
+MAGIC = b'MCSTLOG1'
+_LENGTH = struct.Struct('<I')
+_SUFFIX = '.mlog'
+_NAN = float('nan')
+# Number of records unpacked at once.
+_CHUNK = 1 << 16
+
+
+def record_struct(fields):
+    """:return: Struct of records with extra fields."""
+    return struct.Struct('<dIff' + 'f' * len(fields))
+
+
+def numeric_fields(metric):
+    """:return: Names of extra fields of metric, which can be logged."""
+    return [name for name, value in metric.extra.items()
+            if isinstance(value, numbers.Real) and not isinstance(value, bool)]
+
+
+def segment_paths(directory):
+    """:return: Paths of segments in directory, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name)
+            for name in sorted(os.listdir(directory))
+            if name.endswith(_SUFFIX)]
+
+
+class MetricLogWriter(object):
+    """Appends metrics to segments in directory."""
+    def __init__(self, directory, max_bytes=0, segment_bytes=64 << 20):
+        """
+        :param directory: Directory of segments, created if missing.
+        :param max_bytes: Maximum total size of segments, the oldest are
+        deleted when it's exceeded. 0 means: no limit.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        paths = segment_paths(directory)
+        self.number = int(os.path.basename(paths[-1])[:-len(_SUFFIX)]) + 1 \
+            if paths else 0
+        self.file = None
+        self.interval = None
+        self.channels = {}
+        self.fields = []
+
+    def write(self, metrics, interval):
+        """Appends metrics of one interval."""
+        fields = set()
+        for m in metrics:
+            fields.update(numeric_fields(m))
+        if self.file is None or interval != self.interval or \
+                not fields.issubset(self.fields) or \
+                any(m.channel not in self.channels for m in metrics) or \
+                self.file.tell() >= self.segment_bytes:
+            self.rotate(interval, metrics, fields)
+        record = record_struct(self.fields)
+        channels = self.channels
+        fields = self.fields
+        self.file.write(b''.join(
+            record.pack(m.timestamp, channels[m.channel], m.bitrate,
+                        m.packets, *[m.extra.get(name, _NAN)
+                                     for name in fields])
+            for m in metrics))
+        self.file.flush()
+
+    def rotate(self, interval, metrics, fields):
+        """Starts a new segment, with channels and fields of metrics too."""
+        self.close()
+        channels = sorted(self.channels, key=self.channels.get)
+        channels.extend(sorted({m.channel for m in metrics} -
+                               set(self.channels)))
+        self.channels = {channel: i for i, channel in enumerate(channels)}
+        self.fields = sorted(fields.union(self.fields))
+        self.interval = interval
+        header = json.dumps({'interval': interval,
+                             'channels': channels,
+                             'fields': self.fields}).encode('utf-8')
+        path = os.path.join(self.directory,
+                            '{:012d}{}'.format(self.number, _SUFFIX))
+        self.number += 1
+        self.file = open(path, 'ab')
+        self.file.write(MAGIC + _LENGTH.pack(len(header)) + header)
+        self.file.flush()
+        if self.max_bytes:
+            self.expire()
+
+    def expire(self):
+        paths = segment_paths(self.directory)
+        sizes = [os.path.getsize(path) for path in paths]
+        while len(paths) > 1 and sum(sizes) > self.max_bytes:
+            log.info("Removing %s", paths[0])
+            os.remove(paths.pop(0))
+            sizes.pop(0)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class Segment(object):
+    """Memory-mapped segment file."""
+    def __init__(self, path):
+        """:raise ValueError: If the file isn't a segment."""
+        self.path = path
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < len(MAGIC) + _LENGTH.size:
+                raise ValueError("Segment too short: {}".format(path))
+            self.map = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("Not a segment: {}".format(path))
+        length, = _LENGTH.unpack_from(self.map, len(MAGIC))
+        start = len(MAGIC) + _LENGTH.size
+        header = json.loads(self.map[start:start + length].decode('utf-8'))
+        self.interval = header['interval']
+        self.channels = [tuple(channel) for channel in header['channels']]
+        self.fields = header['fields']
+        self.record = record_struct(self.fields)
+        self.offset = start + length
+        # Incomplete record at the end (e.g. after crash) is ignored.
+        self.count = (size - self.offset) // self.record.size
+
+    def __len__(self):
+        return self.count
+
+    def timestamp(self, i):
+        return struct.unpack_from('<d', self.map,
+                                  self.offset + i * self.record.size)[0]
+
+    def bisect(self, timestamp):
+        """:return: Index of the first record not older than timestamp."""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestamp(mid) < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def records(self, start=None, end=None, channels=None):
+        """
+        Yields records as tuples (timestamp, index of channel, bitrate,
+        packets, extra fields...).
+
+        :param start: Minimum timestamp, or None.
+        :param end: Timestamp after the last one, or None.
+        :param channels: Channels (ip, port), or None for all.
+        """
+        first = 0 if start is None else self.bisect(start)
+        last = self.count if end is None else self.bisect(end)
+        indexes = None if channels is None else \
+            {i for i, channel in enumerate(self.channels)
+             if channel in channels}
+        size = self.record.size
+        # Records are unpacked from copies of chunks, so that the map can be
+        # closed even if the generator isn't finished.
+        for chunk in range(first, last, _CHUNK):
+            data = self.map[self.offset + chunk * size:
+                            self.offset + min(chunk + _CHUNK, last) * size]
+            records = _iter_unpack(self.record, data)
+            if indexes is None:
+                for record in records:
+                    yield record
+            else:
+                for record in records:
+                    if record[1] in indexes:
+                        yield record
+
+    def metrics(self, start=None, end=None, channels=None):
+        """Yields records as Metrics (see records)."""
+        names = self.fields
+        for record in self.records(start, end, channels):
+            extra = {name: value for name, value in zip(names, record[4:])
+                     if not math.isnan(value)}
+            yield Metric(timestamp=record[0],
+                         channel=self.channels[record[1]],
+                         bitrate=record[2],
+                         packets=record[3],
+                         extra=extra,
+                         interval=self.interval)
+
+    def close(self):
+        self.map.close()
+
+
+def _iter_unpack(record, data):
+    if hasattr(record, 'iter_unpack'):
+        return record.iter_unpack(data)
+    # Python 2
+    return (record.unpack_from(data, offset)
+            for offset in range(0, len(data), record.size))
+
+
+def read_segments(directory, start=None, end=None):
+    """
+    Yields segments of directory, which can have metrics between start and
+    end, oldest first. Each segment is closed after it's used.
+    """
+    for path in segment_paths(directory):
+        try:
+            segment = Segment(path)
+        except ValueError as e:
+            log.warning("%s", e)
+            continue
+        try:
+            if not len(segment) or \
+                    (start is not None and
+                     segment.timestamp(len(segment) - 1) < start) or \
+                    (end is not None and segment.timestamp(0) >= end):
+                continue
+            yield segment
+        finally:
+            segment.close()
@@ -1,6 +1,27 @@
+import errno
 import socket
 import struct
 
+# Linux values of socket options, which are not exported by all Python
+# versions.
+IP_PKTINFO = getattr(socket, 'IP_PKTINFO', 8)
+IP_MULTICAST_ALL = getattr(socket, 'IP_MULTICAST_ALL', 49)
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35)
+SO_RCVBUFFORCE = getattr(socket, 'SO_RCVBUFFORCE', 33)
+SO_BUSY_POLL = getattr(socket, 'SO_BUSY_POLL', 46)
+
+# Whether ancillary data can be received (Python 3.3+).
+has_recvmsg = hasattr(socket.socket, 'recvmsg_into')
+
+# Size of ancillary data buffer for struct in_pktinfo.
+pktinfo_bufsize = socket.CMSG_SPACE(12) if has_recvmsg else 0
+
+# struct timespec {time_t tv_sec; long tv_nsec;}
+_timespec = struct.Struct("@ll")
+
+# Size of ancillary data buffer for receive timestamp.
+timestamp_bufsize = socket.CMSG_SPACE(_timespec.size) if has_recvmsg else 0
+
 
 def cidr_to_mask(cidr):
     """
@@ -77,3 +98,88 @@ def make_multicast_server_socket(ip_addr, port):
     sock = make_udp_server_socket(ip_addr, port)
     join_multicast_group(sock, ip_addr)
     return sock
+
+
+def make_multicast_port_socket(ip_addrs, port):
+    """
+    Makes non-blocking UDP socket, which binds to wildcard address and port,
+    and joins all given multicast groups.
+
+    Destination address of every datagram is received in IP_PKTINFO
+    ancillary data (see pktinfo_destination).
+    """
+    sock = make_udp_server_socket('', port)
+    # Don't receive groups joined by other sockets.
+    sock.setsockopt(socket.IPPROTO_IP, IP_MULTICAST_ALL, 0)
+    sock.setsockopt(socket.IPPROTO_IP, IP_PKTINFO, 1)
+    for addr in ip_addrs:
+        join_multicast_group(sock, addr)
+    return sock
+
+
+def set_receive_buffer(sock, size):
+    """
+    Sets size of receive buffer (in bytes). If it's limited by sysctl
+    net.core.rmem_max, then SO_RCVBUFFORCE is tried, which requires
+    CAP_NET_ADMIN.
+
+    :return: Effective size, as reported by the kernel - which doubles the
+    requested size for its bookkeeping.
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+    effective = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    if effective < 2 * size:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, size)
+        except socket.error as e:
+            if e.errno != errno.EPERM:
+                raise
+        effective = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    return effective
+
+
+def set_busy_poll(sock, usec):
+    """
+    Enables busy polling of device queue (in microseconds) when the socket
+    is read and has no datagrams. Increasing it requires CAP_NET_ADMIN.
+
+    :return: Effective value, 0 if it isn't permitted.
+    """
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_BUSY_POLL, usec)
+    except socket.error as e:
+        if e.errno != errno.EPERM:
+            raise
+    return sock.getsockopt(socket.SOL_SOCKET, SO_BUSY_POLL)
+
+
+def enable_timestamps(sock):
+    """
+    Enables kernel receive timestamps of datagrams (see cmsg_timestamp).
+    """
+    sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+
+
+def cmsg_timestamp(ancdata):
+    """
+    Returns kernel receive timestamp of datagram (Unix time), or None if
+    ancillary data doesn't contain SCM_TIMESTAMPNS.
+    """
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS:
+            sec, nsec = _timespec.unpack_from(data)
+            return sec + nsec * 1e-9
+    return None
+
+
+def pktinfo_destination(ancdata):
+    """
+    Returns destination address of datagram (packed, as returned by
+    socket.inet_aton), or None if ancillary data doesn't contain IP_PKTINFO.
+    """
+    for level, kind, data in ancdata:
+        if level == socket.IPPROTO_IP and kind == IP_PKTINFO:
+            # struct in_pktinfo {int ipi_ifindex; struct in_addr ipi_spec_dst;
+            #                    struct in_addr ipi_addr;}
+            return bytes(data[8:12])
+    return None
@@ -0,0 +1,104 @@
+from mcstat.domain import StreamEvent
+
+import heapq
+
+
+class OutageDetector(object):
+    """
+    Detects channels, which received no datagram for longer than threshold.
+
+    Receiver calls seen() for channels with received datagrams, and expire()
+    when timeout() elapses. Deadlines of channels are kept in a heap, so only
+    channels with passed deadline are checked. The heap isn't updated per
+    datagram: when deadline of a channel, which received datagrams in the
+    meantime, passes, the channel gets a new deadline.
+    """
+    def __init__(self, threshold, channels=(), now=None):
+        """
+        :param threshold: Maximum silence (in seconds).
+        :param channels: Channels, which start now. If they receive nothing
+        within threshold, they are reported as down (never started).
+        """
+        self.threshold = threshold
+        # Maps channel to time of its last datagram (None if there was none).
+        self.last_seen = {}
+        # Maps channel to its current deadline. Heap entries with other
+        # deadlines are stale.
+        self.deadlines = {}
+        self.heap = []
+        self.down = set()
+        self.add(channels, now)
+
+    def add(self, channels, now):
+        for channel in channels:
+            self.last_seen[channel] = None
+            self.down.discard(channel)
+            self._schedule(channel, now + self.threshold)
+
+    def remove(self, channels):
+        for channel in channels:
+            self.last_seen.pop(channel, None)
+            self.deadlines.pop(channel, None)
+            self.down.discard(channel)
+
+    def _schedule(self, channel, deadline):
+        self.deadlines[channel] = deadline
+        heapq.heappush(self.heap, (deadline, channel))
+
+    def seen(self, channel, now):
+        """
+        Records that channel received datagrams.
+
+        :return: StreamEvent 'up', if channel was down, otherwise None.
+        """
+        self.last_seen[channel] = now
+        if channel in self.down:
+            self.down.remove(channel)
+            self._schedule(channel, now + self.threshold)
+            return StreamEvent(now, channel, 'up')
+        return None
+
+    def check(self, channels, now):
+        """
+        Records channels with received datagrams, and checks deadlines.
+
+        :return: List of StreamEvents.
+        """
+        events = []
+        for channel in channels:
+            event = self.seen(channel, now)
+            if event is not None:
+                events.append(event)
+        events.extend(self.expire(now))
+        return events
+
+    def expire(self, now):
+        """
+        :return: List of StreamEvents 'down' of channels, whose deadline
+        passed.
+        """
+        events = []
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            deadline, channel = heapq.heappop(heap)
+            if self.deadlines.get(channel) != deadline:
+                continue
+            last_seen = self.last_seen[channel]
+            if last_seen is not None and last_seen + self.threshold > now:
+                self._schedule(channel, last_seen + self.threshold)
+            else:
+                del self.deadlines[channel]
+                self.down.add(channel)
+                events.append(StreamEvent(now, channel, 'down', last_seen))
+        return events
+
+    def timeout(self, now):
+        """
+        :return: Seconds until the next deadline, or -1 if there is none.
+        """
+        while self.heap and \
+                self.deadlines.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return -1
+        return max(self.heap[0][0] - now, 0)
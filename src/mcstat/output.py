@@ -0,0 +1,139 @@
+"""
+Output plugins.
+
+An output is a subclass of Output, registered as entry point (name ->
+class) in group 'mcstat.outputs' - by mcstat itself for the built-in outputs
+(see setup.py), or by another distribution:
+
+  entry_points={'mcstat.outputs': ['kafka = mcstat_kafka:KafkaOutput']}
+
+and enabled like built-in outputs, by its name in stats_output.
+
+Entry points are the only registry of outputs. When mcstat itself isn't
+installed (runs from source), so that its entry points don't exist, its
+built-in outputs are found in the fallback below, which must list the same
+outputs as setup.py.
+
+Every output has its own bounded queue and thread (see make_outputs in
+mcstat.main). Its class declares the queue it prefers; output_queue_sizes
+and output_overflow override that.
+"""
+import importlib
+import logging
+
+log = logging.getLogger('mcstat.output')
+
+group = 'mcstat.outputs'
+
+# Built-in outputs: name -> 'module:class', used only when mcstat isn't
+# installed.
+builtin = {'db': 'mcstat.backend.db:DbOutput',
+           'stdout': 'mcstat.backend.console:ConsoleOutput',
+           'http': 'mcstat.backend.prometheus:HttpOutput',
+           'metriclog': 'mcstat.backend.metriclog:MetricLog',
+           }
+
+# Outputs (name -> entry point, or _Builtin when mcstat isn't installed),
+# found on the first use.
+_outputs = None
+
+
+class Output(object):
+    """
+    Base class of outputs.
+
+    Output receives events in order: MetricBatches of every interval (of
+    output_intervals) followed by Tick, and StreamEvents and Alerts. Its
+    queue can drop whole intervals (see mcstat.health.OutputQueue), other
+    events are never dropped.
+    """
+    # Maximum number of events in the queue of the output.
+    queue_size = 1000
+    # What happens, when the queue is full (see
+    # mcstat.health.output_overflow_policies). Outputs, which need only the
+    # latest metrics, prefer 'coalesce'.
+    overflow = 'drop'
+    # Whether handle never blocks, so that it can be called by the sender of
+    # events (the asyncio engine) instead of a thread of the output.
+    inline = False
+    # Whether mcstat can end without waiting for the output to handle all
+    # events (its thread is a daemon).
+    daemon = False
+
+    @classmethod
+    def from_config(cls, main_config, db_config, queues, health):
+        """
+        Creates the output.
+
+        :type main_config: mcstat.config._Main
+        :type db_config: mcstat.config._DB
+        :param queues: Dictionary (name -> Queue) of internal queues and
+        queues of outputs.
+        :param health: mcstat.health.Health or None.
+        """
+        return cls()
+
+    def handle(self, event):
+        """Handles event (except Term)."""
+        raise NotImplementedError
+
+    def close(self):
+        """Called after the last event."""
+
+
+class _Builtin(object):
+    """Entry point of built-in output, when mcstat isn't installed."""
+    def __init__(self, value):
+        self.module, _, self.attr = value.partition(':')
+
+    def load(self):
+        return getattr(importlib.import_module(self.module), self.attr)
+
+
+def find_outputs():
+    """:return: Dictionary mapping name of output to its entry point."""
+    global _outputs
+    if _outputs is None:
+        try:
+            import pkg_resources
+            entry_points = list(pkg_resources.iter_entry_points(group))
+        except ImportError:
+            entry_points = []
+        if any(entry_point.dist.project_name == 'mcstat'
+               for entry_point in entry_points):
+            _outputs = {}
+        else:
+            _outputs = {name: _Builtin(value)
+                        for name, value in builtin.items()}
+        _outputs.update((entry_point.name, entry_point)
+                        for entry_point in entry_points)
+    return _outputs
+
+
+def output_names():
+    """:return: Sorted names of all outputs."""
+    return sorted(find_outputs())
+
+
+def load_output(name):
+    """
+    :return: Class of output.
+    :raise ValueError: If there is no such output.
+    """
+    entry_point = find_outputs().get(name)
+    if entry_point is None:
+        raise ValueError("Invalid output: {!r}".format(name))
+    return entry_point.load()
+
+
+def run(queue, output):
+    """Handles events from queue until Term, then closes output."""
+    try:
+        while True:
+            event = queue.get()
+            if event.is_term():
+                break
+            output.handle(event)
+            queue.task_done()
+    finally:
+        output.close()
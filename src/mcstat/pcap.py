@@ -0,0 +1,403 @@
+"""
+Offline analysis of packet captures (pcap or pcapng files).
+
+UDP datagrams of channels are read from memory-mapped capture and sent, as
+samples of every interval, to the same worker as received datagrams. Time
+is the time of capture, so captures are processed as fast as they can be
+read.
+"""
+from mcstat.analyzer import make_analyzers, analyze
+from mcstat.core import worker, wait_for_queues
+from mcstat.burst import bucket_layout
+from mcstat.domain import Aggr, Sample, Term, Tick
+from mcstat.rollup import make_rollups
+
+import logging
+import mmap
+import os
+import socket
+import struct
+import threading
+
+try:
+    # Python 2
+    from Queue import Queue
+except ImportError:
+    # Python 3
+    from queue import Queue
+
+log = logging.getLogger('mcstat.pcap')
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_LINUX_SLL2 = 276
+
+_PCAP_MAGIC = {0xa1b2c3d4: 1e-6, 0xa1b23c4d: 1e-9}
+_SHB = 0x0a0d0d0a
+_IDB = 1
+_EPB = 6
+_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+_IF_TSRESOL = 9
+
+_ETHERTYPE_IP = 0x0800
+_ETHERTYPE_VLAN = (0x8100, 0x88a8)
+
+# IPv4 (version and IHL, flags and fragment offset, protocol, destination),
+# and UDP (destination port and length).
+_IP = struct.Struct('>B5xHxB6x4s')
+_UDP = struct.Struct('>2xHH')
+_UDP_HEADER_SIZE = 8
+_ETHER_UDP_HEADERS_SIZE = 14 + 20 + _UDP_HEADER_SIZE
+
+# Events waiting in any output queue, after which reading waits.
+max_queued = 10000
+
+
+def packets(data):
+    """
+    Yields packets of capture.
+
+    :param data: Contents of pcap or pcapng file (bytes-like).
+    :return: Iterator of (timestamp, link type, offset of packet in data,
+    captured length).
+    :raise ValueError: If data isn't a capture.
+    """
+    if len(data) >= 12 and struct.unpack_from('<I', data, 0)[0] == _SHB:
+        return _pcapng_packets(data)
+    pcap = _pcap_format(data)
+    if pcap is None:
+        raise ValueError("Not a pcap or pcapng file.")
+    return _pcap_packets(data, *pcap)
+
+
+def _pcap_packets(data, order, scale, linktype):
+    header = struct.Struct(order + 'IIII')
+    offset = 24
+    end = len(data)
+    while offset + header.size <= end:
+        seconds, fraction, length, _ = header.unpack_from(data, offset)
+        offset += header.size
+        if offset + length > end:
+            log.warning("Capture is truncated.")
+            break
+        yield seconds + fraction * scale, linktype, offset, length
+        offset += length
+
+
+def _pcapng_packets(data):
+    order = '<'
+    # (link type, timestamp unit in seconds) of interfaces of section.
+    interfaces = []
+    offset = 0
+    end = len(data)
+    while offset + 12 <= end:
+        block_type, = struct.unpack_from(order + 'I', data, offset)
+        if block_type == _SHB:
+            magic, = struct.unpack_from('<I', data, offset + 8)
+            order = '<' if magic == _BYTE_ORDER_MAGIC else '>'
+            interfaces = []
+        length, = struct.unpack_from(order + 'I', data, offset + 4)
+        if length < 12 or offset + length > end:
+            log.warning("Capture is truncated.")
+            break
+        if block_type == _IDB:
+            linktype, = struct.unpack_from(order + 'H', data, offset + 8)
+            interfaces.append((linktype, _tsresol(data, offset + 16,
+                                                  offset + length - 4,
+                                                  order)))
+        elif block_type == _EPB:
+            interface, high, low, captured = struct.unpack_from(
+                order + 'IIII', data, offset + 8)
+            linktype, scale = interfaces[interface]
+            yield ((high << 32) | low) * scale, linktype, offset + 28, \
+                captured
+        offset += length
+
+
+def _tsresol(data, offset, end, order):
+    """:return: Timestamp unit of interface, from its options."""
+    while offset + 4 <= end:
+        code, length = struct.unpack_from(order + 'HH', data, offset)
+        if code == 0:
+            break
+        if code == _IF_TSRESOL and length >= 1:
+            value = bytearray(data[offset + 4:offset + 5])[0]
+            if value & 0x80:
+                return 2.0 ** -(value & 0x7f)
+            return 10.0 ** -value
+        offset += 4 + (length + 3) // 4 * 4
+    return 1e-6
+
+
+def ip_offset(linktype, data, offset, length):
+    """:return: Offset of IPv4 header in packet, or None."""
+    end = offset + length
+    if linktype == LINKTYPE_ETHERNET:
+        position = offset + 12
+        while position + 2 <= end:
+            ethertype, = struct.unpack_from('>H', data, position)
+            if ethertype not in _ETHERTYPE_VLAN:
+                return position + 2 if ethertype == _ETHERTYPE_IP else None
+            position += 4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if length >= 16 and \
+                struct.unpack_from('>H', data, offset + 14)[0] == \
+                _ETHERTYPE_IP:
+            return offset + 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        if length >= 20 and \
+                struct.unpack_from('>H', data, offset)[0] == _ETHERTYPE_IP:
+            return offset + 20
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4):
+        return offset
+    elif linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        # Address family in byte order of the capturing host.
+        if length >= 4 and data[offset:offset + 4] in \
+                (b'\x02\0\0\0', b'\0\0\0\x02'):
+            return offset + 4
+    return None
+
+
+def datagrams(data, channels):
+    """
+    Yields UDP datagrams of channels in capture. Fragments after the first
+    one are ignored (the size of datagram is known from the first).
+
+    :param data: Contents of pcap or pcapng file.
+    :param channels: Channels (ip, port).
+    :return: Iterator of (timestamp, channel, size of datagram, offset of
+    captured payload, captured length of payload).
+    """
+    by_addr = {(socket.inet_aton(ip), port): (ip, port)
+               for ip, port in channels}
+    pcap = _pcap_format(data)
+    if pcap is not None and pcap[2] == LINKTYPE_ETHERNET:
+        return _pcap_ether_datagrams(data, pcap[0], pcap[1], by_addr)
+    return _datagrams(data, by_addr)
+
+
+def _datagrams(data, by_addr):
+    for timestamp, linktype, offset, length in packets(data):
+        datagram = _datagram(data, linktype, offset, length, by_addr)
+        if datagram is not None:
+            yield (timestamp,) + datagram
+
+
+def _datagram(data, linktype, offset, length, by_addr):
+    """
+    :param by_addr: Maps (packed ip, port) to channel.
+    :return: (channel, size, offset of payload, captured length of payload)
+    of UDP datagram of a channel, or None.
+    """
+    end = offset + length
+    ip = ip_offset(linktype, data, offset, length)
+    if ip is None or ip + _IP.size > end:
+        return None
+    version, fragment, protocol, dst = _IP.unpack_from(data, ip)
+    if version >> 4 != 4 or protocol != 17 or fragment & 0x1fff:
+        return None
+    udp = ip + (version & 0x0f) * 4
+    if udp + _UDP_HEADER_SIZE > end:
+        return None
+    port, size = _UDP.unpack_from(data, udp)
+    channel = by_addr.get((dst, port))
+    if channel is None:
+        return None
+    payload = udp + _UDP_HEADER_SIZE
+    size -= _UDP_HEADER_SIZE
+    return channel, size, payload, max(min(size, end - payload), 0)
+
+
+def _pcap_format(data):
+    """:return: (byte order, timestamp unit, link type) of pcap, or None."""
+    if len(data) < 24:
+        return None
+    for order in '<>':
+        magic, = struct.unpack_from(order + 'I', data, 0)
+        if magic in _PCAP_MAGIC:
+            # Upper bits of link type are FCS flags.
+            linktype = struct.unpack_from(order + 'I', data, 20)[0] & \
+                0x0fffffff
+            return order, _PCAP_MAGIC[magic], linktype
+    return None
+
+
+def _masked(order, fmt, pattern):
+    """
+    :param pattern: Bytes, as they are in packet.
+    :return: pattern unpacked as integer of format fmt in byte order.
+    """
+    return struct.unpack(order + fmt, pattern)[0]
+
+
+def _pcap_ether_datagrams(data, order, scale, by_addr):
+    """
+    Fast path of datagrams for pcap of Ethernet. Record header and the
+    needed parts of Ethernet, IPv4 and UDP headers are unpacked at once, as
+    a few integers in byte order of the file, which are compared with masked
+    patterns. Other packets (e.g. with VLAN tags or IP options) are parsed
+    by _datagram.
+    """
+    header = struct.Struct(order + 'IIII')
+    # Bytes 12-15 (ethertype, version and IHL, TOS), 20-23 (flags and
+    # fragment offset, TTL, protocol), 30-37 (destination, source and
+    # destination port) and 38-39 (UDP length) of packet.
+    record = struct.Struct(order + 'III4x12xI4xI6xQH')
+    ip_mask = _masked(order, 'I', b'\xff\xff\xff\0')
+    ip_value = _masked(order, 'I', b'\x08\x00\x45\0')
+    udp_mask = _masked(order, 'I', b'\x1f\xff\0\xff')
+    udp_value = _masked(order, 'I', b'\0\0\0\x11')
+    addr_mask = _masked(order, 'Q', b'\xff' * 4 + b'\0\0\xff\xff')
+    channels = {_masked(order, 'Q', dst + b'\0\0' + struct.pack('>H', port)):
+                channel for (dst, port), channel in by_addr.items()}
+    swap = order == '<'
+    min_length = _ETHER_UDP_HEADERS_SIZE
+    unpack_record = record.unpack_from
+    header_size = header.size
+    end = len(data)
+    # Records up to fast_end can be unpacked as whole.
+    fast_end = end - record.size
+    offset = 24
+    while offset + header_size <= end:
+        if offset <= fast_end:
+            seconds, fraction, length, ip, udp, addr, size = \
+                unpack_record(data, offset)
+        else:
+            seconds, fraction, length, _ = header.unpack_from(data, offset)
+            ip = None
+        packet = offset + header_size
+        offset = packet + length
+        if offset > end:
+            log.warning("Capture is truncated.")
+            return
+        if ip is None or ip & ip_mask != ip_value or length < min_length:
+            datagram = _datagram(data, LINKTYPE_ETHERNET, packet, length,
+                                 by_addr)
+            if datagram is not None:
+                yield (seconds + fraction * scale,) + datagram
+            continue
+        if udp & udp_mask != udp_value:
+            continue
+        channel = channels.get(addr & addr_mask)
+        if channel is None:
+            continue
+        if swap:
+            size = ((size & 0xff) << 8) | (size >> 8)
+        size -= _UDP_HEADER_SIZE
+        payload = packet + min_length
+        yield (seconds + fraction * scale, channel, size, payload,
+               max(min(size, packet + length - payload), 0))
+
+
+def start_time(data):
+    """:return: Timestamp of the first packet, or None."""
+    for timestamp, _, _, _ in packets(data):
+        return timestamp
+    return None
+
+
+def read_capture(data, channels, interval, start, queue, analyzer_names=(),
+                 arrivals=False, queues=()):
+    """
+    Sends samples of channels of every interval of capture to worker queue,
+    followed by Tick at the end of the interval (in time of capture), and
+    Term at the end. The last interval is reported as whole.
+
+    :param start: Start of the first interval.
+    :param analyzer_names: Names of analyzers of payload.
+    :param arrivals: Whether samples have Aggr.arrivals (for burst buckets).
+    :param queues: Output queues. Reading waits, while any of them is too
+    long.
+    :return: Number of datagrams.
+    """
+    analyzers = {channel: make_analyzers(analyzer_names)
+                 for channel in channels} if analyzer_names else None
+    # Maps channel to [packets, bytes, arrivals, payloads].
+    pending = {}
+
+    def flush(now):
+        for channel, (num_packets, num_bytes, times, payloads) in \
+                pending.items():
+            aggr = Aggr(num_packets, num_bytes, arrivals=times)
+            if analyzers is not None:
+                aggr.extra = analyze(analyzers[channel], payloads,
+                                     [arrival for arrival, _ in times])
+            queue.put(Sample(now, channel, aggr))
+        pending.clear()
+        queue.put(Tick(now))
+        wait_for_queues(queues, max_queued)
+
+    keep_arrivals = arrivals or analyzers is not None
+    count = 0
+    # Computed from the index, so that fractional intervals don't drift.
+    index = 1
+    tick = start + interval
+    try:
+        for timestamp, channel, size, payload, length in \
+                datagrams(data, channels):
+            while timestamp >= tick:
+                flush(tick)
+                index += 1
+                tick = start + index * interval
+            state = pending.get(channel)
+            if state is None:
+                state = pending[channel] = [0, 0, [], []]
+            state[0] += 1
+            state[1] += size
+            if keep_arrivals:
+                state[2].append((timestamp, size))
+            if analyzers is not None:
+                state[3].append(data[payload:payload + length])
+            count += 1
+        flush(tick)
+    finally:
+        queue.put(Term(tick))
+    return count
+
+
+def run(main_config, db_config):
+    """Analyzes capture main_config.pcap and writes metrics to outputs."""
+    from mcstat.main import make_outputs, make_alerts, load_channels
+
+    interval = main_config.interval
+    channels = load_channels(main_config, db_config)
+    with open(main_config.pcap, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            log.info("No packets.")
+            return
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        start = start_time(data)
+        if start is None:
+            log.info("No packets.")
+            return
+        internal_queues = {}
+        output_queues, threads = make_outputs(main_config, db_config,
+                                              interval, internal_queues,
+                                              queue_size=0)
+        # Metrics of intervals are sent to outputs by the usual worker.
+        layout = bucket_layout(interval, main_config.burst_bucket)
+        queue = Queue()
+        output_queues = make_rollups(interval, output_queues)
+        alerts = make_alerts(main_config, db_config, output_queues)
+        if alerts is not None:
+            output_queues = [alerts]
+        # Capture time is both the clock and the time of ticks.
+        threads.append(threading.Thread(
+            name="worker", target=worker,
+            args=(interval, queue, output_queues, layout),
+            kwargs={'window_start': start, 'table_start': start}))
+        for thread in threads:
+            thread.start()
+        count = read_capture(data, channels, interval, start, queue,
+                             main_config.analyzers, layout is not None,
+                             list(internal_queues.values()))
+        for thread in threads:
+            thread.join()
+        log.info("Read %d datagrams of channels.", count)
+    finally:
+        data.close()
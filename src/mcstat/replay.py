@@ -0,0 +1,128 @@
+"""
+Replays metric log (see mcstat.metriclog) into outputs.
+
+Metrics are replayed as they were logged: they aren't rolled up to
+output_intervals, as the log doesn't keep aggregates of analyzers.
+"""
+from mcstat.config import default_config, load_config, merge_configs, \
+    multicast_address, Config
+from mcstat.core import wait_for_queues
+from mcstat.domain import MetricBatch, Term, Tick
+from mcstat.main import make_outputs, setup_logging
+from mcstat.metriclog import read_segments
+from mcstat.output import output_names
+
+import argparse
+import datetime
+import logging
+import sys
+import time
+
+log = logging.getLogger('mcstat.replay')
+
+# Replay waits, while an output queue has more events.
+max_queued = 10000
+
+
+def replay(segments, queues_out, start=None, end=None, channels=None,
+           queues=()):
+    """
+    Sends metrics of segments to queues: MetricBatch of every timestamp
+    followed by Tick, and Term at the end.
+
+    :param queues: Queues of outputs. Replay waits, while any of them is too
+    long.
+    :return: Number of metrics.
+    """
+    def send_all(event):
+        for queue in queues_out:
+            queue.put_nowait(event)
+
+    def send_batch(metrics):
+        timestamp = metrics[0].timestamp
+        send_all(MetricBatch.of(timestamp, metrics[0].interval, metrics))
+        send_all(Tick(timestamp))
+
+    count = 0
+    # Metrics of the last timestamp.
+    metrics = []
+    try:
+        for segment in segments:
+            for metric in segment.metrics(start, end, channels):
+                if metrics and metric.timestamp != metrics[0].timestamp:
+                    send_batch(metrics)
+                    metrics = []
+                    wait_for_queues(queues, max_queued)
+                metrics.append(metric)
+                count += 1
+        if metrics:
+            send_batch(metrics)
+    finally:
+        send_all(Term(time.time()))
+    return count
+
+
+def timestamp(string):
+    """Argparse type of time: Unix time or local YYYY-MM-DDTHH:MM:SS."""
+    try:
+        return float(string)
+    except ValueError:
+        pass
+    try:
+        date = datetime.datetime.strptime(string, '%Y-%m-%dT%H:%M:%S')
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "Invalid time: {!r}".format(string))
+    return time.mktime(date.timetuple())
+
+
+def commandline_parser():
+    parser = argparse.ArgumentParser(
+        description="Replays metric log into outputs.")
+    parser.add_argument("-v", action="store_true", dest="verbose",
+                        help="Verbose output.", default=False)
+    parser.add_argument("-c", action='store', dest='config', metavar="FILE",
+                        help='Configuration file (outputs and database).')
+    parser.add_argument("-o", action='append', dest='outputs',
+                        choices=output_names(),
+                        help='Output (default: stdout). Can be repeated.')
+    parser.add_argument("--start", type=timestamp,
+                        help='Time of the first metric.')
+    parser.add_argument("--end", type=timestamp,
+                        help='Time after the last metric.')
+    parser.add_argument("--channel", action='append', dest='channels',
+                        type=multicast_address,
+                        help='Channel (ip:port). Can be repeated.')
+    parser.add_argument("directory", nargs='?',
+                        help='Directory of the log. Default: metric_log_dir.')
+    return parser
+
+
+def main():
+    parser = commandline_parser()
+    args = parser.parse_args(sys.argv[1:])
+    configs = [load_config(args.config)] if args.config else [Config()]
+    config = merge_configs(*(configs + [default_config()]))
+    setup_logging(logging.DEBUG if args.verbose else logging.INFO)
+    directory = args.directory or config.main.metric_log_dir
+    if not directory:
+        parser.error("No directory of metric log.")
+    names = args.outputs or ['stdout']
+    if 'metriclog' in names and config.main.metric_log_dir == directory:
+        parser.error("Can't replay metric log into itself.")
+
+    internal_queues = {}
+    output_queues, threads = make_outputs(config.main, config.db,
+                                          config.main.interval,
+                                          internal_queues, names,
+                                          queue_size=0)
+    for thread in threads:
+        thread.start()
+    count = replay(read_segments(directory, args.start, args.end),
+                   [queue for queue, _ in output_queues],
+                   args.start, args.end,
+                   set(args.channels) if args.channels else None,
+                   list(internal_queues.values()))
+    for thread in threads:
+        thread.join()
+    log.info("Replayed %d metrics.", count)
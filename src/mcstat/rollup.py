@@ -0,0 +1,158 @@
+"""
+Rollups: metrics of consecutive intervals combined into metrics of a longer
+interval, e.g. 60 intervals of 1 second into 1 minute.
+"""
+from mcstat.stat import batch
+
+import copy
+import operator
+
+
+def rollup_extra(a, b):
+    """
+    Combines partial statistics of analyzers of consecutive intervals.
+
+    Statistics, which have a rollup method (e.g. burst buckets), are combined
+    with it, others are added. Statistics of b are copied into a, so that b
+    (of a batch, which other outputs and rollups also received) isn't
+    changed.
+
+    :return: a updated with b (new dictionary if a is None).
+    """
+    if a is None:
+        a = {}
+    for name, stats in b.items():
+        if name not in a:
+            a[name] = copy.deepcopy(stats)
+        elif hasattr(a[name], 'rollup'):
+            a[name] = a[name].rollup(stats)
+        else:
+            a[name] += stats
+    return a
+
+
+class Rollup(object):
+    """
+    Output queue, which combines metric batches of every factor intervals
+    into one batch, and sends it (followed by the tick) to its output queues.
+    A rollup interval also ends at the tick, which is at a multiple of its
+    length, so that rollups are aligned like ticks (see mcstat.clock) - the
+    first one is then shorter.
+
+    Workers send events to it like to any other output queue, in their
+    thread. Other events are passed through. On termination, metrics of
+    the incomplete rollup interval are sent.
+
+    Received batches aren't changed. Rollups of several resolutions are
+    chained (see make_rollups).
+    """
+    def __init__(self, interval, factor, queues_out):
+        """
+        :param interval: Interval of received metrics (in seconds).
+        :param factor: Number of intervals in one rollup interval.
+        :param queues_out: Queues (or rollups) of rollup metrics.
+        """
+        self.interval = interval
+        self.factor = factor
+        self.queues_out = queues_out
+        self.ticks = 0
+        self.last_tick = None
+        self.reset()
+
+    def reset(self):
+        """Starts counts of a new rollup interval."""
+        self.channels = ()
+        self.elapsed = 0.0
+        self.slots = {}
+        self.packets = []
+        self.bytes = []
+        self.extras = []
+
+    def send_all(self, event):
+        for queue in self.queues_out:
+            queue.put_nowait(event)
+
+    def put_nowait(self, event):
+        if event.is_batch():
+            self.add(event)
+        elif event.is_tick():
+            self.ticks += 1
+            self.last_tick = event.timestamp
+            if self.ticks == self.factor or \
+                    self.at_boundary(event.timestamp):
+                self.flush(event.timestamp)
+                self.send_all(event)
+        else:
+            if event.is_term() and self.ticks:
+                self.flush(self.last_tick)
+            self.send_all(event)
+
+    def at_boundary(self, now):
+        """
+        Whether tick at now is the nearest one to a multiple of the rollup
+        interval.
+        """
+        length = self.interval * self.factor
+        offset = now % length
+        return min(offset, length - offset) < self.interval / 2.0
+
+    def add(self, metrics):
+        """Adds counts of MetricBatch."""
+        packets, num_bytes, extras = metrics.counts
+        self.elapsed += metrics.elapsed
+        if metrics.channels == self.channels:
+            # Usually channels don't change: counts are added by columns.
+            self.packets = list(map(operator.add, self.packets, packets))
+            self.bytes = list(map(operator.add, self.bytes, num_bytes))
+            slots = range(len(self.channels))
+        else:
+            slots = []
+            for channel, p, b in zip(metrics.channels, packets, num_bytes):
+                slot = self.slots.get(channel)
+                if slot is None:
+                    slot = self.slots[channel] = len(self.packets)
+                    self.packets.append(p)
+                    self.bytes.append(b)
+                    self.extras.append(None)
+                else:
+                    self.packets[slot] += p
+                    self.bytes[slot] += b
+                slots.append(slot)
+            self.channels = tuple(sorted(self.slots, key=self.slots.get))
+        if extras is not None:
+            for slot, extra in zip(slots, extras):
+                if extra:
+                    self.extras[slot] = rollup_extra(self.extras[slot],
+                                                     extra)
+
+    def flush(self, now):
+        """Sends metrics of the rollup interval, which ended now."""
+        interval = self.interval * self.ticks
+        if self.channels:
+            # Over the measured intervals of the received batches.
+            self.send_all(batch(now, interval, self.channels, self.packets,
+                                self.bytes, self.extras, self.elapsed))
+        self.reset()
+        self.ticks = 0
+
+
+def make_rollups(interval, outputs):
+    """
+    Chains rollups of intervals of outputs. Each interval must be a multiple
+    of the previous (shorter) one.
+
+    :param interval: Interval of metrics of the worker (in seconds).
+    :param outputs: List of (output queue, interval of its metrics).
+    :return: Queues, to which the worker sends metrics.
+    """
+    intervals = [interval] + sorted({i for _, i in outputs if i != interval})
+    rollup = None
+    for shorter, longer in reversed(list(zip(intervals, intervals[1:]))):
+        queues = [queue for queue, i in outputs if i == longer]
+        if rollup is not None:
+            queues.append(rollup)
+        rollup = Rollup(shorter, int(round(longer / shorter)), queues)
+    queues = [queue for queue, i in outputs if i == interval]
+    if rollup is not None:
+        queues.append(rollup)
+    return queues
@@ -0,0 +1,256 @@
+from mcstat.core import open_channels, close_channels, send_term, \
+    receive_buffer, make_detector, poll_timeout, pin_receiver, loop_time, \
+    ReceiveOptions
+from mcstat.clock import Window
+from mcstat.counters import CounterTable
+from mcstat.health import ReceiverMonitor, ReceiverReport
+from mcstat.stat import table_batch
+
+import logging
+import multiprocessing
+import select
+import signal
+import time
+
+log = logging.getLogger('mcstat.shard')
+
+# Messages sent from parent to shard.
+SNAPSHOT = 'snapshot'
+STOP = 'stop'
+
+
+def partition(channels, num_shards):
+    """
+    Splits channels between shards.
+
+    :param channels: List of channels. Channel's slot is its index in this
+    list.
+    :return: List of at most num_shards non-empty lists of (slot, channel).
+    """
+    num_shards = max(min(num_shards, len(channels)), 1)
+    shards = [[] for _ in range(num_shards)]
+    for slot, channel in enumerate(channels):
+        shards[slot % num_shards].append((slot, channel))
+    return [shard for shard in shards if shard]
+
+
+def shard_receiver(channels, conn, options=ReceiveOptions(),
+                   events_conn=None, monitor=False):
+    """
+    Main function of shard process.
+
+    Counts datagrams of channels, until STOP is received from conn. Sends
+    tuple (packets, bytes, extras, buckets, report) of counter table to conn
+    on every SNAPSHOT.
+
+    :param events_conn: Connection, to which StreamEvents are sent.
+    :param monitor: Whether the shard measures itself. Report is
+    mcstat.health.ReceiverReport then, otherwise None.
+    """
+    # Termination is controlled by the parent.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.set_wakeup_fd(-1)
+
+    # Maps file descriptor to ChannelSocket or PortSocket
+    socks_map = {}
+    epoll = select.epoll()
+
+    buffer = receive_buffer(options)
+    monitor = ReceiverMonitor() if monitor else None
+    options = options._replace(monitor=monitor)
+    # With timestamps, the clock is read after wake-up only to measure the
+    # loop (see mcstat.core.loop_time).
+    read_clock = monitor is not None or not options.timestamps
+    pin_receiver(options)
+    slots = {channel: slot for slot, channel in enumerate(channels)}
+    table = CounterTable(len(channels), options.buckets)
+
+    try:
+        open_channels(channels, epoll, socks_map, options)
+        epoll.register(conn.fileno(), select.EPOLLIN)
+        detector = make_detector(socks_map, options)
+
+        loop = True
+
+        while loop:
+            events = epoll.poll(poll_timeout(detector))
+            started = time.time() if read_clock else None
+            drained = []
+            for fileno, event in events:
+                if fileno == conn.fileno():
+                    try:
+                        message = conn.recv()
+                    except EOFError:
+                        message = STOP
+                    if message == SNAPSHOT:
+                        conn.send((table.packets, table.bytes,
+                                   table.extras, table.buckets,
+                                   monitor.take() if monitor is not None
+                                   else None))
+                        table = CounterTable(len(channels),
+                                             options.buckets)
+                    else:
+                        loop = False
+                        break
+                else:
+                    drained.extend(socks_map[fileno].drain(buffer))
+            now = loop_time(drained, started, options.timestamps)
+            received = []
+            for channel, aggr in drained:
+                table.add(slots[channel], aggr.packets, aggr.bytes,
+                          aggr.extra, now, aggr.arrivals)
+                received.append(channel)
+            if detector is not None:
+                for event in detector.check(received, now):
+                    events_conn.send(event)
+            if monitor is not None:
+                monitor.loop(time.time() - started)
+    finally:
+        close_channels(epoll, socks_map)
+        epoll.close()
+        conn.close()
+
+
+class Shard(object):
+    """
+    Handle of shard process in parent.
+
+    Shard is a child process with its own epoll loop, which counts datagrams
+    of its channels in a local counter table. On every tick the parent
+    requests counter tables from all shards and merges them.
+    """
+    def __init__(self, name, slot_channels, options=ReceiveOptions()):
+        """
+        :param slot_channels: List of (slot, channel) handled by the shard.
+        :type options: mcstat.core.ReceiveOptions
+        :param options: If monitor is set, the shard measures itself with its
+        own monitor.
+        """
+        self.slots = [slot for slot, _ in slot_channels]
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.events, child_events = multiprocessing.Pipe(False)
+        self.process = multiprocessing.Process(
+            name=name,
+            target=shard_receiver,
+            args=([channel for _, channel in slot_channels], child_conn,
+                  options._replace(monitor=None), child_events,
+                  options.monitor is not None)
+            )
+
+    def start(self):
+        self.process.start()
+
+    def request_snapshot(self):
+        self.conn.send(SNAPSHOT)
+
+    def add_snapshot_to(self, table):
+        """
+        Receives requested snapshot and adds it to table of all channels.
+
+        :return: ReceiverReport of the shard, or None.
+        """
+        packets, num_bytes, extras, buckets, report = self.conn.recv()
+        for i, slot in enumerate(self.slots):
+            table.add(slot, packets[i], num_bytes[i], extras[i])
+            if buckets is not None:
+                table.add_buckets(slot, buckets[i])
+        return report
+
+    def stop(self):
+        try:
+            self.conn.send(STOP)
+        except IOError:
+            pass
+        self.process.join()
+        self.conn.close()
+
+
+def forward_events(wake_up_fd, shards, queue):
+    """
+    Receiver thread of sharded engine: forwards StreamEvents from shards to
+    the worker, until wake_up_fd is readable. Then sends Term to the worker.
+    """
+    conns = {shard.events.fileno(): shard.events for shard in shards}
+    try:
+        loop = True
+        while loop:
+            readable, _, _ = select.select([wake_up_fd] + list(conns), [], [])
+            for fileno in readable:
+                if fileno == wake_up_fd:
+                    loop = False
+                    break
+                try:
+                    queue.put_nowait(conns[fileno].recv())
+                except EOFError:
+                    # Shard ended.
+                    del conns[fileno]
+    finally:
+        send_term(queue)
+
+
+def make_shards(channels, num_shards, options=ReceiveOptions()):
+    """
+    :param options: If cpus are set, shards run on them in turn, one CPU per
+    shard.
+    """
+    cpus = options.cpus
+    return [Shard("shard-{}".format(i), slot_channels,
+                  options._replace(cpus=[cpus[i % len(cpus)]])
+                  if cpus else options)
+            for i, slot_channels in enumerate(partition(channels,
+                                                        num_shards))]
+
+
+def shard_worker(interval, channels, shards, queue_in, queues_out,
+                 layout=None, health=None, start=None):
+    """
+    Worker, which merges counter tables of shards on every tick.
+
+    Stops shards on Term.
+
+    :param channels: List of all channels, in order of slots.
+    :param shards: List of started shards.
+    :param queue_in: Queue with Tick and Term events.
+    :param layout: Layout of sub-interval buckets, or None.
+    :param health: mcstat.health.Health, which receives merged reports of
+    shards, or None.
+    :param start: Start of the first interval (monotonic time): when shards
+    were started. Default: now.
+    """
+    def send_all(obj):
+        for queue in queues_out:
+            queue.put_nowait(obj)
+
+    window = Window(start)
+    try:
+        while True:
+            event = queue_in.get()
+            if event.is_term():
+                send_all(event)
+                break
+            elif event.is_tick():
+                now = event.timestamp
+                log.debug("%.03f: Tick", now)
+                for shard in shards:
+                    shard.request_snapshot()
+                elapsed = window.next(default=interval)
+                table = CounterTable(len(channels), layout)
+                report = ReceiverReport()
+                for shard in shards:
+                    shard_report = shard.add_snapshot_to(table)
+                    if shard_report is not None:
+                        report += shard_report
+                drops = health.tick(now, report) if health is not None \
+                    else None
+                send_all(table_batch(now, interval, channels, table, drops,
+                                     elapsed))
+                send_all(event)
+            elif event.is_stream_event():
+                send_all(event)
+            queue_in.task_done()
+    finally:
+        for shard in shards:
+            shard.stop()
+        send_term(*queues_out)
@@ -0,0 +1,106 @@
+import logging
+import os
+import pickle
+import struct
+
+log = logging.getLogger('mcstat.spool')
+
+_LENGTH = struct.Struct(">I")
+_SUFFIX = '.seg'
+
+
+class Spool(object):
+    """
+    Batches of rows stored on disk, in append-only segment files.
+
+    Batches are appended to the newest segment, and read back a whole
+    segment at a time, oldest first. Total size of segments is limited:
+    when it's exceeded, the oldest segments are deleted.
+    """
+    def __init__(self, directory, max_bytes, segment_bytes=1 << 20):
+        """
+        :param directory: Directory of segment files, created if missing.
+        Segments left there by previous run are read too.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Numbers of segments, oldest first.
+        self.segments = sorted(int(name[:-len(_SUFFIX)])
+                               for name in os.listdir(directory)
+                               if name.endswith(_SUFFIX))
+        # Segment, to which batches are appended.
+        self.current = None
+        self.dropped = 0
+
+    def __len__(self):
+        """Number of segments."""
+        return len(self.segments)
+
+    def path(self, segment):
+        return os.path.join(self.directory,
+                            "{:012d}{}".format(segment, _SUFFIX))
+
+    def size(self):
+        return sum(os.path.getsize(self.path(segment))
+                   for segment in self.segments)
+
+    def append(self, rows):
+        """Appends batch of rows and syncs it to disk."""
+        if self.current is None or \
+                os.path.getsize(self.path(self.current)) >= \
+                self.segment_bytes:
+            self.current = self.segments[-1] + 1 if self.segments else 0
+            self.segments.append(self.current)
+        data = pickle.dumps(rows, 2)
+        with open(self.path(self.current), 'ab') as f:
+            f.write(_LENGTH.pack(len(data)) + data)
+            f.flush()
+            os.fsync(f.fileno())
+        while len(self.segments) > 1 and self.size() > self.max_bytes:
+            segment = self.segments[0]
+            self.dropped += len(self.read(segment))
+            self.remove(segment)
+            log.warning("Spool is full, %d batches dropped so far.",
+                        self.dropped)
+
+    def read(self, segment):
+        """
+        :return: List of batches in segment. Incomplete batch at the end
+        (e.g. after crash) is ignored.
+        """
+        with open(self.path(segment), 'rb') as f:
+            data = f.read()
+        batches = []
+        start = 0
+        while start + _LENGTH.size <= len(data):
+            length, = _LENGTH.unpack_from(data, start)
+            start += _LENGTH.size
+            if start + length > len(data):
+                break
+            batches.append(pickle.loads(data[start:start + length]))
+            start += length
+        return batches
+
+    def oldest(self):
+        """
+        Returns the oldest segment for replay. No more batches are appended
+        to it.
+
+        :return: (segment, list of batches), or None if spool is empty.
+        """
+        if not self.segments:
+            return None
+        segment = self.segments[0]
+        if segment == self.current:
+            self.current = None
+        return segment, self.read(segment)
+
+    def remove(self, segment):
+        """Deletes segment, e.g. after it was replayed."""
+        os.remove(self.path(segment))
+        self.segments.remove(segment)
+        if segment == self.current:
+            self.current = None
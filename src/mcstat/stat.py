@@ -1,19 +1,73 @@
-from mcstat.domain import Metric
+from mcstat.domain import Counts, MetricBatch
+from mcstat.health import KernelDrops
 
 
-def metrics(timestamp, interval, channel, aggr):
+def extra_fields(extra, interval):
     """
-    :param timestamp: Timestamp of the metric.
+    :param extra: Partial statistics of analyzers (see Aggr.extra), or None.
+    :return: Extra fields of metric.
+    """
+    fields = {}
+    for stats in (extra or {}).values():
+        fields.update(stats.fields(interval))
+    return fields
+
+
+def batch(timestamp, interval, channels, packets, num_bytes, extras=None,
+          elapsed=None):
+    """
+    Computes metrics of channels from their counts, column by column.
+
+    :param timestamp: Timestamp of metrics.
     :type timestamp: Unix time (time.time)
-    :param channel: The channel.
-    :type channel: (string ip, port)
-    :param interval: Lenght of time over which samples were collected
+    :param interval: Lenght of time over which datagrams were counted
                      (in seconds).
-    :param aggr: Aggretated samples.
-    :type aggr: Aggr
+    :param channels: Sequence of channels.
+    :param packets: Numbers of datagrams of channels.
+    :param num_bytes: Numbers of bytes of channels.
+    :param extras: Partial statistics (see Aggr.extra) or None of channels,
+    or None.
+    :param elapsed: Measured time (in seconds), over which datagrams were
+    counted, if it differs from interval (see mcstat.clock.Window).
+    :rtype: MetricBatch
+    """
+    if extras is not None and not any(extras):
+        extras = None
+    if elapsed is None:
+        elapsed = interval
+    return MetricBatch(
+        timestamp, interval, tuple(channels),
+        # Multiplied in C, not in a Python loop.
+        list(map((8.0 / 1024 / elapsed).__rmul__, num_bytes)),
+        list(map((1.0 / elapsed).__rmul__, packets)),
+        [extra_fields(extra, elapsed) for extra in extras]
+        if extras is not None else None,
+        Counts(packets, num_bytes, extras), elapsed)
+
+
+def table_batch(timestamp, interval, channels, table, drops=None,
+                elapsed=None):
+    """
+    Computes metrics of all channels in counter table.
+
+    The table becomes part of the batch, so it must not be changed
+    afterwards.
+
+    :param channels: List of channels, in order of slots in the table.
+    :type table: mcstat.counters.CounterTable
+    :param drops: Dictionary mapping channel to kernel drops, or None.
+    :param elapsed: Measured length of the interval, see batch.
+    :rtype: MetricBatch
     """
-    return Metric(timestamp=timestamp,
-                  channel=channel,
-                  bitrate=float(aggr.bytes * 8) / 1024 / interval,
-                  packets=float(aggr.packets) / interval
-                  )
+    extras = table.extras
+    if table.buckets is not None:
+        extras = [dict(extra or {}, burst=buckets)
+                  for extra, buckets in zip(extras, table.buckets)]
+    if drops:
+        extras = list(extras)
+        for slot, channel in enumerate(channels):
+            if channel in drops:
+                extras[slot] = dict(extras[slot] or {},
+                                    drops=KernelDrops(drops[channel]))
+    return batch(timestamp, interval, channels, table.packets, table.bytes,
+                 extras, elapsed)
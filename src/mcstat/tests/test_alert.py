@@ -0,0 +1,109 @@
+from mcstat.alert import Alerts, Rule, parse_rule
+from mcstat.domain import MetricBatch, Tick
+
+import pytest
+
+try:
+    # Python 2
+    from Queue import Queue
+except ImportError:
+    # Python 3
+    from queue import Queue
+
+A = ('239.0.0.1', 1234)
+B = ('239.0.0.2', 1234)
+
+
+def drain(queue):
+    events = []
+    while not queue.empty():
+        events.append(queue.get_nowait())
+    return events
+
+
+def send_interval(alerts, now, bitrates, extra=None):
+    """:param bitrates: Dictionary (channel -> bitrate)."""
+    channels = tuple(sorted(bitrates))
+    alerts.put_nowait(MetricBatch(now, 1, channels,
+                                  [bitrates[c] for c in channels],
+                                  [1.0] * len(channels), extra))
+    alerts.put_nowait(Tick(now))
+
+
+def alerts_of(events):
+    return [(e.timestamp, e.channel, e.rule, e.state)
+            for e in events if e.is_alert()]
+
+
+def test_parse_rule():
+    assert parse_rule("low bitrate < 2000 for 3") == \
+        Rule('low', 'bitrate', '<', 2000.0, 3, 60, None)
+    assert parse_rule("unstable bitrate deviates 20 baseline 10 on "
+                      "239.0.0.2:1234 239.0.0.1:1234") == \
+        Rule('unstable', 'bitrate', 'deviates', 20.0, 1, 10, (A, B))
+    assert parse_rule("zero packets = 0", [A]).channels == (A,)
+    for text in ["low bitrate <", "low bitrate >= 1", "low bitrate < x",
+                 "low bitrate < 1 for 0", "low bitrate < 1 baseline 5",
+                 "low bitrate < 1 on 10.0.0.1:1", "low bitrate < 1 for"]:
+        with pytest.raises(ValueError):
+            parse_rule(text)
+
+
+def test_consecutive_intervals():
+    queue = Queue()
+    alerts = Alerts([parse_rule("low bitrate < 100 for 2")], [queue])
+    send_interval(alerts, 1, {A: 50.0, B: 200.0})
+    send_interval(alerts, 2, {A: 50.0, B: 50.0})
+    send_interval(alerts, 3, {A: 200.0, B: 50.0})
+    send_interval(alerts, 4, {A: 200.0, B: 200.0})
+    events = drain(queue)
+    assert alerts_of(events) == [(2, A, 'low', 'raise'),
+                                 (3, A, 'low', 'clear'),
+                                 (3, B, 'low', 'raise'),
+                                 (4, B, 'low', 'clear')]
+    # Alerts follow the batch, before the tick.
+    assert [e.is_batch() for e in events[:3]] == [True, False, True]
+    assert events[3].value == 50.0
+
+
+def test_channels_and_extra_fields():
+    queue = Queue()
+    alerts = Alerts([parse_rule("errors cc_errors > 0 on 239.0.0.2:1234"),
+                     parse_rule("zero packets = 0")], [queue])
+    send_interval(alerts, 1, {A: 1.0, B: 1.0},
+                  [{'cc_errors': 5}, {'cc_errors': 1}])
+    # Channel without the field, or removed, clears its alert.
+    send_interval(alerts, 2, {B: 1.0}, [{}])
+    assert alerts_of(drain(queue)) == [(1, B, 'errors', 'raise'),
+                                       (2, B, 'errors', 'clear')]
+
+
+def test_deviation():
+    queue = Queue()
+    alerts = Alerts([parse_rule("unstable bitrate deviates 50 baseline 3")],
+                    [queue])
+    for now in range(1, 5):
+        send_interval(alerts, now, {A: 100.0})
+    send_interval(alerts, 5, {A: 200.0})
+    send_interval(alerts, 6, {A: 100.0})
+    assert alerts_of(drain(queue)) == [(5, A, 'unstable', 'raise'),
+                                       (6, A, 'unstable', 'clear')]
+    # Before the baseline covers its intervals, nothing deviates.
+    send_interval(alerts, 7, {B: 1000.0})
+    send_interval(alerts, 8, {B: 1.0})
+    assert alerts_of(drain(queue)) == []
+
+
+def test_set_rules():
+    queue = Queue()
+    low = parse_rule("low bitrate < 100")
+    alerts = Alerts([low], [queue])
+    send_interval(alerts, 1, {A: 50.0})
+    alerts.set_rules([low, parse_rule("high bitrate > 10")])
+    send_interval(alerts, 2, {A: 50.0})
+    alerts.set_rules([])
+    send_interval(alerts, 3, {A: 50.0})
+    assert alerts_of(drain(queue)) == [(1, A, 'low', 'raise'),
+                                       (2, A, 'high', 'raise'),
+                                       (3, A, 'low', 'clear'),
+                                       (3, A, 'high', 'clear')]
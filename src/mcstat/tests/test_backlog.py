@@ -0,0 +1,36 @@
+from mcstat.backlog import Backlog, coalesce
+
+
+def test_drop_oldest():
+    backlog = Backlog(2)
+    for batch in ([1, 2], [3], [4]):
+        backlog.put(batch)
+    assert backlog.dropped == 2
+    assert backlog.get() == [3]
+    assert backlog.get() == [4]
+    assert backlog.get(timeout=0) is None
+
+
+def test_coalesce():
+    def key(row):
+        return row[0]
+
+    backlog = Backlog(2, 'coalesce', key)
+    backlog.put([('a', 1), ('b', 1)])
+    backlog.put([('a', 2)])
+    backlog.put([('b', 3)])
+    assert backlog.dropped == 1
+    assert backlog.get() == [('b', 1), ('a', 2)]
+    assert backlog.get() == [('b', 3)]
+    assert coalesce([('a', 1)], [], key) == [('a', 1)]
+
+
+def test_put_back_and_close():
+    backlog = Backlog(2)
+    backlog.put([2])
+    backlog.put_back([1])
+    backlog.close()
+    assert backlog.wait_closed(0)
+    assert backlog.get() == [1]
+    assert backlog.get() == [2]
+    assert backlog.get() is None
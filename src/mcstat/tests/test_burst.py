@@ -0,0 +1,56 @@
+from mcstat.burst import Buckets, bucket_layout, percentile
+from mcstat.counters import CounterTable
+
+
+def test_bucket_layout():
+    assert bucket_layout(1, 0) is None
+    assert bucket_layout(1, 10) == (0.01, 100)
+    assert bucket_layout(1, 300) == (0.3, 4)
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([7], 99) == 7
+
+
+def test_buckets():
+    buckets = Buckets(100.0, (0.25, 4))
+    buckets.add(100.1, 128)
+    buckets.add(100.2, 128)
+    buckets.add(100.6, 1024)
+    # Late data goes to the last bucket.
+    buckets.add(101.5, 32)
+    assert list(buckets.bytes) == [256, 0, 1024, 32]
+    fields = buckets.fields(1)
+    assert fields['bitrate_min'] == 0
+    assert fields['bitrate_max'] == 32.0
+    assert fields['bitrate_p50'] == 1.0
+    assert fields['burst_bytes'] == 1024
+
+
+def test_counter_table_buckets():
+    table = CounterTable(2, (0.5, 2), start=10.0)
+    table.add(1, 1, 100, now=10.7)
+    table.add(1, 1, 100)
+    other = Buckets(10.0, (0.5, 2))
+    other.add(10.1, 50)
+    table.add_buckets(1, other)
+    assert list(table.buckets[1].bytes) == [50, 100]
+    assert list(table.bytes) == [0, 200]
+
+
+def test_buckets_rollup():
+    first = Buckets(100.0, (0.5, 2))
+    first.add(100.1, 64)
+    first.add(100.6, 128)
+    second = Buckets(101.0, (0.5, 2))
+    second.add(101.1, 256)
+    fields = first.rollup(second).fields(2)
+    scale = 8.0 / 1024 / 0.5
+    assert fields['bitrate_min'] == 0
+    assert fields['bitrate_max'] == 256 * scale
+    assert fields['bitrate_p50'] == (64 + 0) / 2.0 * scale
+    assert fields['bitrate_p99'] == 256 * scale
+    assert fields['burst_bytes'] == 256
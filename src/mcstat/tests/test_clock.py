@@ -0,0 +1,75 @@
+from mcstat.clock import next_boundary, schedule, Window
+
+
+class FakeTime(object):
+    """System clock, which advances only by sleeping (and steps)."""
+    def __init__(self, now):
+        self.now = now
+        self.sleeps = []
+
+    def wall(self):
+        return self.now
+
+    def clock(self):
+        return self.now + 1000
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def take(ticks, count, fake=None, work=0):
+    result = []
+    for _ in range(count):
+        result.append(next(ticks))
+        if fake is not None:
+            # Handling of the tick.
+            fake.now += work
+    return result
+
+
+def test_next_boundary():
+    assert next_boundary(10.0, 0.25) == 41
+    assert next_boundary(10.1, 0.25) == 41
+    assert next_boundary(9.99, 1) == 10
+
+
+def test_schedule_aligned():
+    fake = FakeTime(100.3)
+    ticks = schedule(0.25, fake.wall, fake.clock, fake.sleep)
+    result = take(ticks, 4, fake, work=0.1)
+    assert [due for due, _ in result] == [100.5, 100.75, 101.0, 101.25]
+    assert [clock for _, clock in result] == [1100.5, 1100.75, 1101.0,
+                                              1101.25]
+    # Time spent handling ticks isn't added to the interval.
+    assert [round(s, 6) for s in fake.sleeps] == [0.2, 0.15, 0.15, 0.15]
+
+
+def test_schedule_late():
+    fake = FakeTime(0.5)
+    ticks = schedule(1, fake.wall, fake.clock, fake.sleep)
+    assert next(ticks)[0] == 1
+    # Late by less than an interval: the tick is due immediately.
+    fake.now = 2.4
+    assert next(ticks)[0] == 2
+    assert next(ticks)[0] == 3
+    # Ticks missed are skipped.
+    fake.now = 6.5
+    assert next(ticks)[0] == 7
+
+
+def test_schedule_clock_step():
+    fake = FakeTime(0.5)
+    ticks = schedule(1, fake.wall, fake.clock, fake.sleep)
+    assert next(ticks)[0] == 1
+    # System clock went back an hour.
+    fake.now -= 3600
+    assert next(ticks)[0] == -3598
+
+
+def test_window():
+    window = Window(10)
+    assert window.next(10.5) == 0.5
+    assert window.next(11.75) == 1.25
+    assert window.next(11.0, 1) == 1
+    assert window.next(12.0) == 1.0
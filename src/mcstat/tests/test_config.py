@@ -1,4 +1,8 @@
-from mcstat.config import Config, DB, Main, merge_configs
+from mcstat.config import Config, DB, Main, merge_configs, \
+    output_intervals, output_options, output_sizes, channel_sizes, \
+    cpu_list, seconds, is_multiple
+
+import pytest
 
 
 def test_merge_override():
@@ -22,3 +26,52 @@ def test_merge():
     assert merged.db.host == 'a'
     assert merged.db.user == 'b'
     assert merged.main.interval == 2
+
+
+def test_output_intervals():
+    assert output_intervals("db:60 stdout:1") == {'db': 60, 'stdout': 1}
+    assert output_intervals("http:0.5") == {'http': 0.5}
+    with pytest.raises(ValueError):
+        output_intervals("db")
+    with pytest.raises(ValueError):
+        output_intervals("db:0")
+
+
+def test_seconds():
+    assert seconds("0.25") == 0.25
+    assert seconds("2") == 2 and isinstance(seconds("2.0"), int)
+    for string in ["0", "-1", "nan", "inf", "x"]:
+        with pytest.raises(ValueError):
+            seconds(string)
+
+
+def test_is_multiple():
+    assert is_multiple(60, 1)
+    assert is_multiple(0.3, 0.1)
+    assert is_multiple(1, 0.25)
+    assert not is_multiple(1, 0.3)
+    assert not is_multiple(0.1, 0.3)
+
+
+def test_output_sizes():
+    assert output_sizes("db:5000 http:0") == {'db': 5000, 'http': 0}
+    assert output_options("http:coalesce") == {'http': 'coalesce'}
+    with pytest.raises(ValueError):
+        output_sizes("db:x")
+    with pytest.raises(ValueError):
+        output_options("db")
+
+
+def test_channel_sizes():
+    assert channel_sizes("239.0.0.1:1234:16384 239.0.0.2:5000:0") == {
+        ('239.0.0.1', 1234): 16384, ('239.0.0.2', 5000): 0}
+    with pytest.raises(ValueError):
+        channel_sizes("239.0.0.1:1234")
+    with pytest.raises(ValueError):
+        channel_sizes("10.0.0.1:1234:16")
+
+
+def test_cpu_list():
+    assert cpu_list("4-6 1 5") == [1, 4, 5, 6]
+    with pytest.raises(ValueError):
+        cpu_list("1-")
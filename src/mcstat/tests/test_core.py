@@ -0,0 +1,125 @@
+from mcstat.core import drain, drain_timestamps, receive_buffer, worker, \
+    requested_buffer, loop_time, ReceiveOptions, ChannelUpdates
+from mcstat.domain import Aggr, Removal, Sample, Term, Tick
+from mcstat.net import enable_timestamps, has_recvmsg
+
+import pytest
+import socket
+import time
+
+try:
+    # Python 2
+    from Queue import Queue
+except ImportError:
+    # Python 3
+    from queue import Queue
+
+
+def make_socket_pair():
+    sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    receiver.setblocking(0)
+    return sender, receiver
+
+
+def test_drain():
+    sender, receiver = make_socket_pair()
+    for size in (10, 20, 30):
+        sender.send(b'x' * size)
+    aggr = drain(receiver, bytearray(4096))
+    assert (aggr.packets, aggr.bytes) == (3, 60)
+
+
+def test_drain_empty():
+    sender, receiver = make_socket_pair()
+    aggr = drain(receiver, bytearray(4096))
+    assert (aggr.packets, aggr.bytes) == (0, 0)
+
+
+def test_drain_limit():
+    sender, receiver = make_socket_pair()
+    for _ in range(5):
+        sender.send(b'x')
+    aggr = drain(receiver, bytearray(4096), limit=3)
+    assert aggr.packets == 3
+    aggr = drain(receiver, bytearray(4096), limit=3)
+    assert aggr.packets == 2
+
+
+def test_drain_counts_truncated_datagrams():
+    sender, receiver = make_socket_pair()
+    sender.send(b'x' * 5000)
+    aggr = drain(receiver, receive_buffer(ReceiveOptions()))
+    assert (aggr.packets, aggr.bytes) == (1, 5000)
+
+
+def test_channel_updates_latest():
+    updates = ChannelUpdates()
+    updates.send([('239.0.0.1', 1234)])
+    updates.send([('239.0.0.2', 1234)])
+    assert updates.take() == [('239.0.0.2', 1234)]
+    assert updates.take() is None
+
+
+def test_worker_removes_channel():
+    a, b = ('239.0.0.1', 1234), ('239.0.0.2', 1234)
+    queue_in, queue_out = Queue(), Queue()
+    for event in [Sample(0, a, Aggr(1, 100)), Sample(0, b, Aggr(2, 200)),
+                  Tick(1), Removal(1, a), Sample(1, b, Aggr(1, 100)),
+                  Tick(2), Term(2)]:
+        queue_in.put(event)
+    worker(1, queue_in, [queue_out])
+    events = [queue_out.get() for _ in range(queue_out.qsize())]
+    metrics = [(m.timestamp, m.channel, m.packets)
+               for e in events if e.is_batch() for m in e.metrics()]
+    assert sorted(metrics) == [(1, a, 1), (1, b, 2), (2, b, 1)]
+
+
+def test_worker_measures_interval():
+    a = ('239.0.0.1', 1234)
+    queue_in, queue_out = Queue(), Queue()
+    # The second tick is late.
+    for event in [Sample(0, a, Aggr(2, 256)), Tick(1, clock=11),
+                  Sample(1, a, Aggr(3, 256)), Tick(2, clock=12.5), Term(2)]:
+        queue_in.put(event)
+    worker(1, queue_in, [queue_out], window_start=10)
+    batches = [e for e in (queue_out.get() for _ in range(queue_out.qsize()))
+               if e.is_batch()]
+    assert [(b.interval, b.elapsed) for b in batches] == [(1, 1), (1, 1.5)]
+    assert [b.packets[0] for b in batches] == [2, 2]
+    assert [b.bitrate[0] for b in batches] == [2, 256 * 8 / 1024 / 1.5]
+
+
+@pytest.mark.skipif(not has_recvmsg, reason="requires recvmsg")
+def test_drain_timestamps():
+    sender, receiver = make_socket_pair()
+    enable_timestamps(receiver)
+    before = time.time()
+    sender.send(b'a' * 10)
+    sender.send(b'b' * 20)
+    after = time.time()
+    payloads = []
+    aggr = drain_timestamps(receiver, bytearray(4 * 65536), payloads=payloads)
+    assert (aggr.packets, aggr.bytes) == (2, 30)
+    assert [size for _, size in aggr.arrivals] == [10, 20]
+    assert all(before - 0.01 <= t <= after + 0.01 for t, _ in aggr.arrivals)
+    assert [bytes(p) for p in payloads] == [b'a' * 10, b'b' * 20]
+
+
+def test_loop_time():
+    a, b = ('239.0.0.1', 1234), ('239.0.0.2', 1234)
+    received = [(a, Aggr(1, 10, arrivals=[(5.5, 10)])),
+                (b, Aggr(2, 20, arrivals=[(5.75, 10), (5.8, 10)]))]
+    # The first kernel timestamp, not the clock.
+    assert loop_time(received, None, True) == 5.5
+    assert loop_time(received, 7, False) == 7
+    # Without datagrams, the clock is read.
+    before = time.time()
+    assert before <= loop_time([], None, True) <= time.time()
+
+
+def test_requested_buffer():
+    a, b = ('239.0.0.1', 1234), ('239.0.0.2', 1234)
+    assert requested_buffer([a], ReceiveOptions()) == 0
+    options = ReceiveOptions(receive_buffer=1000, channel_buffers={b: 5000})
+    assert requested_buffer([a], options) == 1000
+    assert requested_buffer([a, b], options) == 5000
@@ -0,0 +1,24 @@
+from mcstat.counters import SharedCounters
+
+
+def test_swap():
+    counters = SharedCounters(['a', 'b'])
+    counters.table.add(1, 3, 300)
+    counters.table.add(1, 1, 100)
+    channels, table = counters.swap()
+    assert channels == ['a', 'b']
+    assert list(table.packets) == [0, 4]
+    assert list(table.bytes) == [0, 400]
+    assert list(counters.table.packets) == [0, 0]
+    assert len(counters.table) == 2
+
+
+def test_set_channels():
+    counters = SharedCounters(['a', 'b', 'c'])
+    counters.table.add(0, 1, 100)
+    counters.table.add(2, 3, 300)
+    counters.set_channels(['c', 'd'])
+    channels, table = counters.swap()
+    assert channels == ['c', 'd']
+    assert list(table.packets) == [3, 0]
+    assert list(table.bytes) == [300, 0]
@@ -0,0 +1,208 @@
+from mcstat.core import worker
+from mcstat.domain import Aggr, MetricBatch, Sample, StreamEvent, Term, \
+    Tick
+from mcstat.health import read_drops, Health, MonitoredQueue, OutputQueue, \
+    ReceiverMonitor, ReceiverReport
+
+import os
+import socket
+import threading
+
+try:
+    # Python 2
+    from Queue import Queue
+except ImportError:
+    # Python 3
+    from queue import Queue
+
+A = ('239.0.0.1', 1234)
+B = ('239.0.0.2', 1234)
+
+HEADER = ("  sl  local_address rem_address   st tx_queue rx_queue tr tm->when "
+          "retrnsmt   uid  timeout inode ref pointer drops\n")
+
+
+def write_table(path, drops):
+    """Writes fake /proc/net/udp with drops of inodes."""
+    with open(path, 'w') as f:
+        f.write(HEADER)
+        for i, (inode, count) in enumerate(sorted(drops.items())):
+            f.write(" {}: 010000EF:04D2 00000000:0000 07 00000000:00000000 "
+                    "00:00000000 00000000     0        0 {} 2 "
+                    "0000000000000000 {}\n".format(i, inode, count))
+
+
+class FakeSocket(object):
+    def __init__(self, channels):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.channels = channels
+
+    def fileno(self):
+        return self.sock.fileno()
+
+
+def test_read_drops(tmpdir):
+    path = str(tmpdir.join('udp'))
+    write_table(path, {100: 0, 200: 7})
+    assert read_drops(path) == {100: 0, 200: 7}
+    assert read_drops(str(tmpdir.join('missing'))) is None
+
+
+def test_monitor_drops(tmpdir):
+    path = str(tmpdir.join('udp'))
+    monitor = ReceiverMonitor(path)
+    sock = FakeSocket([A, B])
+    inode = os.fstat(sock.fileno()).st_ino
+    monitor.register(sock)
+    write_table(path, {inode: 5})
+    monitor.loop(0.25)
+    monitor.loop(0.5)
+    report = monitor.take()
+    assert report.drops == {A: 5, B: 5}
+    # Datagrams of the shared socket are counted once.
+    assert report.total == 5
+    assert (report.loops, report.busy, report.longest) == (2, 0.75, 0.5)
+    # Counter wraps around.
+    write_table(path, {inode: 2})
+    assert monitor.take().drops == {A: (1 << 32) - 3, B: (1 << 32) - 3}
+    write_table(path, {inode: 2})
+    report = monitor.take()
+    assert (report.drops, report.loops) == ({}, 0)
+    # Closed socket is forgotten.
+    write_table(path, {})
+    monitor.take()
+    assert monitor.socks == {}
+
+
+def test_monitor_loops_concurrent(tmpdir):
+    monitor = ReceiverMonitor(str(tmpdir.join('missing')))
+    loops = 100000
+
+    def receive():
+        for _ in range(loops):
+            monitor.loop(0.0)
+    receiver = threading.Thread(target=receive)
+    receiver.start()
+    taken = 0
+    while receiver.is_alive():
+        taken += monitor.take().loops
+    receiver.join()
+    # No iteration is lost between reading and resetting counts.
+    assert taken + monitor.take().loops == loops
+
+
+def test_report_add():
+    report = ReceiverReport({A: 1}, 10, 0.5, 0.1)
+    report += ReceiverReport({A: 2, B: 2}, 5, 0.25, 0.2, total=2)
+    assert report.drops == {A: 3, B: 2}
+    assert report.total == 3
+    assert (report.loops, report.busy, report.longest) == (15, 0.75, 0.2)
+
+
+def test_queues():
+    queue = MonitoredQueue()
+    for i in range(3):
+        queue.put_nowait(i)
+    queue.get()
+    assert queue.take_high() == 3
+    assert queue.take_high() == 2
+
+    output = OutputQueue()
+    output.put(Tick(1))
+    output.put(Term(2))
+    output.get()
+    assert output.latency is None
+    output.get()
+    assert output.latency > 0
+
+
+def drain(queue):
+    events = []
+    while not queue.empty():
+        events.append(queue.get_nowait())
+    return events
+
+
+def fill(queue, intervals):
+    for now in intervals:
+        queue.put_nowait(MetricBatch(now, 1, (A,), [1.0], [1.0]))
+        queue.put_nowait(Tick(now))
+
+
+def test_output_queue_drop():
+    queue = OutputQueue(5, 'drop')
+    fill(queue, [1, 2])
+    queue.put_nowait(StreamEvent(2, A, 'down'))
+    fill(queue, [3])
+    # The oldest interval is dropped, the stream event remains.
+    assert [(e.timestamp, e.is_tick()) for e in drain(queue)] == [
+        (2, False), (2, True), (2, False), (3, False), (3, True)]
+    assert queue.take_dropped() == 1
+    assert queue.take_dropped() == 0
+
+
+def test_output_queue_coalesce():
+    queue = OutputQueue(6, 'coalesce')
+    fill(queue, [1, 2, 3, 4])
+    queue.put_nowait(Term(5))
+    assert [e.timestamp for e in drain(queue)] == [3, 3, 4, 4, 5]
+    assert queue.take_dropped() == 2
+
+
+def test_output_queue_join_after_overflow():
+    queue = OutputQueue(4, 'coalesce')
+    fill(queue, [1, 2, 3, 4])
+    for _ in drain(queue):
+        queue.task_done()
+    # Dropped events don't count as unfinished.
+    joined = threading.Thread(target=queue.join)
+    joined.daemon = True
+    joined.start()
+    joined.join(1)
+    assert not joined.is_alive()
+
+
+def test_health_samples():
+    queue = OutputQueue()
+    queue.put(Tick(1))
+    health = Health(2, {'stdout': queue, 'plain': Queue()})
+    drops = health.tick(3, ReceiverReport({A: 4}, 10, 0.5, 0.25))
+    assert drops == {A: 4}
+    samples = {(name, labels): value for name, labels, value
+               in health.samples}
+    assert samples == {
+        ('mcstat_queue_high_water', 'queue="stdout"'): 1,
+        ('mcstat_output_dropped_intervals', 'queue="stdout"'): 0,
+        ('mcstat_kernel_drops', ''): 4,
+        ('mcstat_receiver_loops', ''): 10,
+        ('mcstat_receiver_busy_ratio', ''): 0.25,
+        ('mcstat_receiver_loop_seconds_max', ''): 0.25,
+        }
+
+
+def test_health_shared_socket_drops(tmpdir):
+    path = str(tmpdir.join('udp'))
+    monitor = ReceiverMonitor(path)
+    sock = FakeSocket([A, B])
+    monitor.register(sock)
+    write_table(path, {os.fstat(sock.fileno()).st_ino: 5})
+    health = Health(1, monitor=monitor)
+    # Both channels are degraded, 5 datagrams were dropped.
+    assert health.tick(1) == {A: 5, B: 5}
+    assert ('mcstat_kernel_drops', '', 5) in health.samples
+
+
+def test_worker_marks_drops():
+    class FakeMonitor(object):
+        def take(self):
+            return ReceiverReport({A: 3})
+
+    queue_in, queue_out = Queue(), Queue()
+    for event in [Sample(0, A, Aggr(1, 100)), Sample(0, B, Aggr(2, 200)),
+                  Tick(1), Term(1)]:
+        queue_in.put(event)
+    worker(1, queue_in, [queue_out], health=Health(1, {}, FakeMonitor()))
+    events = [queue_out.get() for _ in range(queue_out.qsize())]
+    extras = {m.channel: m.extra for e in events if e.is_batch()
+              for m in e.metrics()}
+    assert extras == {A: {'drops': 3}, B: {}}
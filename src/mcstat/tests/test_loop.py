@@ -0,0 +1,72 @@
+from mcstat.clock import Window, monotonic
+from mcstat.counters import SharedCounters
+from mcstat.domain import Term, Tick
+from mcstat.main import InlineOutput
+
+import os
+import pytest
+import time
+
+try:
+    # Python 2
+    from Queue import Queue
+except ImportError:
+    # Python 3
+    from queue import Queue
+
+asyncio = pytest.importorskip('asyncio')
+
+from mcstat.loop import LoopEngine, run_loop  # noqa: E402
+
+A = ('239.0.0.1', 1234)
+
+
+def drain(queue):
+    events = []
+    while not queue.empty():
+        events.append(queue.get_nowait())
+    return events
+
+
+def test_tick():
+    loop = asyncio.new_event_loop()
+    queue = Queue()
+    counters = SharedCounters([A])
+    engine = LoopEngine(loop, 1, counters, [queue])
+    # Sockets were opened (see LoopEngine.start) 2 seconds ago.
+    engine.window = Window(monotonic() - 2)
+    counters.table.add(0, 4, 1024)
+    engine.index = 10
+    engine.tick(10)
+    batch, tick = drain(queue)
+    assert (batch.timestamp, batch.channels, batch.interval) == (10, (A,), 1)
+    # Measured since the start of the window, 2 seconds ago.
+    assert 2 <= batch.elapsed < 3
+    assert batch.counts.packets[0] == 4
+    assert tick.is_tick() and tick.timestamp == 10
+    # The next tick is scheduled, ticks missed since 10 are skipped.
+    assert 0 < engine.index - time.time() <= 1
+    assert counters.table.packets[0] == 0
+    loop.close()
+
+
+def test_run_loop_ends():
+    wake_up_fd, term_fd = os.pipe()
+    queue = Queue()
+    os.write(term_fd, b'\0')
+    run_loop(60, SharedCounters([]), wake_up_fd, [queue])
+    assert [e.is_term() for e in drain(queue)] == [True]
+    os.close(wake_up_fd)
+    os.close(term_fd)
+
+
+def test_inline_output():
+    events = []
+    closed = []
+    output = InlineOutput(events.append, lambda: closed.append(True))
+    output.put_nowait(Tick(1))
+    assert events[0].timestamp == 1
+    assert output.latency > 0
+    assert output.qsize() == 0
+    output.put_nowait(Term(2))
+    assert closed == [True] and len(events) == 1
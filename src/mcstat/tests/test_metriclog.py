@@ -0,0 +1,84 @@
+from mcstat.domain import Metric
+from mcstat.metriclog import MetricLogWriter, read_segments, segment_paths
+from mcstat.replay import replay
+
+import os
+
+try:
+    # Python 2
+    from Queue import Queue
+except ImportError:
+    # Python 3
+    from queue import Queue
+
+A = ('239.0.0.1', 1234)
+B = ('239.0.0.2', 1234)
+
+
+def write(directory, ticks, channels, extra=None, **kwargs):
+    writer = MetricLogWriter(directory, **kwargs)
+    for now in ticks:
+        writer.write([Metric(now, channel, 100.0, 10.0, dict(extra or {}),
+                             interval=1)
+                      for channel in channels], 1)
+    writer.close()
+
+
+def read(directory, *args):
+    return [(m.timestamp, m.channel, m.bitrate, m.extra)
+            for segment in read_segments(directory)
+            for m in segment.metrics(*args)]
+
+
+def test_write_read(tmpdir):
+    directory = str(tmpdir)
+    write(directory, [1, 2, 3], [A, B], {'cc_errors': 2, 'pid_bitrate': {}})
+    metrics = read(directory)
+    assert len(metrics) == 6
+    assert metrics[0] == (1, A, 100.0, {'cc_errors': 2})
+    assert [m[0] for m in read(directory, 2, 3)] == [2, 2]
+    assert read(directory, None, None, {B}) == \
+        [(now, B, 100.0, {'cc_errors': 2}) for now in (1, 2, 3)]
+
+
+def test_rotate(tmpdir):
+    directory = str(tmpdir)
+    writer = MetricLogWriter(directory)
+    writer.write([Metric(1, A, 1.0, 1.0)], 1)
+    writer.write([Metric(2, A, 1.0, 1.0), Metric(2, B, 1.0, 1.0)], 1)
+    writer.write([Metric(3, B, 1.0, 1.0, {'cc_errors': 1})], 1)
+    writer.close()
+    assert len(segment_paths(directory)) == 3
+    metrics = read(directory)
+    assert [m[1] for m in metrics] == [A, A, B, B]
+    assert metrics[-1][3] == {'cc_errors': 1}
+
+
+def test_incomplete_record(tmpdir):
+    directory = str(tmpdir)
+    write(directory, [1, 2], [A])
+    path, = segment_paths(directory)
+    with open(path, 'ab') as f:
+        f.write(b'\0' * 5)
+    assert [m[0] for m in read(directory)] == [1, 2]
+
+
+def test_max_bytes(tmpdir):
+    directory = str(tmpdir)
+    write(directory, range(100), [A], max_bytes=1500, segment_bytes=500)
+    assert sum(os.path.getsize(path)
+               for path in segment_paths(directory)) <= 1500 + 500
+    assert read(directory)[-1][0] == 99
+
+
+def test_replay(tmpdir):
+    directory = str(tmpdir)
+    write(directory, [1, 2, 3], [A, B])
+    queue = Queue()
+    assert replay(read_segments(directory), [queue], start=2) == 4
+    events = []
+    while not queue.empty():
+        events.append(queue.get_nowait())
+    assert [e.is_tick() for e in events] == [False, True, False, True, False]
+    assert [len(e) for e in events if e.is_batch()] == [2, 2]
+    assert events[-1].is_term()
@@ -1,6 +1,10 @@
 # import py.test
 
-from mcstat.net import is_multicast
+from mcstat.net import is_multicast, pktinfo_destination, cmsg_timestamp, \
+    set_receive_buffer, IP_PKTINFO, SO_TIMESTAMPNS
+
+import socket
+import struct
 
 
 def test_is_multicast():
@@ -8,3 +12,26 @@ def test_is_multicast():
     assert is_multicast("239.0.0.0")
     assert not is_multicast("240.0.0.0")
     assert not is_multicast("223.255.255.255")
+
+
+def test_pktinfo_destination():
+    pktinfo = struct.pack("=i4s4s", 2, socket.inet_aton("10.0.0.1"),
+                          socket.inet_aton("239.0.0.1"))
+    ancdata = [(socket.IPPROTO_IP, IP_PKTINFO, pktinfo)]
+    assert pktinfo_destination(ancdata) == socket.inet_aton("239.0.0.1")
+    assert pktinfo_destination([]) is None
+
+
+def test_cmsg_timestamp():
+    timespec = struct.pack("@ll", 1500000000, 250000000)
+    ancdata = [(socket.SOL_SOCKET, SO_TIMESTAMPNS, timespec)]
+    assert cmsg_timestamp(ancdata) == 1500000000.25
+    assert cmsg_timestamp([]) is None
+
+
+def test_set_receive_buffer():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    effective = set_receive_buffer(sock, 65536)
+    assert effective == sock.getsockopt(socket.SOL_SOCKET,
+                                        socket.SO_RCVBUF)
+    assert effective >= 65536
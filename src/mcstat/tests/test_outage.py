@@ -0,0 +1,38 @@
+from mcstat.outage import OutageDetector
+
+A = ('239.0.0.1', 1234)
+B = ('239.0.0.2', 1234)
+
+
+def states(events):
+    return [(e.channel, e.state, e.last_seen) for e in events]
+
+
+def test_down_and_up():
+    detector = OutageDetector(0.1, [A, B], now=0.0)
+    assert detector.check([A, B], 0.05) == []
+    assert detector.timeout(0.05) == 0.1 - 0.05
+    # Deadline passed, but A and B received datagrams since.
+    assert detector.check([A], 0.12) == []
+    assert states(detector.check([], 0.2)) == [(B, 'down', 0.05)]
+    assert states(detector.check([], 0.25)) == [(A, 'down', 0.12)]
+    assert detector.timeout(0.25) == -1
+    assert states(detector.check([B], 0.3)) == [(B, 'up', None)]
+    assert detector.check([], 0.35) == []
+
+
+def test_never_started():
+    detector = OutageDetector(0.1, [A], now=0.0)
+    assert states(detector.check([], 0.1)) == [(A, 'down', None)]
+
+
+def test_add_and_remove():
+    detector = OutageDetector(0.1, [A], now=0.0)
+    detector.remove([A])
+    detector.add([B], 0.05)
+    assert detector.check([], 0.1) == []
+    assert states(detector.check([], 0.16)) == [(B, 'down', None)]
+    # Re-added channel starts again.
+    detector.add([B], 0.2)
+    assert detector.check([], 0.25) == []
+    assert states(detector.check([], 0.31)) == [(B, 'down', None)]
@@ -0,0 +1,51 @@
+from mcstat.backend.console import ConsoleOutput
+from mcstat.domain import Term, Tick
+from mcstat.output import Output, builtin, load_output, output_names, run
+
+import os
+import pytest
+import re
+
+try:
+    # Python 2
+    from Queue import Queue
+except ImportError:
+    # Python 3
+    from queue import Queue
+
+
+class ListOutput(Output):
+    def __init__(self):
+        self.events = []
+        self.closed = False
+
+    def handle(self, event):
+        self.events.append(event)
+
+    def close(self):
+        self.closed = True
+
+
+def test_load_output():
+    assert {'db', 'stdout', 'http', 'metriclog'} <= set(output_names())
+    assert load_output('stdout') is ConsoleOutput
+    with pytest.raises(ValueError):
+        load_output('nothing')
+
+
+def test_run():
+    queue = Queue()
+    output = ListOutput()
+    queue.put(Tick(1))
+    queue.put(Term(2))
+    run(queue, output)
+    assert [e.timestamp for e in output.events] == [1]
+    assert output.closed
+
+
+def test_builtin_outputs_match_setup():
+    setup = os.path.join(os.path.dirname(__file__), '..', '..', 'setup.py')
+    with open(setup) as f:
+        outputs = f.read().split("'mcstat.outputs': [")[1].split(']')[0]
+    declared = re.findall(r"'(\w+) = ([\w.]+:\w+)'", outputs)
+    assert dict(declared) == builtin
@@ -0,0 +1,99 @@
+from mcstat.pcap import datagrams, packets, read_capture, \
+    LINKTYPE_ETHERNET, LINKTYPE_LINUX_SLL
+
+import socket
+import struct
+
+try:
+    # Python 2
+    from Queue import Queue
+except ImportError:
+    # Python 3
+    from queue import Queue
+
+A = ('239.0.0.1', 1234)
+B = ('239.0.0.2', 1234)
+
+
+def udp_packet(channel, payload, vlan=False, fragment=0):
+    ip, port = channel
+    udp = struct.pack('>HHHH', 5000, port, 8 + len(payload), 0) + payload
+    header = struct.pack('>BBHHHBBH4s4s', 0x45, 0, 20 + len(udp), 0,
+                         fragment, 64, 17, 0, socket.inet_aton('10.0.0.1'),
+                         socket.inet_aton(ip))
+    ethernet = b'\x01\x00\x5e\x00\x00\x01' + b'\x02' * 6
+    if vlan:
+        ethernet += struct.pack('>HH', 0x8100, 10)
+    return ethernet + struct.pack('>H', 0x0800) + header + udp
+
+
+def pcap(records, linktype=LINKTYPE_ETHERNET):
+    data = struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, linktype)
+    for timestamp, packet in records:
+        data += struct.pack('<IIII', int(timestamp),
+                            int(round(timestamp % 1 * 1e6)), len(packet),
+                            len(packet)) + packet
+    return data
+
+
+def pcapng(records):
+    def block(block_type, body):
+        body += b'\0' * (-len(body) % 4)
+        length = len(body) + 12
+        return struct.pack('<II', block_type, length) + body + \
+            struct.pack('<I', length)
+    data = block(0x0a0d0d0a, struct.pack('<IHHq', 0x1a2b3c4d, 1, 0, -1))
+    # Nanosecond timestamps.
+    data += block(1, struct.pack('<HHIHHB3xHH', LINKTYPE_ETHERNET, 0, 65535,
+                                 9, 1, 9, 0, 0))
+    for timestamp, packet in records:
+        ns = int(round(timestamp * 1e9))
+        data += block(6, struct.pack('<IIIII', 0, ns >> 32, ns & 0xffffffff,
+                                     len(packet), len(packet)) + packet)
+    return data
+
+
+def test_datagrams():
+    data = pcap([(1.5, udp_packet(A, b'x' * 100)),
+                 (1.625, udp_packet(B, b'y' * 10)),
+                 (1.75, udp_packet(('239.0.0.3', 1234), b'z')),
+                 (1.875, udp_packet(A, b'x' * 50, vlan=True)),
+                 # Not the first fragment.
+                 (1.9, udp_packet(A, b'x' * 50, fragment=100))])
+    found = list(datagrams(data, [A, B]))
+    assert [(t, c, size) for t, c, size, _, _ in found] == \
+        [(1.5, A, 100), (1.625, B, 10), (1.875, A, 50)]
+    _, _, _, offset, length = found[1]
+    assert data[offset:offset + length] == b'y' * 10
+
+
+def test_pcapng():
+    data = pcapng([(1000.000000001, udp_packet(A, b'x' * 100))])
+    (timestamp, linktype, _, _), = packets(data)
+    assert linktype == LINKTYPE_ETHERNET
+    assert abs(timestamp - 1000.000000001) < 1e-6
+    assert [size for _, _, size, _, _ in datagrams(data, [A])] == [100]
+
+
+def test_linux_sll():
+    packet = udp_packet(A, b'x' * 10)[14:]
+    sll = struct.pack('>HHH8sH', 0, 1, 6, b'', 0x0800) + packet
+    data = pcap([(1, sll)], LINKTYPE_LINUX_SLL)
+    assert [size for _, _, size, _, _ in datagrams(data, [A])] == [10]
+
+
+def test_read_capture():
+    data = pcap([(10.1, udp_packet(A, b'x' * 100)),
+                 (10.2, udp_packet(A, b'x' * 100)),
+                 (12.5, udp_packet(B, b'x' * 10))])
+    queue = Queue()
+    assert read_capture(data, [A, B], 1, 10.0, queue) == 3
+    events = []
+    while not queue.empty():
+        events.append(queue.get_nowait())
+    assert [(e.timestamp, e.is_tick()) for e in events] == \
+        [(11, False), (11, True), (12, True), (13, False), (13, True),
+         (13, False)]
+    assert events[0].aggr.packets == 2
+    assert events[0].aggr.bytes == 200
+    assert events[-1].is_term()
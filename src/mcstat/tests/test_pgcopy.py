@@ -0,0 +1,28 @@
+import datetime
+
+from mcstat.backend.pgcopy import copy_statement, copy_data
+
+
+def test_copy_statement():
+    sql = """insert into stats (ts, bitrate)
+             values (%(timestamp)s, %(bitrate)s);"""
+    assert copy_statement(sql) == (
+        "copy stats (ts, bitrate) from stdin", ['timestamp', 'bitrate'])
+
+
+def test_not_copy_statement():
+    assert copy_statement("update channels set bitrate = %(bitrate)s") is None
+    assert copy_statement(
+        "insert into stats (ts, n) values (%(timestamp)s, 1)") is None
+    assert copy_statement(
+        "insert into stats (ts) values (%(timestamp)s, %(ip)s)") is None
+
+
+def test_copy_data():
+    rows = [{'timestamp': datetime.datetime(2020, 1, 2, 3, 4, 5),
+             'bitrate': 0.1,
+             'pids': '{"a":\t"\\\\"}'},
+            {'bitrate': 2.0}]
+    assert copy_data(rows, ['timestamp', 'bitrate', 'pids']) == (
+        '2020-01-02 03:04:05\t0.1\t{"a":\\t"\\\\\\\\"}\n'
+        '\\N\t2.0\t\\N\n')
@@ -0,0 +1,72 @@
+from mcstat.backend.prometheus import render, make_server, HttpOutput
+from mcstat.domain import Metric, MetricBatch, StreamEvent, Term, Tick
+from mcstat.output import run
+
+import threading
+
+try:
+    # Python 2
+    from Queue import Queue
+    from urllib2 import urlopen
+except ImportError:
+    # Python 3
+    from queue import Queue
+    from urllib.request import urlopen
+
+A = ('239.0.0.1', 1234)
+B = ('239.0.0.2', 1234)
+
+
+def test_render():
+    batch = MetricBatch.of(1, 1, [
+        Metric(1, A, 100.0, 10.0, {'cc_errors': 2,
+                                   'pid_bitrate': {256: 50.0}}),
+        Metric(1, B, 0.0, 0.0)])
+    lines = render([batch], down={B}, timestamp=1.5,
+                   samples=[('mcstat_kernel_drops', '', 3)],
+                   alerts=[(B, 'no_packets')]).decode().splitlines()
+    assert '# TYPE mcstat_bitrate_kbps gauge' in lines
+    assert 'mcstat_bitrate_kbps{ip="239.0.0.1",port="1234"} 100.0' in lines
+    assert 'mcstat_channel_up{ip="239.0.0.1",port="1234"} 1.0' in lines
+    assert 'mcstat_channel_up{ip="239.0.0.2",port="1234"} 0.0' in lines
+    assert 'mcstat_cc_errors{ip="239.0.0.1",port="1234"} 2.0' in lines
+    assert 'mcstat_pid_bitrate{ip="239.0.0.1",port="1234",key="256"} 50.0' \
+        in lines
+    assert 'mcstat_last_tick_timestamp_seconds 1.5' in lines
+    assert 'mcstat_kernel_drops 3.0' in lines
+    assert 'mcstat_alert{ip="239.0.0.2",port="1234",rule="no_packets"} 1.0' \
+        in lines
+
+
+def test_render_escapes_labels():
+    batch = MetricBatch.of(1, 1, [Metric(1, A, 1.0, 1.0,
+                                         {'pid_bitrate': {'a"b': 1.0}})])
+    lines = render([batch], queues={'out\\1': Queue()},
+                   alerts=[(A, 'low\nbitrate')]).decode().splitlines()
+    assert 'mcstat_pid_bitrate{ip="239.0.0.1",port="1234",key="a\\"b"} 1.0' \
+        in lines
+    assert 'mcstat_queue_size{queue="out\\\\1"} 0.0' in lines
+    assert 'mcstat_alert{ip="239.0.0.1",port="1234",rule="low\\nbitrate"} ' \
+        '1.0' in lines
+
+
+def test_output():
+    queue = Queue()
+    server = make_server(('127.0.0.1', 0))
+    thread = threading.Thread(target=run, args=(queue, HttpOutput(
+        server, {'test': queue})))
+    thread.start()
+    try:
+        queue.put(MetricBatch.of(1, 1, [Metric(1, A, 100.0, 10.0)]))
+        queue.put(StreamEvent(1, A, 'down'))
+        queue.put(Tick(1))
+        queue.join()
+        url = 'http://127.0.0.1:{}/metrics'.format(server.server_address[1])
+        body = urlopen(url).read().decode()
+        assert 'mcstat_bitrate_kbps{ip="239.0.0.1",port="1234"} 100.0' \
+            in body
+        assert 'mcstat_channel_up{ip="239.0.0.1",port="1234"} 0.0' in body
+        assert 'mcstat_queue_size{queue="test"} 0.0' in body
+    finally:
+        queue.put(Term(2))
+        thread.join()
@@ -0,0 +1,144 @@
+from mcstat.analyzer.ts import TsStats
+from mcstat.burst import Buckets, BurstSummary, bucket_layout
+from mcstat.domain import StreamEvent, Term, Tick
+from mcstat.rollup import Rollup, make_rollups, rollup_extra
+from mcstat.stat import batch
+
+from collections import Counter
+
+try:
+    # Python 2
+    from Queue import Queue
+except ImportError:
+    # Python 3
+    from queue import Queue
+
+A = ('239.0.0.1', 1234)
+B = ('239.0.0.2', 1234)
+
+
+def drain(queue):
+    events = []
+    while not queue.empty():
+        events.append(queue.get_nowait())
+    return events
+
+
+def send_interval(rollup, now, channels, extras=None):
+    rollup.put_nowait(batch(now, 1, [channel for channel, _ in channels],
+                            [1] * len(channels),
+                            [num_bytes for _, num_bytes in channels],
+                            extras))
+    rollup.put_nowait(Tick(now))
+
+
+def metrics(event):
+    return {m.channel: m for m in event.metrics()}
+
+
+def test_rollup():
+    queue = Queue()
+    rollup = Rollup(1, 3, [queue])
+    send_interval(rollup, 1, [(A, 128), (B, 256)])
+    send_interval(rollup, 2, [(A, 128)])
+    assert drain(queue) == []
+    send_interval(rollup, 3, [(A, 128)])
+    events = drain(queue)
+    assert [e.is_tick() for e in events] == [False, True]
+    m = metrics(events[0])
+    assert m[A].timestamp == 3
+    assert m[A].interval == 3
+    assert m[A].packets == 1
+    assert m[A].bitrate == 1
+    assert m[B].packets == 1.0 / 3
+
+
+def test_rollup_measured_intervals():
+    queue = Queue()
+    rollup = Rollup(0.5, 2, [queue])
+    for now, elapsed in [(0.5, 0.5), (1.0, 0.75)]:
+        rollup.put_nowait(batch(now, 0.5, [A], [5], [160], elapsed=elapsed))
+        rollup.put_nowait(Tick(now))
+    event = drain(queue)[0]
+    assert (event.interval, event.elapsed) == (1, 1.25)
+    assert event.packets == [8]
+    assert event.bitrate == [2]
+
+
+def test_rollup_aligned():
+    queue = Queue()
+    rollup = Rollup(0.25, 4, [queue])
+    for index in range(2, 9):
+        send_interval(rollup, index * 0.25, [(A, 128)])
+    events = drain(queue)
+    assert [(e.timestamp, e.interval) for e in events if e.is_batch()] == [
+        (1.0, 0.75), (2.0, 1.0)]
+
+
+def test_rollup_same_channels():
+    queue = Queue()
+    rollup = Rollup(1, 2, [queue])
+    send_interval(rollup, 1, [(A, 128), (B, 256)])
+    send_interval(rollup, 2, [(A, 384), (B, 256)])
+    m = metrics(drain(queue)[0])
+    assert (m[A].bitrate, m[B].bitrate) == (2, 2)
+
+
+def test_rollup_extras():
+    layout = bucket_layout(1, 500)
+    queue = Queue()
+    rollup = Rollup(1, 2, [queue])
+    for now in (1, 2):
+        buckets = Buckets(now - 1, layout)
+        buckets.add(now - 0.75, 128 * now)
+        send_interval(rollup, now, [(A, 128 * now), (B, 0)],
+                      [{'burst': buckets}, None])
+    m = metrics(drain(queue)[0])
+    assert m[A].extra['burst_bytes'] == 256
+    assert m[B].extra == {}
+
+
+def test_rollup_extra_keeps_batch():
+    first = {'ts': TsStats(cc_errors=1, pid_packets=Counter({17: 2})),
+             'burst': BurstSummary(0.1, 1, 0, 10, 5, 9)}
+    second = {'ts': TsStats(cc_errors=2, pid_packets=Counter({17: 3})),
+              'burst': BurstSummary(0.1, 1, 0, 20, 5, 19)}
+    extra = rollup_extra(rollup_extra(None, first), second)
+    assert extra['ts'].cc_errors == 3
+    assert extra['ts'].pid_packets == {17: 5}
+    assert extra['burst'].intervals == 2
+    # Statistics of the batches, which other outputs also received, remain.
+    assert first['ts'].cc_errors == 1
+    assert first['ts'].pid_packets == {17: 2}
+    assert first['burst'].intervals == 1
+
+
+def test_rollup_term():
+    queue = Queue()
+    rollup = Rollup(1, 60, [queue])
+    send_interval(rollup, 1, [(A, 128)])
+    rollup.put_nowait(StreamEvent(1.5, A, 'down'))
+    send_interval(rollup, 2, [])
+    rollup.put_nowait(Term(2.5))
+    events = drain(queue)
+    assert events[0].is_stream_event()
+    assert events[1].interval == 2
+    assert events[1].timestamp == 2
+    assert events[2].is_term()
+
+
+def test_make_rollups():
+    second, minute, hour = Queue(), Queue(), Queue()
+    queues = make_rollups(1, [(second, 1), (hour, 3600), (minute, 60)])
+    assert queues[0] is second
+    assert queues[1].factor == 60
+    assert queues[1].queues_out[0] is minute
+    assert queues[1].queues_out[1].factor == 60
+    assert queues[1].queues_out[1].queues_out == [hour]
+    for now in range(1, 3601):
+        send_interval(queues[1], now, [(A, 128)])
+    assert len(drain(minute)) == 120
+    events = drain(hour)
+    assert len(events) == 2
+    assert events[0].interval == 3600
+    assert metrics(events[0])[A].bitrate == 1
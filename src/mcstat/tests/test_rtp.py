@@ -0,0 +1,74 @@
+from mcstat.analyzer.rtp import RtpAnalyzer, RtpStats, CLOCK_RATE, WINDOW
+
+import struct
+
+
+def rtp_packet(seq, timestamp=0):
+    return struct.pack(">BBHII", 0x80, 33, seq & 0xffff,
+                       timestamp & 0xffffffff, 1)
+
+
+def feed(analyzer, seqs, arrivals=None):
+    datagrams = [rtp_packet(seq) for seq in seqs]
+    return analyzer.feed(datagrams, arrivals or [0.0] * len(datagrams))
+
+
+def test_in_order():
+    stats = feed(RtpAnalyzer(), range(65530, 65550))
+    assert (stats.lost, stats.reordered, stats.duplicates) == (0, 0, 0)
+
+
+def test_reordered_and_duplicate():
+    stats = feed(RtpAnalyzer(), [1, 2, 4, 3, 3, 5])
+    assert (stats.lost, stats.reordered, stats.duplicates) == (0, 1, 1)
+
+
+def test_lost_after_window():
+    analyzer = RtpAnalyzer()
+    stats = feed(analyzer, [1, 2, 5])
+    assert stats.lost == 0
+    stats = feed(analyzer, range(6, 6 + WINDOW))
+    assert stats.lost == 2
+
+
+def test_restart():
+    stats = feed(RtpAnalyzer(), [1, 2, 20000, 20001])
+    assert (stats.lost, stats.reordered, stats.duplicates) == (0, 0, 0)
+
+
+def test_single_jump_ignored():
+    # A stray packet far from the stream doesn't restart it: 3 is lost.
+    seqs = [1, 2, 20000] + list(range(4, 4 + WINDOW))
+    stats = feed(RtpAnalyzer(), seqs)
+    assert (stats.lost, stats.reordered, stats.duplicates) == (1, 0, 0)
+
+
+def test_invalid():
+    stats = RtpAnalyzer().feed([b'\x47' * 188, b'\x80'], [0.0, 0.0])
+    assert (stats.packets, stats.invalid) == (0, 2)
+
+
+def test_jitter():
+    analyzer = RtpAnalyzer()
+    # Packets sent every 10 ms, the second one arrives 1 ms late.
+    step = CLOCK_RATE // 100
+    datagrams = [rtp_packet(seq, seq * step) for seq in range(3)]
+    stats = analyzer.feed(datagrams, [0.0, 0.011, 0.020])
+    assert abs(stats.fields(1)['rtp_jitter'] - (1 / 16.0 + 15 / 256.0)) < 1e-6
+
+
+def test_in_order_batches():
+    # Batches after the first one use fast path, which must give the same
+    # results as processing packets one by one.
+    fast, slow = RtpAnalyzer(), RtpAnalyzer()
+    step = CLOCK_RATE // 100
+    for batch in range(5):
+        seqs = range(65500 + batch * 10, 65500 + batch * 10 + 10)
+        datagrams = [rtp_packet(seq, seq * step) for seq in seqs]
+        arrivals = [seq * 0.01 + (seq % 3) * 0.001 for seq in seqs]
+        a = fast.feed(datagrams, arrivals)
+        b = RtpStats()
+        for datagram, arrival in zip(datagrams, arrivals):
+            slow.feed_one(b, datagram, arrival)
+        assert (a.packets, a.lost) == (b.packets, b.lost)
+        assert abs(fast.jitter - slow.jitter) < 1e-6
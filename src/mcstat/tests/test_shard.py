@@ -0,0 +1,26 @@
+from mcstat.counters import CounterTable
+from mcstat.shard import partition, Shard
+
+import multiprocessing
+
+
+def test_partition():
+    channels = [('239.0.0.{}'.format(i), 1234) for i in range(5)]
+    shards = partition(channels, 2)
+    assert [[slot for slot, _ in shard] for shard in shards] == \
+        [[0, 2, 4], [1, 3]]
+    assert shards[1][0] == (1, channels[1])
+
+
+def test_partition_more_shards_than_channels():
+    assert len(partition([('239.0.0.1', 1234)], 8)) == 1
+
+
+def test_add_snapshot():
+    shard = Shard('test', [(1, ('239.0.0.1', 1234)), (3, ('239.0.0.2', 1234))])
+    shard.conn, child_conn = multiprocessing.Pipe()
+    child_conn.send(([2, 5], [200, 500], [None, None], None, None))
+    table = CounterTable(4)
+    shard.add_snapshot_to(table)
+    assert list(table.packets) == [0, 2, 0, 5]
+    assert list(table.bytes) == [0, 200, 0, 500]
@@ -0,0 +1,40 @@
+import datetime
+import os
+
+from mcstat.spool import Spool
+
+
+def test_replay_oldest_first(tmpdir):
+    spool = Spool(str(tmpdir.join('spool')), 1 << 20, segment_bytes=1)
+    spool.append([{'timestamp': datetime.datetime(2020, 1, 1), 'ip': 'a'}])
+    spool.append([{'ip': 'b'}, {'ip': 'c'}])
+    assert len(spool) == 2
+    segment, batches = spool.oldest()
+    assert batches == [[{'timestamp': datetime.datetime(2020, 1, 1),
+                         'ip': 'a'}]]
+    spool.remove(segment)
+    # Segments left by previous run.
+    spool = Spool(str(tmpdir.join('spool')), 1 << 20)
+    spool.append([{'ip': 'd'}])
+    assert spool.oldest()[1] == [[{'ip': 'b'}, {'ip': 'c'}]]
+    assert len(spool) == 2
+
+
+def test_size_limit(tmpdir):
+    spool = Spool(str(tmpdir), 300, segment_bytes=100)
+    for i in range(10):
+        spool.append([{'ip': 'x' * 50, 'n': i}])
+    assert spool.size() <= 300
+    assert spool.dropped > 0
+    segment, batches = spool.oldest()
+    assert batches[0][0]['n'] == spool.dropped
+
+
+def test_incomplete_batch(tmpdir):
+    spool = Spool(str(tmpdir), 1 << 20)
+    spool.append([1])
+    spool.append([2])
+    path = spool.path(spool.segments[0])
+    with open(path, 'rb+') as f:
+        f.truncate(os.path.getsize(path) - 1)
+    assert spool.oldest()[1] == [[1]]
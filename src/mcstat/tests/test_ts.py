@@ -0,0 +1,71 @@
+from mcstat.analyzer.ts import TsAnalyzer, ts_payload, NULL_PID
+
+import struct
+
+
+def ts_packet(pid, cc, payload=True, tei=False, sync=0x47,
+              discontinuity=False):
+    afc = 0x10 if payload else 0
+    adaptation = b''
+    if discontinuity:
+        afc |= 0x20
+        adaptation = b'\x01\x80'
+    header = struct.pack(">BHB", sync, (0x8000 if tei else 0) | pid,
+                         afc | cc) + adaptation
+    return header + b'\xff' * (188 - len(header))
+
+
+def feed(analyzer, *packets):
+    return analyzer.feed([b''.join(packets)])
+
+
+def test_continuous():
+    stats = feed(TsAnalyzer(), *[ts_packet(0x100, cc % 16)
+                                 for cc in range(20)])
+    assert stats.cc_errors == 0
+    assert stats.pid_packets == {0x100: 20}
+
+
+def test_cc_gap():
+    stats = feed(TsAnalyzer(), ts_packet(0x100, 0), ts_packet(0x100, 1),
+                 ts_packet(0x100, 3))
+    assert stats.cc_errors == 1
+
+
+def test_cc_per_pid():
+    stats = feed(TsAnalyzer(), ts_packet(0x100, 0), ts_packet(0x101, 7),
+                 ts_packet(0x100, 1), ts_packet(0x101, 8),
+                 ts_packet(NULL_PID, 0), ts_packet(NULL_PID, 0))
+    assert stats.cc_errors == 0
+    assert stats.pid_packets == {0x100: 2, 0x101: 2, NULL_PID: 2}
+
+
+def test_cc_allowed():
+    stats = feed(TsAnalyzer(),
+                 ts_packet(0x100, 0),
+                 ts_packet(0x100, 0),  # duplicate
+                 ts_packet(0x100, 0, payload=False),
+                 ts_packet(0x100, 9, discontinuity=True))
+    assert stats.cc_errors == 0
+
+
+def test_cc_between_feeds():
+    analyzer = TsAnalyzer()
+    feed(analyzer, ts_packet(0x100, 14))
+    assert feed(analyzer, ts_packet(0x100, 15)).cc_errors == 0
+    assert feed(analyzer, ts_packet(0x100, 2)).cc_errors == 1
+
+
+def test_errors():
+    stats = feed(TsAnalyzer(), ts_packet(0x100, 0),
+                 ts_packet(0x100, 5, tei=True), ts_packet(0x100, 9, sync=0),
+                 ts_packet(0x100, 1))
+    assert (stats.sync_errors, stats.tei_errors, stats.cc_errors) == (1, 1, 0)
+    assert stats.fields(1)['pid_bitrate'] == {0x100: 2 * 188 * 8 / 1024.0}
+
+
+def test_rtp_payload():
+    rtp = b'\x80\x21\x00\x01' + b'\x00' * 8
+    assert ts_payload(rtp + ts_packet(0x100, 0)) == ts_packet(0x100, 0)
+    assert ts_payload(ts_packet(0x100, 0) + b'\x47\x00') == \
+        ts_packet(0x100, 0)
@@ -6,10 +6,19 @@ setup(name='mcstat',
       author='Maciej Starzyk',
       author_email='mstarzyk@gmail.com',
       url='https://github.com/mstarzyk/mcstat',
-      packages=['mcstat', 'mcstat.tests', 'mcstat.backend'],
+      packages=['mcstat', 'mcstat.tests', 'mcstat.backend',
+                'mcstat.analyzer'],
       entry_points={
           'console_scripts': [
               'mcstat = mcstat.main:main',
+              'mcstat-replay = mcstat.replay:main',
+          ],
+          # Outputs (see mcstat.output), other distributions can add more.
+          'mcstat.outputs': [
+              'db = mcstat.backend.db:DbOutput',
+              'stdout = mcstat.backend.console:ConsoleOutput',
+              'http = mcstat.backend.prometheus:HttpOutput',
+              'metriclog = mcstat.backend.metriclog:MetricLog',
           ],
       }
       )